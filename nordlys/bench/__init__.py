@@ -0,0 +1,6 @@
+"""
+Benchmarks
+==========
+
+Tools for measuring the performance of nordlys: a generator of synthetic data and a runner for end-to-end benchmarks of the services.
+"""
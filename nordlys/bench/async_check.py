@@ -0,0 +1,215 @@
+"""
+Async Check
+===========
+
+Checks that async retrieval (:func:`Retrieval.retrieve_async <nordlys.core.retrieval.retrieval.Retrieval.retrieve_async>`)
+processes queries concurrently and gives the same results as synchronous retrieval, without an Elasticsearch server.
+
+  - :class:`LocalAsyncElasticsearch` is an async Elasticsearch client (the subset of the API used by
+    :class:`~nordlys.core.retrieval.elastic_async.AsyncElastic`) that serves the requests from a
+    :py:mod:`local index <nordlys.core.retrieval.local_index>`, after a simulated network latency. It keeps track of
+    the number of requests in flight.
+  - The queries of :py:mod:`synthetic data <nordlys.bench.data_generator>` are retrieved concurrently using
+    :class:`~nordlys.core.retrieval.elastic_async.AsyncElasticCache` over the fake client, and synchronously using the
+    local index. The check fails if
+
+      - no two requests were ever in flight at the same time,
+      - any synchronous (blocking) Elasticsearch request was made, or
+      - the results differ.
+
+Usage
+-----
+
+::
+
+  python -m nordlys.bench.async_check [-m <model>] [-q <num_queries>] [-c <num_concurrent>] [-l <latency>]
+"""
+
+import argparse
+import asyncio
+import shutil
+import sys
+import tempfile
+
+from nordlys.config import PLOGGER
+from nordlys.core.utils import timing
+
+MODEL_CONFIGS = {
+    "lm": {"model": "lm", "fields": "catchall"},
+    "mlm": {"model": "mlm", "fields": {"names": 0.2, "catchall": 0.8}},
+    "prms": {"model": "prms", "fields": ["names", "categories", "catchall"]},
+    "bm25f": {"model": "bm25f", "fields": {"names": 0.2, "catchall": 0.8}}
+}
+
+
+class _Indices(object):
+    """Indices API of :class:`LocalAsyncElasticsearch`."""
+
+    def __init__(self, client):
+        self.__client = client
+
+    async def analyze(self, index, body):
+        return await self.__client.request(self.__client.analyze, body)
+
+
+class LocalAsyncElasticsearch(object):
+    """Async Elasticsearch client serving the requests from a local index (after a simulated latency)."""
+
+    def __init__(self, local_index, latency=0.01):
+        """
+        :param local_index: LocalIndex object
+        :param latency: simulated latency of each request (in seconds)
+        """
+        self.__index = local_index
+        self.__latency = latency
+        self.indices = _Indices(self)
+        self.num_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, func, *args):
+        """Serves a request after the simulated latency."""
+        self.num_requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.__latency)
+            return func(*args)
+        finally:
+            self.in_flight -= 1
+
+    # =========================================
+    # ============ Local responses ============
+    # =========================================
+    def analyze(self, body):
+        analyzed = self.__index.analyze_query(body["text"], body["analyzer"])
+        return {"tokens": [{"token": t, "position": i} for i, t in enumerate(analyzed.split())]}
+
+    @staticmethod
+    def __hits(results):
+        return {"hits": {"hits": [{"_id": doc_id, "_score": res["score"]} for doc_id, res in results.items()]}}
+
+    def __search(self, body):
+        """Serves the term queries of collection stats lookups; see :func:`Elastic._coll_tv_search_body`."""
+        field, term = next(iter(body["query"]["bool"]["must"]["term"].items()))
+        if self.__index.doc_freq(term, field) == 0:
+            return self.__hits({})
+        return self.__hits(self.__index.search(term, field, num=1))
+
+    def __termvectors(self, doc_id, fields, term_stats):
+        doc_tvs = {}
+        for field in fields:
+            terms = {}
+            for term, tf in self.__index.term_freqs(doc_id, field).items():
+                terms[term] = {"term_freq": tf}
+                if term_stats:
+                    terms[term].update({"doc_freq": self.__index.doc_freq(term, field),
+                                        "ttf": self.__index.coll_term_freq(term, field)})
+            if len(terms) > 0:
+                doc_tvs[field] = {"terms": terms}
+        return {"_id": doc_id, "found": True, "term_vectors": doc_tvs}
+
+    # =========================================
+    # ================== API ==================
+    # =========================================
+    async def search(self, index, q=None, df=None, body=None, size=10, from_=0, **kwargs):
+        if body is not None:
+            return await self.request(self.__search, body)
+        return await self.request(lambda: self.__hits(self.__index.search(q, df, num=size, start=from_)))
+
+    async def msearch(self, index, body, **kwargs):
+        return await self.request(lambda: {"responses": [self.__search(b) for b in body[1::2]]})
+
+    async def count(self, index, **kwargs):
+        return await self.request(lambda: {"count": self.__index.num_docs()})
+
+    async def field_stats(self, index, fields):
+        fields = None if fields == "*" else fields.split(",")
+        return await self.request(lambda: {"indices": {"_all": {"fields": self.__index.get_all_field_stats(fields)}}})
+
+    async def mtermvectors(self, index, ids=None, fields=None, term_statistics=False, body=None, **kwargs):
+        if body is not None:
+            return await self.request(lambda: {"docs": [self.__termvectors(doc["_id"], doc["fields"],
+                                                                           doc.get("term_statistics", False))
+                                                        for doc in body["docs"]]})
+        return await self.request(lambda: {"docs": [self.__termvectors(doc_id, fields.split(","), term_statistics)
+                                                    for doc_id in ids.split(",")]})
+
+
+def check(model="mlm", num_queries=20, num_concurrent=10, latency=0.01):
+    """Runs the check.
+
+    :param model: retrieval model; see MODEL_CONFIGS
+    :param num_queries: number of queries
+    :param num_concurrent: max number of queries processed concurrently
+    :param latency: simulated latency of each request (in seconds)
+    :return: list of errors (empty if the check passed)
+    """
+    from nordlys.bench.data_generator import DataGenerator
+    from nordlys.core.retrieval.elastic_async import AsyncElasticCache
+    from nordlys.core.retrieval.local_index import LocalIndex
+    from nordlys.core.retrieval.retrieval import Retrieval
+
+    data = DataGenerator(num_entities=500, num_types=20, num_queries=num_queries).generate()
+    index_dir = tempfile.mkdtemp(prefix="nordlys_async_check_")
+    try:
+        data.build_local_index(index_dir)
+        index = LocalIndex(index_dir)
+        config = dict(MODEL_CONFIGS[model], index_name=index.index_name, first_pass={"1st_num_docs": 50},
+                      num_docs=50)
+        queries = [q for _, q in sorted(data.queries.items())]
+        es = LocalAsyncElasticsearch(index, latency)
+        retrieval = Retrieval(dict(config), AsyncElasticCache(index.index_name, es=es, stats_store=None))
+
+        async def retrieve_all():
+            semaphore = asyncio.Semaphore(num_concurrent)
+
+            async def retrieve(query):
+                async with semaphore:
+                    return await retrieval.retrieve_async(query)
+            return await asyncio.gather(*[retrieve(query) for query in queries])
+
+        with timing.tracing() as trace:
+            try:
+                results = asyncio.run(retrieve_all())
+            except Exception as e:  # e.g., a synchronous request, as there is no Elasticsearch server
+                return ["Async retrieval failed: " + str(e)]
+        PLOGGER.info(str(es.num_requests) + " requests; max " + str(es.max_in_flight) + " in flight")
+
+        errors = []
+        if es.max_in_flight < 2:
+            errors.append("Requests were not made concurrently")
+        if trace.counts.get("es_calls", 0) > 0:
+            errors.append(str(trace.counts["es_calls"]) + " synchronous Elasticsearch requests were made")
+        local_retrieval = Retrieval(dict(config), index)
+        for query, res in zip(queries, results):
+            expected = local_retrieval.retrieve(query)
+            if {doc_id: r["score"] for doc_id, r in res.items()} != \
+                    {doc_id: r["score"] for doc_id, r in expected.items()}:
+                errors.append("Results differ for query: " + query)
+        return errors
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--model", help="retrieval model", choices=sorted(MODEL_CONFIGS), default="mlm")
+    parser.add_argument("-q", "--num_queries", help="number of queries", type=int, default=20)
+    parser.add_argument("-c", "--num_concurrent", help="max number of concurrent queries", type=int, default=10)
+    parser.add_argument("-l", "--latency", help="simulated request latency (in seconds)", type=float, default=0.01)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    errors = check(args.model, args.num_queries, args.num_concurrent, args.latency)
+    for error in errors:
+        PLOGGER.error(error)
+    if len(errors) == 0:
+        PLOGGER.info("Async check passed")
+    return 1 if len(errors) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(arg_parser()))
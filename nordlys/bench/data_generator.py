@@ -0,0 +1,348 @@
+"""
+Data Generator
+==============
+
+Generates synthetic DBpedia-like data for benchmarking:
+
+  - Entity documents, as stored in the DBpedia collection (see :py:mod:`nordlys.core.data.dbpedia.dbpedia2mongo`);
+    the index documents are made from them by :class:`~nordlys.core.data.dbpedia.indexer_dbpedia.IndexerDBpedia`.
+  - Surface form dictionaries, as produced by
+    :py:mod:`DBpediaSurfaceforms2Mongo <nordlys.core.data.dbpedia.dbpedia_surfaceforms2mongo>` and
+    :py:mod:`FACCToMongo <nordlys.core.data.facc.facc2mongo>`, and the Freebase to DBpedia mapping.
+  - Type documents, as indexed by :class:`~nordlys.core.data.dbpedia.indexer_dbpedia_types.IndexerDBpediaTypes`.
+  - A query set with entity linking ground truth (in the Y-ERD format) and a KB snapshot.
+
+Word, entity and type frequencies follow a Zipf distribution; the ``skew`` parameter is its exponent (0 is uniform).
+
+The generated data is written to a directory, and can be loaded into MongoDB and Elasticsearch, or into a
+:py:mod:`local index <nordlys.core.retrieval.local_index>`. Mind that the data is loaded into the collections and
+indices given in the config files; use a local config (``config/local``) pointing to a dedicated database.
+
+Usage
+-----
+
+::
+
+  python -m nordlys.bench.data_generator -o <output_dir> [-n <num_entities>] [-q <num_queries>] [-s <skew>]
+      [--local_index <index_dir>] [--sf_index <sf_index_dir>] [--fb2dbp_index <fb2dbp_index_dir>] [--mongo]
+      [--elastic]
+"""
+
+import argparse
+import bisect
+import json
+import os
+import random
+from itertools import accumulate
+
+from nordlys.config import MONGO_HOST, MONGO_DB, MONGO_COLLECTION_DBPEDIA, MONGO_COLLECTION_SF_FACC, \
+    MONGO_COLLECTION_SF_DBPEDIA, MONGO_COLLECTION_FREEBASE2DBPEDIA, ELASTIC_INDICES, ELASTIC_TTI_INDICES, \
+    BASE_DIR, PLOGGER
+from nordlys.core.data.dbpedia.indexer_dbpedia import IndexerDBpedia
+from nordlys.core.retrieval.analyzer import ENGLISH_STOPWORDS
+from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.local_index import LocalIndexWriter
+from nordlys.core.storage.id_mapping import IDMappingWriter
+from nordlys.core.storage.mongo import Mongo
+from nordlys.core.storage.sstable import SSTableWriter
+from nordlys.core.utils.file_utils import FileUtils
+
+INDEX_CONFIG = os.sep.join([BASE_DIR, "data", "config", "dbpedia-2015-10", "index.config.json"])
+FACC_PREDICATE = "facc12"
+FB2DBP_PREDICATE = "!<owl:sameAs>"
+TYPE_MAPPINGS = {"content": Elastic.analyzed_field()}
+
+CONSONANTS = "bcdfghjklmnprstvz"
+VOWELS = "aeiou"
+
+
+class ZipfSampler(object):
+    """Samples items with probabilities proportional to 1 / rank^skew."""
+
+    def __init__(self, items, skew, rng):
+        self.__items = items
+        self.__cum_weights = list(accumulate(1 / (rank ** skew) for rank in range(1, len(items) + 1)))
+        self.__rng = rng
+
+    def sample(self):
+        i = bisect.bisect_left(self.__cum_weights, self.__rng.random() * self.__cum_weights[-1])
+        return self.__items[min(i, len(self.__items) - 1)]
+
+    def sample_n(self, n):
+        return [self.sample() for _ in range(n)]
+
+
+class DataGenerator(object):
+    def __init__(self, num_entities=1000, num_types=50, num_queries=100, vocab_size=5000, skew=1.0, seed=0):
+        """
+        :param num_entities: number of entities
+        :param num_types: number of types
+        :param num_queries: number of queries
+        :param vocab_size: number of distinct words
+        :param skew: exponent of the Zipf distribution of words, entities and types (0: uniform)
+        :param seed: random seed
+        """
+        self.__num_entities = num_entities
+        self.__num_types = num_types
+        self.__num_queries = num_queries
+        self.__vocab_size = vocab_size
+        self.__skew = skew
+        self.__rng = random.Random(seed)
+
+        self.entities = {}  # {en_id: DBpedia document}
+        self.sf_dbpedia = {}  # {surface form: {predicate: {en_id: count}}}
+        self.sf_facc = {}  # {surface form: {"facc12": {fb_id: count}}}
+        self.fb2dbp = {}  # {fb_id: {"!<owl:sameAs>": [en_id, ..]}}
+        self.types = {}  # {type: {"content": xx}}
+        self.queries = {}  # {qid: query}
+        self.ground_truth = []  # [(qid, query, mention, en_id), ..]
+
+    def __gen_word(self, words):
+        """Generates a new (pronounceable) word."""
+        while True:
+            word = "".join(self.__rng.choice(CONSONANTS) + self.__rng.choice(VOWELS)
+                           for _ in range(self.__rng.randint(2, 4)))
+            if word not in words and word not in ENGLISH_STOPWORDS:
+                return word
+
+    def __gen_vocab(self, size):
+        words = set()
+        vocab = []
+        for _ in range(size):
+            word = self.__gen_word(words)
+            words.add(word)
+            vocab.append(word)
+        return vocab
+
+    @staticmethod
+    def __to_uri(prefix, name):
+        return "<" + prefix + ":" + name.replace(" ", "_") + ">"
+
+    def generate(self):
+        """Generates all data."""
+        vocab = self.__gen_vocab(self.__vocab_size)
+        words = ZipfSampler(vocab, self.__skew, self.__rng)
+        type_names = [w.capitalize() + self.__gen_word(set()).capitalize() for w in vocab[:self.__num_types]]
+        type_ids = [self.__to_uri("dbo", t) for t in type_names]
+        types = ZipfSampler(type_ids, self.__skew, self.__rng)
+        num_top_types = max(1, self.__num_types // 10)
+
+        # entities
+        names = {}  # {en_id: name}
+        for i in range(self.__num_entities):
+            name = " ".join(w.capitalize() for w in words.sample_n(self.__rng.choice([1, 2, 2, 3])))
+            en_id = self.__to_uri("dbpedia", name)
+            if en_id in names:
+                name += " " + str(i)
+                en_id = self.__to_uri("dbpedia", name)
+            names[en_id] = name
+        en_ids = list(names.keys())
+        self.__rng.shuffle(en_ids)  # popularity rank
+        popular_ens = ZipfSampler(en_ids, self.__skew, self.__rng)
+
+        for rank, en_id in enumerate(en_ids):
+            en_type = types.sample()
+            parent_type = type_ids[type_ids.index(en_type) % num_top_types]
+            name = names[en_id]
+            abstract = name + " is a " + " ".join(words.sample_n(self.__rng.randint(20, 60))) + "."
+            fb_id = "<fb:m.0" + format(rank, "x") + ">"
+            doc = {"_id": en_id,
+                   "<rdfs:label>": [name],
+                   "<rdfs:comment>": [abstract],
+                   "<dbo:abstract>": [abstract],
+                   "<rdf:type>": sorted({en_type, parent_type, "<owl:Thing>"}),
+                   "<dcterms:subject>": [self.__to_uri("dbpedia", "Category:" + " ".join(words.sample_n(2)))
+                                         for _ in range(self.__rng.randint(1, 3))],
+                   "<dbo:wikiPageWikiLink>": sorted(set(popular_ens.sample_n(self.__rng.randint(0, 5))) - {en_id}),
+                   "<dbp:description>": [" ".join(words.sample_n(self.__rng.randint(2, 6)))],
+                   "fb:<owl:sameAs>": [fb_id]}
+            if len(doc["<dbo:wikiPageWikiLink>"]) == 0:
+                del doc["<dbo:wikiPageWikiLink>"]
+            name_words = name.split()
+            if len(name_words) > 1 and self.__rng.random() < 0.5:  # alternative name (e.g., surname)
+                doc["<foaf:name>"] = [name_words[-1]]
+            if self.__rng.random() < 0.3:
+                doc["!<dbo:wikiPageRedirects>"] = [self.__to_uri("dbpedia", " ".join(words.sample_n(2)).title())]
+            self.entities[en_id] = doc
+
+            # surface forms; commonness counts decrease with the popularity rank
+            count = max(1, int(1000 / (rank + 1) ** self.__skew))
+            self.__add_sf(self.sf_dbpedia, name, "<rdfs:label>", en_id, 1)
+            self.__add_sf(self.sf_facc, name, FACC_PREDICATE, fb_id, count)
+            for alt_name in doc.get("<foaf:name>", []):
+                self.__add_sf(self.sf_dbpedia, alt_name, "<foaf:name>", en_id, 1)
+                self.__add_sf(self.sf_facc, alt_name, FACC_PREDICATE, fb_id, max(1, count // 10))
+            self.fb2dbp[fb_id] = {FB2DBP_PREDICATE: [en_id]}
+
+        # types (content: abstracts of the entities)
+        abstracts = {}
+        for en_id, doc in self.entities.items():
+            for t in doc["<rdf:type>"]:
+                if t.startswith("<dbo:"):
+                    abstracts.setdefault(t, []).append(doc["<rdfs:comment>"][0])
+        self.types = {t: {"content": "\n".join(abstracts[t])} for t in sorted(abstracts)}
+
+        # queries: entity names (and context words), with the linked entities as ground truth
+        for i in range(self.__num_queries):
+            qid = "bench_" + str(i + 1)
+            linked = [popular_ens.sample() for _ in range(1 if self.__rng.random() < 0.8 else 2)]
+            mentions = [names[en_id].lower() for en_id in linked]
+            query = " ".join(mentions + words.sample_n(self.__rng.randint(0, 2)))
+            self.queries[qid] = query
+            for en_id, mention in zip(linked, mentions):
+                self.ground_truth.append((qid, query, mention, en_id))
+        return self
+
+    @staticmethod
+    def __add_sf(sf_dict, surface_form, predicate, en_id, count):
+        ens = sf_dict.setdefault(surface_form.lower(), {}).setdefault(predicate, {})
+        ens[en_id] = ens.get(en_id, 0) + count
+
+    def get_index_docs(self):
+        """Returns the documents of the entity index; see :func:`IndexerDBpedia.get_doc_content`."""
+        indexer = IndexerDBpedia(FileUtils.load_config(INDEX_CONFIG))
+        docs = {}
+        for en_id, doc in self.entities.items():
+            content = indexer.get_doc_content(doc)
+            if content is not None:
+                docs[en_id] = dict(content)
+        return docs
+
+    # =========================
+    # Storing and loading
+    # =========================
+    def save(self, output_dir):
+        """Writes the data to the output directory."""
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        for name in ["entities", "sf_dbpedia", "sf_facc", "fb2dbp", "types", "queries"]:
+            json.dump(getattr(self, name), open(os.sep.join([output_dir, name + ".json"]), "w"), indent=1,
+                      sort_keys=True)
+        with open(os.sep.join([output_dir, "ground_truth.tsv"]), "w") as f:
+            f.write("difficulty\tqid\tquery\tmention\tentity\tset_id\n")
+            for qid, query, mention, en_id in self.ground_truth:
+                f.write("\t".join(["", qid, query, mention, en_id, ""]) + "\n")
+        with open(os.sep.join([output_dir, "kb_snapshot.txt"]), "w") as f:
+            f.write("\n".join(sorted(self.entities)) + "\n")
+        PLOGGER.info("Synthetic data is written to " + output_dir)
+
+    @classmethod
+    def load(cls, data_dir):
+        """Loads the data written by :func:`save`."""
+        data = cls()
+        for name in ["entities", "sf_dbpedia", "sf_facc", "fb2dbp", "types", "queries"]:
+            setattr(data, name, json.load(open(os.sep.join([data_dir, name + ".json"]))))
+        with open(os.sep.join([data_dir, "ground_truth.tsv"])) as f:
+            next(f)
+            data.ground_truth = [tuple(line.rstrip("\n").split("\t")[1:5]) for line in f]
+        return data
+
+    def build_index(self, indexer, batch=1000):
+        """Adds the entity documents to an index.
+
+        :param indexer: Elastic or LocalIndexWriter object
+        :param batch: number of documents per bulk request
+        """
+        indexer.create_index(IndexerDBpedia(FileUtils.load_config(INDEX_CONFIG)).get_mappings(), force=True)
+        docs = self.get_index_docs()
+        doc_ids = sorted(docs)
+        for i in range(0, len(doc_ids), batch):
+            indexer.add_docs_bulk({doc_id: docs[doc_id] for doc_id in doc_ids[i:i + batch]})
+        PLOGGER.info(str(len(docs)) + " entities are indexed")
+
+    def build_type_index(self, indexer):
+        """Adds the type documents to an index.
+
+        :param indexer: Elastic or LocalIndexWriter object
+        """
+        indexer.create_index(TYPE_MAPPINGS, force=True)
+        indexer.add_docs_bulk(self.types)
+        PLOGGER.info(str(len(self.types)) + " types are indexed")
+
+    def build_local_index(self, index_dir, type_index_dir=None):
+        """Builds local indices of entities and types; see :py:mod:`nordlys.core.retrieval.local_index`."""
+        writer = LocalIndexWriter(index_dir)
+        self.build_index(writer)
+        writer.close()
+        if type_index_dir:
+            writer = LocalIndexWriter(type_index_dir)
+            self.build_type_index(writer)
+            writer.close()
+
+    def build_elastic_index(self, index_name=ELASTIC_INDICES[0], type_index_name=ELASTIC_TTI_INDICES[0]):
+        """Builds Elasticsearch indices of entities and types."""
+        self.build_index(Elastic(index_name))
+        self.build_type_index(Elastic(type_index_name))
+
+    def build_sf_index(self, sf_index_dir):
+        """Writes the surface form dictionaries as tables; see :py:mod:`nordlys.core.storage.sstable`."""
+        for collection, sf_dict in [(MONGO_COLLECTION_SF_DBPEDIA, self.sf_dbpedia),
+                                    (MONGO_COLLECTION_SF_FACC, self.sf_facc)]:
+            writer = SSTableWriter(os.sep.join([sf_index_dir, collection]))
+            for surface_form, doc in sf_dict.items():
+                writer.add(surface_form, doc)
+            writer.close()
+
+    def build_fb2dbp_index(self, fb2dbp_index_dir):
+        """Writes the Freebase to DBpedia mapping; see :py:mod:`nordlys.core.storage.id_mapping`."""
+        writer = IDMappingWriter(os.sep.join([fb2dbp_index_dir, MONGO_COLLECTION_FREEBASE2DBPEDIA]))
+        for fb_id, doc in self.fb2dbp.items():
+            writer.add(fb_id, doc[FB2DBP_PREDICATE])
+        writer.close()
+
+    def load_mongo(self):
+        """Loads entities, surface forms and the Freebase to DBpedia mapping into the MongoDB collections."""
+        mongo = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_DBPEDIA)
+        for en_id, doc in self.entities.items():
+            mongo.add(en_id, {f: v for f, v in doc.items() if f != Mongo.ID_FIELD})
+        mongo = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_FREEBASE2DBPEDIA)
+        for fb_id, doc in self.fb2dbp.items():
+            mongo.add(fb_id, doc)
+        for collection, sf_dict in [(MONGO_COLLECTION_SF_DBPEDIA, self.sf_dbpedia),
+                                    (MONGO_COLLECTION_SF_FACC, self.sf_facc)]:
+            mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+            for surface_form, predicates in sf_dict.items():
+                for predicate, ens in predicates.items():
+                    for en_id, count in ens.items():
+                        mongo.inc_in_dict(surface_form, predicate, en_id, count)
+        PLOGGER.info("Synthetic data is loaded into " + MONGO_DB)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output_dir", help="output directory", type=str)
+    parser.add_argument("-n", "--num_entities", help="number of entities", type=int, default=1000)
+    parser.add_argument("-t", "--num_types", help="number of types", type=int, default=50)
+    parser.add_argument("-q", "--num_queries", help="number of queries", type=int, default=100)
+    parser.add_argument("-v", "--vocab_size", help="number of distinct words", type=int, default=5000)
+    parser.add_argument("-s", "--skew", help="exponent of the Zipf distribution", type=float, default=1.0)
+    parser.add_argument("--seed", help="random seed", type=int, default=0)
+    parser.add_argument("--local_index", help="builds local indices in the given directory", type=str, default=None)
+    parser.add_argument("--sf_index", help="writes surface form tables to the given directory", type=str,
+                        default=None)
+    parser.add_argument("--fb2dbp_index", help="writes the Freebase to DBpedia mapping to the given directory",
+                        type=str, default=None)
+    parser.add_argument("--mongo", help="loads the data into MongoDB", action="store_true")
+    parser.add_argument("--elastic", help="builds the Elasticsearch indices", action="store_true")
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    data = DataGenerator(args.num_entities, args.num_types, args.num_queries, args.vocab_size, args.skew,
+                         args.seed).generate()
+    data.save(args.output_dir)
+    if args.local_index:
+        data.build_local_index(os.sep.join([args.local_index, "entities"]), os.sep.join([args.local_index, "types"]))
+    if args.sf_index:
+        data.build_sf_index(args.sf_index)
+    if args.fb2dbp_index:
+        data.build_fb2dbp_index(args.fb2dbp_index)
+    if args.mongo:
+        data.load_mongo()
+    if args.elastic:
+        data.build_elastic_index()
+
+
+if __name__ == "__main__":
+    main(arg_parser())
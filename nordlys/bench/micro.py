@@ -0,0 +1,489 @@
+"""
+Micro-benchmarks
+================
+
+Micro-benchmarks of the hot functions of scoring, entity linking, feature extraction, and parsing, with stored
+baselines and a regression gate.
+
+  - Each benchmark runs a function on a fixed set of synthetic inputs (generated with a fixed seed; the scorers use a
+    small :py:mod:`local index <nordlys.core.retrieval.local_index>` built from
+    :py:mod:`synthetic data <nordlys.bench.data_generator>`).
+  - The time of a benchmark is the minimum over a number of rounds; each round runs the benchmark enough times to
+    take at least 0.2 seconds.
+  - The ``scorer.score_docs`` benchmark also checks that the batch scores of all scorers are identical to the
+    per-document scores; it fails (with an exception) otherwise.
+  - Baselines are stored in ``data/bench/micro_baselines.json`` (with the machine and Python version they were
+    measured on) and updated with ``--save``. Record the baselines before making changes.
+  - Absolute timings drift between runs (e.g., CPU frequency, other load on a shared host). Therefore, a fixed
+    calibration loop is timed at the start and at the end of each run, and stored with the baselines; benchmark times
+    are scaled by the ratio of the baseline calibration time and the current one before they are compared.
+  - The command exits with status 1 if any (scaled) benchmark is slower than its baseline by more than the threshold
+    (default: 0.2, i.e., 20%). To tolerate noise, regressed benchmarks are measured again (``--retries`` times) and
+    the minimum time is used. If the baselines were measured on a different machine (see :func:`get_machine`), the
+    comparison is advisory only: regressions are reported, but the exit status is 0 unless ``--strict`` is given.
+
+Usage
+-----
+
+::
+
+  python -m nordlys.bench.micro [-b <name> ...] [-t <threshold>] [-r <rounds>] [--retries <n>] [--strict]
+                                [--baseline_file <file>] [--save]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from nordlys.config import DATA_DIR, PLOGGER
+
+BASELINE_FILE = os.sep.join([DATA_DIR, "bench", "micro_baselines.json"])
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_ROUNDS = 5
+DEFAULT_RETRIES = 2
+SEED = 0
+
+BENCHMARKS = {}  # {name: setup function}; the setup function returns the function to be timed
+
+
+def benchmark(name):
+    """Decorator registering the setup function of a benchmark."""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+class _Data(object):
+    """Synthetic inputs shared by the benchmarks (generated on first use)."""
+    __data = None
+    __index = None
+    __index_dir = None
+
+    @classmethod
+    def get_data(cls):
+        if cls.__data is None:
+            from nordlys.bench.data_generator import DataGenerator
+            cls.__data = DataGenerator(num_entities=500, num_types=20, num_queries=100, vocab_size=2000,
+                                       seed=SEED).generate()
+        return cls.__data
+
+    @classmethod
+    def get_index(cls):
+        if cls.__index is None:
+            from nordlys.core.retrieval.local_index import LocalIndex
+            cls.__index_dir = tempfile.mkdtemp(prefix="nordlys_bench_")
+            cls.get_data().build_local_index(cls.__index_dir)
+            cls.__index = LocalIndex(cls.__index_dir)
+        return cls.__index
+
+    @classmethod
+    def get_queries(cls):
+        return [q for _, q in sorted(cls.get_data().queries.items())]
+
+    @classmethod
+    def get_doc_ids(cls, num):
+        return sorted(cls.get_data().entities)[:num]
+
+    @classmethod
+    def cleanup(cls):
+        if cls.__index_dir is not None:
+            shutil.rmtree(cls.__index_dir, ignore_errors=True)
+            cls.__index, cls.__index_dir = None, None
+
+
+# =========================
+# Benchmarks
+# =========================
+def _gen_lm_args(rng, num=1000):
+    """Returns arguments (tf_t_d, len_d, tf_t_C, len_C) of the LM smoothing functions."""
+    return [(rng.randint(0, 5), rng.randint(0, 200), rng.randint(0, 10000), 1000000) for _ in range(num)]
+
+
+@benchmark("scorer_lm.get_dirichlet_prob")
+def _setup_dirichlet_prob():
+    from nordlys.core.retrieval.scorer import ScorerLM
+    args = _gen_lm_args(random.Random(SEED))
+
+    def run():
+        for tf_t_d, len_d, tf_t_C, len_C in args:
+            ScorerLM.get_dirichlet_prob(tf_t_d, len_d, tf_t_C, len_C, 2000)
+    return run
+
+
+@benchmark("scorer_lm.get_jm_prob")
+def _setup_jm_prob():
+    from nordlys.core.retrieval.scorer import ScorerLM
+    args = _gen_lm_args(random.Random(SEED))
+
+    def run():
+        for tf_t_d, len_d, tf_t_C, len_C in args:
+            ScorerLM.get_jm_prob(tf_t_d, len_d, tf_t_C, len_C, 0.1)
+    return run
+
+
+@benchmark("scorer_mlm.get_mlm_term_probs")
+def _setup_mlm_term_probs():
+    from nordlys.core.retrieval.scorer import ScorerMLM
+    index = _Data.get_index()
+    queries = _Data.get_queries()[:10]
+    doc_ids = _Data.get_doc_ids(50)
+    params = {"fields": {"names": 0.2, "categories": 0.1, "catchall": 0.7}}
+
+    def run():
+        for query in queries:
+            scorer = ScorerMLM(index, query, params)
+            for doc_id in doc_ids:
+                scorer.get_mlm_term_probs(doc_id)
+    return run
+
+
+@benchmark("scorer_prms.get_mapping_prob")
+def _setup_mapping_prob():
+    from nordlys.core.retrieval.scorer import ScorerPRMS
+    index = _Data.get_index()
+    fields = ["names", "categories", "attributes", "related_entity_names", "catchall"]
+    scorer = ScorerPRMS(index, " ".join(_Data.get_queries()), {"fields": fields})
+    terms = sorted(set(scorer._query_terms))
+
+    def run():
+        for t in terms:
+            scorer.get_mapping_prob(t)
+    return run
+
+
+SCORER_CONFIGS = [
+    {"model": "lm", "fields": "catchall", "smoothing_method": "dirichlet"},
+    {"model": "lm", "fields": "catchall", "smoothing_method": "jm"},
+    {"model": "mlm", "fields": {"names": 0.2, "categories": 0.1, "catchall": 0.7}},
+    {"model": "prms", "fields": ["names", "categories", "attributes", "related_entity_names", "catchall"]},
+    {"model": "bm25", "fields": "catchall"},
+    {"model": "bm25f", "fields": {"names": 0.2, "categories": 0.1, "catchall": 0.7}}
+]
+
+
+def check_batch_scores(scorer, doc_ids):
+    """Checks that the batch scores of a scorer are identical to its per-document scores."""
+    batch_scores = scorer.score_docs(doc_ids)
+    for doc_id in doc_ids:
+        score = scorer.score_doc(doc_id)
+        if batch_scores[doc_id] != score:
+            raise Exception("Batch score of " + doc_id + " differs: " + str(batch_scores[doc_id]) + " != " +
+                            str(score) + " (" + type(scorer).__name__ + ")")
+
+
+@benchmark("scorer.score_docs")
+def _setup_score_docs():
+    from nordlys.core.retrieval.scorer import Scorer
+    index = _Data.get_index()
+    queries = _Data.get_queries()[:10]
+    doc_ids = _Data.get_doc_ids(50)
+    scorers = [Scorer.get_scorer(index, query, config) for config in SCORER_CONFIGS for query in queries]
+    for scorer in scorers:
+        check_batch_scores(scorer, _Data.get_doc_ids(500))
+
+    def run():
+        for scorer in scorers:
+            scorer.score_docs(doc_ids)
+    return run
+
+
+@benchmark("query.get_ngrams")
+def _setup_get_ngrams():
+    from nordlys.logic.query.query import Query
+    queries = [Query(q) for q in _Data.get_queries()]
+
+    def run():
+        for query in queries:
+            query.get_ngrams()
+    return run
+
+
+@benchmark("greedy.disambiguate")
+def _setup_disambiguate():
+    from nordlys.core.ml.instance import Instance
+    from nordlys.core.ml.instances import Instances
+    from nordlys.logic.el.greedy import Greedy
+    rng = random.Random(SEED)
+    query_inss = []
+    for query in _Data.get_queries()[:20]:
+        terms = query.split()
+        ngrams = [" ".join(terms[i:j]) for i in range(len(terms)) for j in range(i + 1, len(terms) + 1)]
+        inss = []
+        for i in range(50):  # candidate entities of the query
+            ins = Instance(i, properties={"mention": rng.choice(ngrams), "en_id": "<dbpedia:E" + str(i) + ">"})
+            ins.score = rng.random()
+            inss.append(ins)
+        query_inss.append(Instances(inss))
+    greedy = Greedy(0.2)
+
+    def run():
+        for inss in query_inss:
+            greedy.disambiguate(inss)
+    return run
+
+
+@benchmark("ftr_lexical.edit_dis_agg")
+def _setup_edit_dis_agg():
+    from nordlys.logic.features.ftr_lexical import FtrLexical
+    data = _Data.get_data()
+    queries = _Data.get_queries()
+    names = [doc["<rdfs:label>"][0] for _, doc in sorted(data.entities.items())]
+    pairs = list(zip(queries, names))
+    ftr_lexical = FtrLexical()
+
+    def run():
+        for s1, s2 in pairs:
+            ftr_lexical.edit_dis_agg(s1, s2)
+    return run
+
+
+@benchmark("uri_prefix.get_prefixed")
+def _setup_get_prefixed():
+    from nordlys.core.storage.parser.uri_prefix import URIPrefix
+    uri_prefix = URIPrefix()
+    rng = random.Random(SEED)
+    prefixes = sorted(uri_prefix.prefixes)
+    uris = ["<" + rng.choice(prefixes) + "Entity_" + str(i) + ">" for i in range(900)]
+    uris += ["<http://example.org/unknown/path/Entity_" + str(i) + ">" for i in range(100)]
+
+    def run():
+        for uri in uris:
+            uri_prefix.get_prefixed(uri)
+    return run
+
+
+@benchmark("mongo.unescape_doc")
+def _setup_unescape_doc():
+    from nordlys.core.storage.mongo import Mongo
+
+    def escape(s):
+        return s.replace(".", "U+002E").replace("$", "U+0024")
+
+    data = _Data.get_data()
+    mdocs = []
+    for en_id, doc in sorted(data.entities.items()):  # DBpedia collection
+        mdocs.append({escape(f): v if f != Mongo.ID_FIELD else escape(v) for f, v in doc.items()})
+    for sf, predicates in sorted(data.sf_facc.items()):  # surface form collections
+        mdoc = {Mongo.ID_FIELD: escape(sf)}
+        for predicate, ens in predicates.items():
+            mdoc[escape(predicate)] = {escape(en_id): count for en_id, count in ens.items()}
+        mdocs.append(mdoc)
+
+    def run():
+        for mdoc in mdocs:
+            Mongo.unescape_doc(mdoc)
+    return run
+
+
+@benchmark("instances.to_libsvm")
+def _setup_to_libsvm():
+    from nordlys.core.ml.instance import Instance
+    from nordlys.core.ml.instances import Instances
+    rng = random.Random(SEED)
+    features = ["f" + str(i) for i in range(30)]
+    inss = Instances()
+    for i in range(2000):
+        ins = Instance(str(i), {f: rng.random() for f in features}, target=str(rng.randint(0, 1)),
+                       properties={"q_id": i // 20 + 1})
+        inss.add_instance(ins)
+    out_file = os.path.join(tempfile.gettempdir(), "nordlys_bench_" + str(os.getpid()) + ".libsvm")
+
+    def run():
+        inss.to_libsvm(out_file, qid_prop="q_id")
+    return run
+
+
+# =========================
+# Running and comparing
+# =========================
+def get_cpu_model():
+    """Returns the CPU model name (from /proc/cpuinfo, where available)."""
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    return platform.processor() or platform.machine()
+
+
+def get_machine():
+    """Returns the description of the machine and Python version."""
+    return {"machine": platform.machine(), "processor": get_cpu_model(), "cpus": os.cpu_count(),
+            "python": platform.python_version()}
+
+
+def _calibration_loop():
+    """Fixed workload (dictionary, string and arithmetic operations) for calibrating the timings."""
+    counts = {}
+    for i in range(2000):
+        key = "t" + str(i % 300)
+        counts[key] = counts.get(key, 0) + 1
+    total = 0.0
+    for key, count in sorted(counts.items()):
+        total += math.log(count + len(key))
+    return total
+
+
+def calibrate(rounds=DEFAULT_ROUNDS):
+    """Returns the time of the calibration loop in microseconds (minimum over the rounds)."""
+    return _time(_calibration_loop, rounds)
+
+
+def _time(func, rounds):
+    """Returns the time of a function in microseconds (minimum over the rounds)."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()  # number of runs taking >= 0.2 sec
+    times = timer.repeat(repeat=rounds, number=number)
+    return round(min(times) / number * 1e6, 3)
+
+
+def run_benchmark(name, rounds=DEFAULT_ROUNDS):
+    """Runs a benchmark and returns its time in microseconds (minimum over the rounds)."""
+    return _time(BENCHMARKS[name](), rounds)
+
+
+def run(names=None, rounds=DEFAULT_ROUNDS):
+    """Runs the benchmarks.
+
+    :param names: names of the benchmarks (default: all)
+    :param rounds: number of rounds
+    :return: {name: time in microseconds}
+    """
+    names = sorted(BENCHMARKS) if not names else names
+    for name in names:
+        if name not in BENCHMARKS:
+            raise Exception("Unknown benchmark " + name + "; available: " + ", ".join(sorted(BENCHMARKS)))
+    results = {}
+    try:
+        for name in names:
+            results[name] = run_benchmark(name, rounds)
+            PLOGGER.info(name + "\t" + str(results[name]) + " us")
+    finally:
+        _Data.cleanup()
+    return results
+
+
+def load_baselines(baseline_file=BASELINE_FILE):
+    """Loads the baselines (None if the file does not exist)."""
+    if not os.path.exists(baseline_file):
+        return None
+    return json.load(open(baseline_file))
+
+
+def save_baselines(results, calibration_us, baseline_file=BASELINE_FILE):
+    """Stores the results as baselines; baselines of other benchmarks are kept.
+
+    :param results: {name: time in microseconds}
+    :param calibration_us: time of the calibration loop in microseconds
+    :param baseline_file: baseline file
+    """
+    baselines = load_baselines(baseline_file) or {"benchmarks": {}}
+    if baselines.get("machine", None) != get_machine() or baselines.get("calibration_us", None) is None:
+        baselines["benchmarks"] = {}  # baselines measured on another machine are not kept
+    baselines["machine"] = get_machine()
+    baselines["calibration_us"] = calibration_us
+    baselines["benchmarks"].update({name: {"time_us": t} for name, t in results.items()})
+    if not os.path.exists(os.path.dirname(baseline_file)):
+        os.makedirs(os.path.dirname(baseline_file))
+    json.dump(baselines, open(baseline_file, "w"), indent=2, sort_keys=True)
+    PLOGGER.info("Baselines are written to " + baseline_file)
+
+
+def get_scale(baselines, calibration_us):
+    """Returns the factor by which the current timings are multiplied to be comparable with the baselines."""
+    if baselines.get("calibration_us", None) is None or not calibration_us:
+        return 1.0
+    return baselines["calibration_us"] / calibration_us
+
+
+def check_regressions(results, baselines, threshold=DEFAULT_THRESHOLD, scale=1.0):
+    """Compares the results with the baselines.
+
+    :param results: {name: time in microseconds}
+    :param baselines: baselines, as stored by :func:`save_baselines`
+    :param threshold: maximum allowed slowdown (relative to the baseline)
+    :param scale: factor applied to the results before comparing them (see :func:`get_scale`)
+    :return: list of regressed benchmarks [(name, baseline time, scaled time), ...]
+    """
+    regressions = []
+    for name, t in sorted(results.items()):
+        baseline = baselines["benchmarks"].get(name, None)
+        if baseline is None:
+            PLOGGER.info(name + "\tno baseline")
+            continue
+        t = round(t * scale, 3)
+        change = (t - baseline["time_us"]) / baseline["time_us"]
+        regressed = change > threshold
+        PLOGGER.info("{}\t{} us\t{} us\t{:+.1%}{}".format(name, baseline["time_us"], t, change,
+                                                          "\tREGRESSION" if regressed else ""))
+        if regressed:
+            regressions.append((name, baseline["time_us"], t))
+    return regressions
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--benchmarks", help="names of the benchmarks (default: all)", type=str, nargs="*")
+    parser.add_argument("-t", "--threshold", help="maximum allowed slowdown (default: 0.2)", type=float,
+                        default=DEFAULT_THRESHOLD)
+    parser.add_argument("-r", "--rounds", help="number of rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--retries", help="number of times regressed benchmarks are measured again", type=int,
+                        default=DEFAULT_RETRIES)
+    parser.add_argument("--strict", help="fails on regressions even if the baselines are from another machine",
+                        action="store_true")
+    parser.add_argument("--baseline_file", help="baseline file", type=str, default=BASELINE_FILE)
+    parser.add_argument("--save", help="stores the results as baselines", action="store_true")
+    parser.add_argument("--list", help="lists the benchmarks", action="store_true")
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.list:
+        print("\n".join(sorted(BENCHMARKS)))
+        return 0
+
+    calibration_us = calibrate(args.rounds)
+    results = run(args.benchmarks, args.rounds)
+    calibration_us = min(calibration_us, calibrate(args.rounds))
+    PLOGGER.info("calibration\t" + str(calibration_us) + " us")
+    if args.save:
+        save_baselines(results, calibration_us, args.baseline_file)
+        return 0
+
+    baselines = load_baselines(args.baseline_file)
+    if baselines is None:
+        PLOGGER.warning("No baselines found in " + args.baseline_file + "; use --save to store them.")
+        return 0
+    advisory = baselines.get("machine", None) != get_machine() and not args.strict
+    if baselines.get("machine", None) != get_machine():
+        PLOGGER.warning("Baselines were measured on a different machine: " + json.dumps(baselines.get("machine")) +
+                        ("; regressions are reported only (use --strict to fail on them)" if advisory else ""))
+    scale = get_scale(baselines, calibration_us)
+    PLOGGER.info("Timings are scaled by {:.3f} (calibration)".format(scale))
+    regressions = check_regressions(results, baselines, args.threshold, scale)
+    for _ in range(args.retries):
+        if len(regressions) == 0:
+            break
+        PLOGGER.info("Measuring " + str(len(regressions)) + " regressed benchmark(s) again ...")
+        retry_results = run([name for name, _, _ in regressions], args.rounds)
+        results.update({name: min(t, results[name]) for name, t in retry_results.items()})
+        regressions = check_regressions({name: results[name] for name in retry_results}, baselines, args.threshold,
+                                        scale)
+    if len(regressions) > 0:
+        PLOGGER.error(str(len(regressions)) + " benchmark(s) are slower than the baseline by more than " +
+                      "{:.0%}".format(args.threshold))
+        return 0 if advisory else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(arg_parser()))
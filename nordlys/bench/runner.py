@@ -0,0 +1,238 @@
+"""
+Benchmark Runner
+================
+
+Runs a service (entity retrieval, entity linking, or target type identification) on a query set and writes a JSON
+report with throughput, latency percentiles, peak memory usage, stage times, and backend call counts.
+
+Reports include the git commit and the run parameters, and can be compared between commits with ``--compare``.
+
+The backends are either
+
+  - the Elasticsearch indices and MongoDB collections of the config files (e.g., loaded with synthetic data by
+    :py:mod:`nordlys.bench.data_generator`),
+  - a local index (see :py:mod:`nordlys.core.retrieval.local_index`), or
+  - recorded requests (see :py:mod:`nordlys.core.utils.replay`); run once with ``"replay": "record"`` against the
+    real backends, then with ``"replay": "replay"`` to benchmark without them.
+
+Usage
+-----
+
+::
+
+  python -m nordlys.bench.runner <config_file>
+  python -m nordlys.bench.runner --compare <report_file_1> <report_file_2>
+
+
+Config parameters
+-----------------
+
+- **service**: [er | el | tti]
+- **config**: config of the service; see :py:mod:`nordlys.services.er`, :py:mod:`nordlys.services.el`, and
+  :py:mod:`nordlys.services.tti`
+- **query_file**: queries (JSON); e.g., ``queries.json`` of the generated data
+- **num_queries**: maximum number of queries *(default: all)*
+- **warmup**: number of queries run before the measurement *(default: 10)*
+- **repeat**: number of passes over the queries *(default: 1)*
+- **local_index_dir**: local index of the entities; used instead of Elasticsearch (for er and el; for tti, set
+  ``local_index_dir`` in the tti config)
+- **replay**: [null | record | replay] *(default: null)*
+- **replay_dir**, **latency**, **latency_scale**: replay settings; see :py:mod:`nordlys.core.utils.replay`
+- **output_file**: the report is written to this file *(default: printed)*
+
+
+Example config
+---------------
+
+.. code:: python
+
+	{
+	  "service": "er",
+	  "config": {"model": "lm", "first_pass": {"1st_num_docs": 100}},
+	  "query_file": "path/to/bench_data/queries.json",
+	  "local_index_dir": "path/to/bench_index/entities",
+	  "output_file": "path/to/report.json"
+	}
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy
+
+from nordlys.config import BASE_DIR, ELASTIC_INDICES, PLOGGER
+from nordlys.core.utils import replay, timing
+from nordlys.core.utils.file_utils import FileUtils
+
+SERVICE_ER = "er"
+SERVICE_EL = "el"
+SERVICE_TTI = "tti"
+
+COUNTERS = ["es_calls", "mongo_lookups", "cache_hits", "cache_misses"]
+
+
+class Runner(object):
+    def __init__(self, config):
+        self.__check_config(config)
+        self.__config = config
+        self.__service = config["service"]
+        self.__service_config = config["config"]
+        # must be set before the service creates its Elastic and Mongo objects
+        replay.configure(config.get("replay", None), config.get("replay_dir", None), config.get("latency", None),
+                         config.get("latency_scale", None))
+        self.__func = self.__get_service_func()
+
+    @staticmethod
+    def __check_config(config):
+        """Checks config parameters and sets default values."""
+        if config.get("service", None) not in {SERVICE_ER, SERVICE_EL, SERVICE_TTI}:
+            raise Exception("Unknown service " + str(config.get("service", None)))
+        if config.get("query_file", None) is None:
+            raise Exception("query_file is missing")
+        if config.get("local_index_dir", None) and config["service"] == SERVICE_TTI:
+            raise Exception("Set local_index_dir in the tti config (types or entities index, depending on the method)")
+        config["config"] = config.get("config", None) or {}
+        config["warmup"] = int(config.get("warmup", 10))
+        config["repeat"] = int(config.get("repeat", 1))
+        return config
+
+    def __get_service_func(self):
+        """Creates the service and returns its function processing a single query."""
+        if self.__service == SERVICE_ER:
+            from nordlys.core.retrieval.local_index import get_index
+            from nordlys.services.er import ER
+            elastic = get_index(ELASTIC_INDICES[0], self.__config.get("local_index_dir", None))
+            return ER(self.__service_config, elastic).retrieve
+
+        if self.__service == SERVICE_EL:
+            from nordlys.core.retrieval.local_index import get_index
+            from nordlys.logic.entity.entity import Entity
+            from nordlys.logic.features.feature_cache import FeatureCache
+            from nordlys.services.el import EL
+            elastic = get_index(ELASTIC_INDICES[0], self.__config.get("local_index_dir", None))
+            el = EL(self.__service_config, Entity(), elastic, FeatureCache())
+            return el.link
+
+        from nordlys.services.tti import TTI
+        return TTI(self.__service_config).identify
+
+    @staticmethod
+    def get_peak_rss():
+        """Returns the peak resident set size of the process (in MB)."""
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024  # bytes on macOS, KB on Linux
+
+    @staticmethod
+    def get_commit():
+        """Returns the git commit of the code (None if not available)."""
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR,
+                                           stderr=subprocess.DEVNULL).decode("utf-8").strip()
+        except Exception:
+            return None
+
+    def run(self):
+        """Runs the benchmark and returns the report."""
+        queries = sorted(json.load(open(self.__config["query_file"])).items())
+        if self.__config.get("num_queries", None):
+            queries = queries[:int(self.__config["num_queries"])]
+        if len(queries) == 0:
+            raise Exception("No queries in " + self.__config["query_file"])
+
+        PLOGGER.info("Warming up with " + str(self.__config["warmup"]) + " queries ...")
+        for i in range(self.__config["warmup"]):
+            self.__func(queries[i % len(queries)][1])
+
+        PLOGGER.info("Running " + str(len(queries)) + " queries (" + str(self.__config["repeat"]) + " passes) ...")
+        metrics = timing.Metrics()
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(self.__config["repeat"]):
+            for qid, query in queries:
+                with timing.tracing() as trace:
+                    self.__func(query)
+                metrics.add(self.__service, trace)
+                latencies.append(trace.total * 1000)
+        elapsed = time.perf_counter() - start
+        replay.save()
+        return self.__gen_report(latencies, elapsed, metrics.stats()[self.__service])
+
+    def __gen_report(self, latencies, elapsed, stats):
+        """Generates the report of a run."""
+        percentiles = numpy.percentile(latencies, [50, 95, 99])
+        return {
+            "service": self.__service,
+            "config": self.__service_config,
+            "backend": "local_index" if self.__config.get("local_index_dir", None) or
+                                        self.__service_config.get("local_index_dir", None) else "elastic",
+            "replay": self.__config.get("replay", None),
+            "commit": self.get_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "num_queries": len(latencies),
+            "qps": round(len(latencies) / elapsed, 3),
+            "latency_ms": {"mean": round(float(numpy.mean(latencies)), 3),
+                           "p50": round(float(percentiles[0]), 3),
+                           "p95": round(float(percentiles[1]), 3),
+                           "p99": round(float(percentiles[2]), 3),
+                           "max": round(float(numpy.max(latencies)), 3)},
+            "peak_rss_mb": round(self.get_peak_rss(), 1),
+            "backend_calls": {name: stats["counts"].get(name, {"mean": 0})["mean"] for name in COUNTERS},
+            "stages": stats["stages"]
+        }
+
+
+def compare(report_1, report_2):
+    """Compares two reports; returns the relative changes of the second report w.r.t. the first one.
+
+    :param report_1: report (dict)
+    :param report_2: report (dict)
+    :return: {metric: {"before": xx, "after": xx, "change": xx}}
+    """
+    def change(before, after):
+        return round((after - before) / before, 4) if before else None
+
+    metrics = {"qps": (report_1["qps"], report_2["qps"]),
+               "peak_rss_mb": (report_1["peak_rss_mb"], report_2["peak_rss_mb"])}
+    for name in report_1["latency_ms"]:
+        metrics["latency_ms." + name] = (report_1["latency_ms"][name], report_2["latency_ms"].get(name, 0))
+    for name in report_1["backend_calls"]:
+        metrics["backend_calls." + name] = (report_1["backend_calls"][name], report_2["backend_calls"].get(name, 0))
+    for name in report_1["stages"]:
+        metrics["stages." + name] = (report_1["stages"][name]["mean_ms"],
+                                     report_2["stages"].get(name, {"mean_ms": 0})["mean_ms"])
+    return {metric: {"before": before, "after": after, "change": change(before, after)}
+            for metric, (before, after) in sorted(metrics.items())}
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("config", help="config file", type=str, nargs="?")
+    parser.add_argument("--compare", help="compares two report files", type=str, nargs=2, default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.compare:
+        res = compare(json.load(open(args.compare[0])), json.load(open(args.compare[1])))
+        for metric, values in res.items():
+            PLOGGER.info(metric + "\t" + str(values["before"]) + "\t" + str(values["after"]) + "\t" +
+                         ("{0:+.1%}".format(values["change"]) if values["change"] is not None else "-"))
+        return
+
+    config = FileUtils.load_config(args.config)
+    report = Runner(config).run()
+    if config.get("output_file", None):
+        json.dump(report, open(config["output_file"], "w"), indent=2, sort_keys=True)
+        PLOGGER.info("Report is written to " + config["output_file"])
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main(arg_parser())
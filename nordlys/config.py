@@ -43,13 +43,21 @@ MONGO_COLLECTION_SF_DBPEDIA = MONGO_CONFIG["collection_sf_dbpedia"]
 MONGO_COLLECTION_WORD2VEC = MONGO_CONFIG["collection_word2vec"]
 MONGO_COLLECTION_FREEBASE2DBPEDIA = MONGO_CONFIG["collection_freebase2dbpedia"]
 MONGO_ENTITY_COLLECTIONS = MONGO_CONFIG["entity_collections"]
+MONGO_SF_INDEX_DIR = MONGO_CONFIG.get("sf_index_dir", None)
+MONGO_FB2DBP_INDEX_DIR = MONGO_CONFIG.get("fb2dbp_index_dir", None)
 
 # config for Elasticsearch
 ELASTIC_CONFIG = load_nordlys_config("elastic.json")
 ELASTIC_HOSTS = ELASTIC_CONFIG["hosts"]
+ELASTIC_CONNECTION = ELASTIC_CONFIG.get("connection", {})
 ELASTIC_SETTINGS = ELASTIC_CONFIG["settings"]
 ELASTIC_INDICES = ELASTIC_CONFIG["indices"]
 ELASTIC_TTI_INDICES = ELASTIC_CONFIG["tti_indices"]
+ELASTIC_CACHE = ELASTIC_CONFIG.get("cache", {})
+ELASTIC_LOCAL_ANALYZER = ELASTIC_CONFIG.get("local_analyzer", False)
+
+# config for record-and-replay of backend requests
+REPLAY_CONFIG = load_nordlys_config("replay.json")
 
 # config for trec_eval
 TREC_EVAL = os.sep.join([LIB_DIR, "trec_eval", "trec_eval"])
@@ -58,6 +66,8 @@ TREC_EVAL = os.sep.join([LIB_DIR, "trec_eval", "trec_eval"])
 API_CONFIG = load_nordlys_config("api.json")
 API_HOST = API_CONFIG["host"]
 API_PORT = int(API_CONFIG["port"])
+API_RESULT_CACHE = API_CONFIG.get("result_cache", {})
+API_METRICS = API_CONFIG.get("metrics", False)
 
 # config for Web interface
 WWW_CONFIG = load_nordlys_config("www.json")
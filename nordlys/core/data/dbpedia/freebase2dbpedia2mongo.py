@@ -10,6 +10,16 @@ To generate one-to-one mapping, we therefore perform the followings:
 
 Note: Even with the above pre-processing, some Freebase IDs (specifically, 560) remain that are mapped to multiple DBpedia IDs.
 
+Config parameters
+-----------------
+
+- **collection**: name of the Mongo collection (and of the memory-mapped mapping)
+- **mapping_file**: Freebase links of DBpedia 2015-10
+- **mapping_file_39**: Freebase links of DBpedia 3.9 (used for removing duplicates)
+- **mapping_dir**: if set, the mapping is also written as a memory-mapped ID mapping to ``<mapping_dir>/<collection>``
+  (see :py:mod:`nordlys.core.storage.id_mapping`); set ``fb2dbp_index_dir`` in ``config/mongo.json`` to the same
+  directory to use it *(optional)*
+
 :Author: Faegheh Hasibi
 """
 import argparse
@@ -19,6 +29,7 @@ import sys
 from rdflib.plugins.parsers.ntriples import NTriplesParser, ParseError
 
 from nordlys.config import MONGO_HOST, MONGO_DB, MONGO_COLLECTION_DBPEDIA
+from nordlys.core.storage.id_mapping import IDMappingWriter
 from nordlys.core.storage.mongo import Mongo
 from nordlys.core.storage.parser.nt_parser import Triple
 from nordlys.core.storage.parser.uri_prefix import URIPrefix
@@ -32,6 +43,7 @@ KEY_COLLECTION = "collection"
 KEY_MAPPING_FILE = "mapping_file"
 KEY_MAPPING_FILE_39 = "mapping_file_39"
 KEY_FILE_NAME = "filename"
+KEY_MAPPING_DIR = "mapping_dir"  # optional; the mapping is also written to <mapping_dir>/<collection>
 
 
 class Freebase2DBpedia2Mongo(object):
@@ -134,6 +146,15 @@ class Freebase2DBpedia2Mongo(object):
             if i % 1000 == 0:
                 PLOGGER.info(str(i // 1000) + "K entities are added!")
 
+    def build_mapping(self, mappings, mapping_dir):
+        """Builds the (memory-mapped) ID mapping in ``<mapping_dir>/<collection>``, where
+        :class:`~nordlys.logic.entity.entity.Entity` reads it from; see :py:mod:`nordlys.core.storage.id_mapping`.
+        """
+        writer = IDMappingWriter(os.path.join(mapping_dir, self.__collection))
+        for fb_id, dbp_ids in mappings.items():
+            writer.add(fb_id, dbp_ids)
+        writer.close()
+
 
 def arg_parser():
     parser = argparse.ArgumentParser()
@@ -147,6 +168,8 @@ def main(args):
     fb2dbp2mongo = Freebase2DBpedia2Mongo(config)
     mappings = fb2dbp2mongo.load_fb2dbp_mapping()
     fb2dbp2mongo.build_collection(mappings)
+    if config.get(KEY_MAPPING_DIR, None):
+        fb2dbp2mongo.build_mapping(mappings, config[KEY_MAPPING_DIR])
 
 
 if __name__ == "__main__":
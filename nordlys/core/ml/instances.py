@@ -18,6 +18,7 @@ from sys import argv
 
 from collections import defaultdict
 from nordlys.core.ml.instance import Instance
+from nordlys.core.utils.ranked_list import rank, TrecWriter
 from nordlys.config import PLOGGER
 
 
@@ -208,13 +209,9 @@ class Instances(object):
                 if (score is None) or (score < ins.score):
                     unique_entries[qid][doc_id] = ins.score
 
-        out_str = ""
-        for qid, docs in sorted(unique_entries.items()):
-            rank = 1
-            for doc_id, score in sorted(docs.items(), key=lambda x:x[1], reverse=True):
-                out_str += qid + "\tQ0\t" + doc_id + "\t" + str(rank) + "\t" + "{0:.5f}".format(score) + "\tnordlys\n"
-                rank += 1
-        open(file_name, "w").write(out_str)
+        with TrecWriter(file_name, "nordlys", score_format="{0:.5f}".format) as out:
+            for qid, docs in sorted(unique_entries.items()):
+                out.write(qid, rank(docs))
         PLOGGER.info("Trec-eval output:\t" + file_name)
 
     def to_libsvm(self, file_name=None, qid_prop=None):
@@ -37,6 +37,7 @@ Config parameters
 - **load_model**: if True, loads the model
 - **feature_imp_file**: Feature importance is saved to this file
 - **output_file**: where output is written; default output format: TSV with with instance_id and (estimated) target
+- **apply_chunk_size**: max number of instances the model is applied on at once (default: 10000)
 
 
 Example config
@@ -79,6 +80,7 @@ from nordlys.core.ml.instances import Instances
 from nordlys.core.ml.cross_validation import CrossValidation
 from nordlys.config import PLOGGER
 from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.utils.timing import timed
 
 
 class ML(object):
@@ -202,6 +204,7 @@ class ML(object):
         open(self.__config["feature_imp_file"], "w").write(feat_imp_str)
         return feat_imp_str
 
+    @timed("model_apply")
     def apply_model(self, instances, model):
         """Applies model on a given set of instances.
 
@@ -210,16 +213,27 @@ class ML(object):
         :return: Instances
         """
         PLOGGER.info("Applying model ... ")
-        if len(instances.get_all()) > 0:
-            features_names = sorted(instances.get_all()[0].features.keys())
-            for ins in instances.get_all():
-                test_x = numpy.array([[ins.features[ftr] for ftr in features_names]])
+        all_ins = instances.get_all()
+        if len(all_ins) > 0:
+            features_names = sorted(all_ins[0].features.keys())
+            chunk_size = self.__config.get("apply_chunk_size", 10000)
+            # the model is applied on a (n_samples, n_features) matrix per chunk; single predictions are costly
+            for start in range(0, len(all_ins), chunk_size):
+                chunk = all_ins[start:start + chunk_size]
+                test_x = numpy.zeros((len(chunk), len(features_names)))
+                for i, ins in enumerate(chunk):
+                    test_x[i] = [ins.features[ftr] for ftr in features_names]
                 if self.__config.get("category", "regression") == "regression":
-                    ins.score = model.predict(test_x)[0]
+                    scores = model.predict(test_x)
+                    for i, ins in enumerate(chunk):
+                        ins.score = scores[i]
                 else:  # classification
-                    ins.target = str(model.predict(test_x)[0])
+                    targets = model.predict(test_x)
                     # "predict_proba" gets class probabilities; an array of probabilities for each class e.g.[0.99, 0.1]
-                    ins.score = model.predict_proba(test_x)[0][1]
+                    probs = model.predict_proba(test_x)
+                    for i, ins in enumerate(chunk):
+                        ins.target = str(targets[i])
+                        ins.score = probs[i][1]
         return instances
 
     def output(self, instances):
@@ -0,0 +1,217 @@
+"""
+Analyzer
+========
+
+Local (in-process) versions of the analyzers used in the Elasticsearch indices. They are used by the
+:py:mod:`local index <nordlys.core.retrieval.local_index>`, and optionally by
+:func:`Elastic.analyze_query <nordlys.core.retrieval.elastic.Elastic.analyze_query>`, so that queries are analyzed
+without any round trip to Elasticsearch. The latter is opt-in (``local_analyzer`` in ``config/elastic.json``); enable it
+only after verifying the local analyzers against your Elasticsearch version (see below).
+
+The custom analyzers are compiled from the analysis settings of the indices (:const:`ANALYSIS_SETTINGS`, which are
+also used by :func:`Elastic.create_index <nordlys.core.retrieval.elastic.Elastic.create_index>`). Supported analyzers:
+
+  - ``stop_en`` (:const:`Elastic.ANALYZER_STOP <nordlys.core.retrieval.elastic.Elastic.ANALYZER_STOP>`): standard
+    tokenizer, lowercase filter, and English stopwords.
+  - ``standard``: standard tokenizer and lowercase filter.
+  - ``keyword``: the whole value is a single token.
+
+The standard tokenizer of Elasticsearch implements the Unicode word boundary rules (UAX #29); here they are
+approximated with a regular expression:
+
+  - words consist of letters, digits and underscores; tokens without any letter or digit (e.g., ``_``) are dropped,
+  - letters are joined by apostrophes, periods and colons (e.g., ``that's``, ``u.s.a``),
+  - digits are joined by apostrophes, periods, commas and semicolons (e.g., ``1,000.5``); e.g., ``10:30`` and ``a.1``
+    are split,
+  - each CJK ideograph (and Hiragana character) is a separate token.
+
+Other scripts that need dictionary-based segmentation (e.g., Thai) are not supported. The local analyzers can be
+verified against Elasticsearch, or against the recorded ``_analyze`` outputs of a previous run (a JSON file
+``{text: analyzed text}``), using the command line:
+
+::
+
+  python -m nordlys.core.retrieval.analyzer -q <query_file> -i <index_name> [-o <output_file>] [-a <analyzer>]
+  python -m nordlys.core.retrieval.analyzer -f <fixture_file> [-a <analyzer>]
+"""
+
+import argparse
+import json
+import re
+
+from nordlys.config import PLOGGER
+from nordlys.core.utils.lru_cache import LRUCache
+
+# Lucene's English stopword list (``_english_``)
+ENGLISH_STOPWORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no", "not", "of",
+    "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to", "was", "will", "with"])
+STOPWORD_LISTS = {"_english_": ENGLISH_STOPWORDS, "_none_": frozenset()}
+
+# Analysis settings of the indices (custom analyzers)
+ANALYSIS_SETTINGS = {"analyzer": {"stop_en": {"type": "standard", "stopwords": "_english_"}}}
+
+MAX_TOKEN_LENGTH = 255
+# CJK ideographs and Hiragana (one token per character)
+IDEOGRAPHIC = "\u3040-\u309f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\U00020000-\U0002fa1f"
+LETTER = "[^\\W\\d_" + IDEOGRAPHIC + "]"
+TOKEN_PATTERN = re.compile("[" + IDEOGRAPHIC + "]"
+                           "|(?:[^\\W" + IDEOGRAPHIC + "]"  # letters, digits and underscores
+                           "|(?<=" + LETTER + ")['’.:](?=" + LETTER + ")"  # between letters
+                           "|(?<=\\d)['’.,;](?=\\d))+")  # between digits
+
+
+class Analyzer(object):
+    """Analyzer producing the same tokens as the corresponding Elasticsearch analyzer."""
+    STOP = "stop_en"
+    STANDARD = "standard"
+    KEYWORD = "keyword"
+
+    __analyzers = {}  # {name: Analyzer}; shared instances, see :func:`get`
+
+    def __init__(self, name=STOP, max_cache=10000):
+        """
+        :param name: name of the analyzer; a custom analyzer in ANALYSIS_SETTINGS or a built-in analyzer
+            [Analyzer.STANDARD, Analyzer.KEYWORD]
+        :param max_cache: max number of memoized analyzed texts
+        """
+        definition = self.get_definition(name)
+        if definition is None:
+            raise Exception("Analyzer " + name + " is not supported.")
+        self.__name = name
+        self.__type = definition["type"]
+        stopwords = definition.get("stopwords", "_none_")
+        self.__stopwords = STOPWORD_LISTS[stopwords] if isinstance(stopwords, str) else frozenset(stopwords)
+        self.__max_token_length = definition.get("max_token_length", MAX_TOKEN_LENGTH)
+        self.__cache = LRUCache(max_size=max_cache)  # {text: analyzed text}
+
+    @staticmethod
+    def get_definition(name):
+        """Returns the definition of an analyzer (None if it is not supported)."""
+        definition = ANALYSIS_SETTINGS["analyzer"].get(name, {"type": name})
+        if definition["type"] not in {Analyzer.STANDARD, Analyzer.KEYWORD}:
+            return None
+        if isinstance(definition.get("stopwords", "_none_"), str) and \
+                definition.get("stopwords", "_none_") not in STOPWORD_LISTS:
+            return None
+        return definition
+
+    @staticmethod
+    def is_supported(name):
+        """Returns True if the analyzer can be run locally."""
+        return Analyzer.get_definition(name) is not None
+
+    @staticmethod
+    def get(name=STOP):
+        """Returns a shared (memoized) analyzer instance."""
+        if name not in Analyzer.__analyzers:
+            Analyzer.__analyzers[name] = Analyzer(name)
+        return Analyzer.__analyzers[name]
+
+    @property
+    def name(self):
+        return self.__name
+
+    def cache_stats(self):
+        """Returns statistics of the memoized analyzed texts; see :func:`LRUCache.stats`."""
+        return self.__cache.stats()
+
+    def tokenize(self, text):
+        """Returns the list of tokens for the given text (or a list of texts, as for multi-valued fields)."""
+        if isinstance(text, (list, tuple)):
+            tokens = []
+            for value in text:
+                tokens += self.tokenize(value)
+            return tokens
+        if text is None:
+            return []
+        text = str(text)
+        if self.__type == self.KEYWORD:
+            return [text]
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(text):
+            token = match.group().lower()
+            if token.strip("_") == "":
+                continue
+            if len(token) <= self.__max_token_length and token not in self.__stopwords:
+                tokens.append(token)
+        return tokens
+
+    def analyze(self, text):
+        """Returns the analyzed text (tokens joined by a space); same as :func:`Elastic.analyze_query`.
+        Analyzed texts are memoized."""
+        if text.strip() == "":
+            return ""
+        analyzed = self.__cache.lookup(text)
+        if analyzed is LRUCache.MISSING:
+            analyzed = " ".join(self.tokenize(text))
+            self.__cache.put(text, analyzed)
+        return analyzed
+
+    def analyze_batch(self, texts):
+        """Analyzes multiple texts.
+
+        :param texts: list of texts
+        :return: list of analyzed texts (in the same order)
+        """
+        return [self.analyze(text) for text in texts]
+
+
+def analyze_remote(index_name, texts, analyzer=Analyzer.STOP):
+    """Analyzes the texts using Elasticsearch.
+
+    :param index_name: name of the index
+    :param texts: list of texts
+    :param analyzer: name of the analyzer
+    :return: dictionary {text: analyzed text}
+    """
+    from nordlys.core.retrieval.elastic import Elastic
+
+    elastic = Elastic(index_name)
+    return {text: elastic.analyze_query_remote(text, analyzer) for text in texts}
+
+
+def verify(expected, analyzer=Analyzer.STOP):
+    """Compares the output of the local analyzer with that of Elasticsearch.
+
+    :param expected: dictionary {text: analyzed text}, as returned by :func:`analyze_remote` (or recorded earlier)
+    :param analyzer: name of the analyzer
+    :return: list of mismatches [(text, local output, Elasticsearch output), ...]
+    """
+    local = Analyzer(analyzer)
+    mismatches = []
+    for text, es_analyzed in sorted(expected.items()):
+        analyzed = local.analyze(text)
+        if analyzed != es_analyzed:
+            mismatches.append((text, analyzed, es_analyzed))
+    return mismatches
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--index", help="index name", type=str)
+    parser.add_argument("-q", "--query_file", help="query file (JSON)", type=str)
+    parser.add_argument("-a", "--analyzer", help="analyzer name", type=str, default=Analyzer.STOP)
+    parser.add_argument("-o", "--output_file", help="records the Elasticsearch outputs (JSON)", type=str, default=None)
+    parser.add_argument("-f", "--fixture_file", help="recorded Elasticsearch outputs (JSON); used instead of -i",
+                        type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    if args.fixture_file:
+        expected = json.load(open(args.fixture_file))
+    else:
+        queries = json.load(open(args.query_file))
+        expected = analyze_remote(args.index, [queries[qid] for qid in sorted(queries)], args.analyzer)
+        if args.output_file:
+            json.dump(expected, open(args.output_file, "w"), indent=4, sort_keys=True, ensure_ascii=False)
+    mismatches = verify(expected, args.analyzer)
+    for text, analyzed, es_analyzed in mismatches:
+        PLOGGER.info("Mismatch: " + text + "\n\tlocal: " + analyzed + "\n\telastic: " + es_analyzed)
+    PLOGGER.info(str(len(mismatches)) + " mismatches out of " + str(len(expected)) + " texts")
+
+
+if __name__ == "__main__":
+    main(arg_parser())
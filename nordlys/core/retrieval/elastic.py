@@ -26,6 +26,7 @@ The following statistics can be obtained from this class:
   - Document length: :func:`Elastic.doc_length`
   - Document frequency: :func:`Elastic.doc_freq`
   - Collection frequency: :func:`Elastic.coll_term_freq`
+  - Document and collection frequencies of multiple (term, field) pairs: :func:`Elastic.multi_term_stats`
   - Term frequencies: :func:`Elastic.term_freqs`
 
 
@@ -35,18 +36,52 @@ Efficiency considerations
 
   - For efficiency reasons, we do not store term positions during indexing. To store them, see the corresponding mapping functions :func:`Elastic.analyzed_field`, :func:`Elastic.notanalyzed_searchable_field`.
   - Use :py:mod:`ElasticCache <nordlys.core.retrieval.elastic_cache>` for getting index statistics. This module caches the statistics into memory and boosts efficeicny.
-  - Mind that :py:mod:`ElasticCache <nordlys.core.retrieval.elastic_cache>` does not empty the cache!
+  - Queries can be analyzed locally, without a request to Elasticsearch, by setting ``local_analyzer`` to true in
+    ``config/elastic.json``; verify the local analyzers against your index first (see
+    :py:mod:`nordlys.core.retrieval.analyzer`).
+  - All instances share a single Elasticsearch client (and thereby its connection pool) per set of hosts; see
+    :func:`Elastic.get_client`. Pool size, timeout, keep-alive and response compression are set in the
+    ``connection`` section of ``config/elastic.json``.
+  - Mind that :py:mod:`ElasticCache <nordlys.core.retrieval.elastic_cache>` bounds its caches (see the ``cache`` section of ``config/elastic.json``).
 
 
 :Authors: Faegheh Hasibi, Krisztian Balog
 """
 
+import copy
+import os
+import threading
+from bisect import bisect_right
 from pprint import pprint, pformat
 
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, Transport
 from elasticsearch import helpers
 
-from nordlys.config import ELASTIC_HOSTS, ELASTIC_SETTINGS
+from nordlys.config import ELASTIC_HOSTS, ELASTIC_CONNECTION, ELASTIC_SETTINGS, ELASTIC_LOCAL_ANALYZER
+from nordlys.core.retrieval.analyzer import Analyzer, ANALYSIS_SETTINGS
+from nordlys.core.utils import replay, timing
+
+
+class CountingTransport(Transport):
+    """Transport that counts the requests in the active trace; see :py:mod:`nordlys.core.utils.timing`."""
+
+    def perform_request(self, method, url, params=None, body=None):
+        timing.count("es_calls")
+        return super(CountingTransport, self).perform_request(method, url, params=params, body=body)
+
+
+class ReplayTransport(CountingTransport):
+    """Transport that records the responses, or replays them without connecting to Elasticsearch;
+    see :py:mod:`nordlys.core.utils.replay`."""
+
+    def perform_request(self, method, url, params=None, body=None):
+        recording = replay.get_recording(replay.BACKEND_ELASTIC)
+        key = recording.get_key(method, url, params, body)
+        if recording.mode == replay.MODE_REPLAY:
+            timing.count("es_calls")
+            return recording.replay(key)
+        return recording.call(key, super(ReplayTransport, self).perform_request, method, url, params=params,
+                              body=body)
 
 
 class Elastic(object):
@@ -58,10 +93,62 @@ class Elastic(object):
     BM25 = "BM25"
     SIMILARITY = "sim"  # Used when other similarities are used
 
-    def __init__(self, index_name):
-        self.__es = Elasticsearch(hosts=ELASTIC_HOSTS)
+    __clients = {}  # {(pid, hosts, replay mode): Elasticsearch}; shared clients, see :func:`get_client`
+    __clients_lock = threading.Lock()
+
+    def __init__(self, index_name, es=None):
+        """
+        :param index_name: name of the index
+        :param es: Elasticsearch client (default: the shared client for the configured hosts)
+        """
+        self.__es = es if es is not None else Elastic.get_client()
         self.__index_name = index_name
 
+    @staticmethod
+    def get_client(hosts=None):
+        """Returns the shared Elasticsearch client for the given hosts.
+
+        Clients are created once per set of hosts (and per process, as connections cannot be shared with forked
+        processes), using the connection settings in ``config/elastic.json``. If record-and-replay is enabled (see
+        :py:mod:`nordlys.core.utils.replay`), the requests are recorded or replayed.
+
+        :param hosts: list of hosts (default: the configured hosts)
+        """
+        hosts = tuple(hosts if hosts is not None else ELASTIC_HOSTS)
+        key = (os.getpid(), hosts, replay.get_mode())
+        if key not in Elastic.__clients:
+            with Elastic.__clients_lock:
+                if key not in Elastic.__clients:
+                    Elastic.__clients[key] = Elasticsearch(hosts=list(hosts), **Elastic.get_connection_params())
+        return Elastic.__clients[key]
+
+    @staticmethod
+    def get_connection_params(connection=None):
+        """Returns the client parameters for the given connection settings.
+
+        :param connection: dictionary with the keys "maxsize" (number of pooled connections per host), "timeout"
+            (in seconds), "keep_alive" and "compression" (gzip-compressed responses); default: from config
+        """
+        connection = connection if connection is not None else ELASTIC_CONNECTION
+        headers = {"Connection": "keep-alive" if connection.get("keep_alive", True) else "close"}
+        if connection.get("compression", False):
+            headers["Accept-Encoding"] = "gzip, deflate"
+        transport_class = CountingTransport if replay.get_mode() is None else ReplayTransport
+        params = {"headers": headers, "transport_class": transport_class}
+        for param in ["maxsize", "timeout"]:
+            if connection.get(param, None) is not None:
+                params[param] = connection[param]
+        return params
+
+    @property
+    def es(self):
+        """Returns the Elasticsearch client."""
+        return self.__es
+
+    @property
+    def index_name(self):
+        return self.__index_name
+
     @staticmethod
     def analyzed_field(analyzer=ANALYZER_STOP):
         """Returns the mapping for analyzed fields.
@@ -100,13 +187,32 @@ class Elastic(object):
     def __gen_analyzers(self):
         """Gets custom analyzers.
         We include customized analyzers in the index setting, a field may or may not use it.
+        The analyzers are defined in :py:mod:`nordlys.core.retrieval.analyzer`, where they are also run locally.
         """
-        analyzer = {"type": "standard", "stopwords": "_english_"}
-        analyzers = {"analyzer": {Elastic.ANALYZER_STOP: analyzer}}
-        return analyzers
+        return copy.deepcopy(ANALYSIS_SETTINGS)
+
+    @staticmethod
+    def local_analyzer(analyzer):
+        """Returns the local analyzer (or None if the analyzer needs to be run by Elasticsearch)."""
+        if ELASTIC_LOCAL_ANALYZER and Analyzer.is_supported(analyzer):
+            return Analyzer.get(analyzer)
+        return None
 
     def analyze_query(self, query, analyzer=ANALYZER_STOP):
         """Analyzes the query.
+        If ``local_analyzer`` is enabled, analyzers defined in :py:mod:`nordlys.core.retrieval.analyzer` are run locally
+        (no request is sent).
+
+        :param query: raw query
+        :param analyzer: name of analyzer
+        """
+        local_analyzer = self.local_analyzer(analyzer)
+        if local_analyzer is not None:
+            return local_analyzer.analyze(query)
+        return self.analyze_query_remote(query, analyzer)
+
+    def analyze_query_remote(self, query, analyzer=ANALYZER_STOP):
+        """Analyzes the query using Elasticsearch.
 
         :param query: raw query
         :param analyzer: name of analyzer
@@ -115,6 +221,47 @@ class Elastic(object):
             return ""
         body = {"analyzer": analyzer, "text": query}
         tokens = self.__es.indices.analyze(index=self.__index_name, body=body)["tokens"]
+        return self._parse_tokens(tokens)
+
+    def analyze_queries(self, queries, analyzer=ANALYZER_STOP):
+        """Analyzes multiple queries using a single request.
+
+        :param queries: list of raw queries
+        :param analyzer: name of analyzer
+        :return: list of analyzed queries (in the same order)
+        """
+        local_analyzer = self.local_analyzer(analyzer)
+        if local_analyzer is not None:
+            return local_analyzer.analyze_batch(queries)
+        texts = sorted({query for query in queries if query.strip() != ""})
+        analyzed = {}
+        if len(texts) > 0:
+            body = {"analyzer": analyzer, "text": texts}
+            tokens = self.__es.indices.analyze(index=self.__index_name, body=body)["tokens"]
+            for text, text_tokens in zip(texts, self._split_tokens(texts, tokens)):
+                analyzed[text] = self._parse_tokens(text_tokens)
+        return [analyzed.get(query, "") for query in queries]
+
+    @staticmethod
+    def _split_tokens(texts, tokens):
+        """Splits the tokens of an analyze response for multiple texts by text.
+
+        Elasticsearch analyzes the texts as values of a multi-valued field: the offsets of each text are shifted by the
+        (UTF-16) length of the preceding texts plus an offset gap of 1.
+        """
+        ends, end = [], 0
+        for text in texts:
+            end += len(text.encode("utf-16-le")) // 2
+            ends.append(end)
+            end += 1
+        text_tokens = [[] for _ in texts]
+        for t in tokens:
+            text_tokens[bisect_right(ends, t["start_offset"])].append(t)
+        return text_tokens
+
+    @staticmethod
+    def _parse_tokens(tokens):
+        """Returns the analyzed query from the tokens of an analyze response."""
         query_terms = []
         for t in sorted(tokens, key=lambda x: x["position"]):
             query_terms.append(t["token"])
@@ -152,6 +299,10 @@ class Elastic(object):
         if old_similarity != new_similarity:
             self.__update_settings({"similarity": new_similarity})
 
+    def refresh(self):
+        """Refreshes the index (makes all recent changes available for search and stats)."""
+        self.__es.indices.refresh(index=self.__index_name)
+
     def delete_index(self):
         """Deletes an index."""
         self.__es.indices.delete(index=self.__index_name)
@@ -243,12 +394,41 @@ class Elastic(object):
         :param start: starting offset (default: 0)
         :return: dictionary of document IDs with scores
         """
-        hits = self.__es.search(index=self.__index_name, q=query, df=field, _source=False, size=num,
-                                fielddata_fields=fields_return, from_=start)["hits"]["hits"]
-        results = {}
-        for hit in hits:
-            results[hit["_id"]] = {"score": hit["_score"], "fields": hit.get("fields", {})}
-        return results
+        res = self.__es.search(index=self.__index_name, q=query, df=field, _source=False, size=num,
+                               fielddata_fields=fields_return, from_=start)
+        return self._parse_hits(res)
+
+    def multi_search(self, queries, field, num=100, fields_return="", start=0):
+        """Searches multiple queries in a given field using a single multi-search request; see :func:`search`.
+
+        :param queries: list of query strings
+        :return: list of dictionaries of document IDs with scores (in the same order as queries)
+        """
+        if len(queries) == 0:
+            return []
+        body = []
+        for query in queries:
+            body.append({})
+            body.append(self._search_body(query, field, num, fields_return, start))
+        res = self.__es.msearch(index=self.__index_name, doc_type=self.DOC_TYPE, body=body)
+        return [self._parse_hits(r) for r in self._check_responses(res["responses"])]
+
+    @staticmethod
+    def _search_body(query, field, num=100, fields_return="", start=0):
+        """Returns the search body equivalent to the URI search of :func:`search`."""
+        body = {"query": {"query_string": {"query": query, "default_field": field}},
+                "_source": False, "size": num, "from": start}
+        if fields_return:
+            body["fielddata_fields"] = fields_return.split(",")
+        return body
+
+    @staticmethod
+    def _check_responses(responses):
+        """Raises an exception if any of the multi-search responses is an error."""
+        for r in responses:
+            if "error" in r:
+                raise Exception("Multi-search error: " + str(r["error"]))
+        return responses
 
     def search_complex(self, body, num=10, fields_return="", start=0):
         """
@@ -287,10 +467,15 @@ class Elastic(object):
         :param start: starting offset (default: 0)
         :return: dictionary of document IDs with scores
         """
-        hits = self.__es.search(index=self.__index_name, body=body, _source=False, size=num,
-                                fielddata_fields=fields_return, from_=start)["hits"]["hits"]
+        res = self.__es.search(index=self.__index_name, body=body, _source=False, size=num,
+                               fielddata_fields=fields_return, from_=start)
+        return self._parse_hits(res)
+
+    @staticmethod
+    def _parse_hits(res):
+        """Returns dictionary of document IDs with scores from a search response."""
         results = {}
-        for hit in hits:
+        for hit in res["hits"]["hits"]:
             results[hit["_id"]] = {"score": hit["_score"], "fields": hit.get("fields", {})}
         return results
 
@@ -298,6 +483,15 @@ class Elastic(object):
         """Returns stats of the given field."""
         return self.__es.field_stats(index=self.__index_name, fields=[field])["indices"]["_all"]["fields"][field]
 
+    def get_all_field_stats(self, fields=None):
+        """Returns stats of all (or the given) fields of the index in a single request.
+
+        :param fields: list of fields (default: all fields)
+        :return: dictionary {field: {"doc_count": xx, "sum_total_term_freq": xx, ..}, ..}
+        """
+        fields = ",".join(fields) if fields else "*"
+        return self.__es.field_stats(index=self.__index_name, fields=fields)["indices"]["_all"]["fields"]
+
     def get_fields(self):
         """Returns name of fields in the index."""
         return list(self.get_mapping().keys())
@@ -341,6 +535,86 @@ class Elastic(object):
         doc_id = next(iter(hits.keys())) if len(hits) > 0 else None
         return self._get_termvector(doc_id, field, term_stats=True) if doc_id else {}
 
+    def _get_multi_field_termvectors(self, doc_ids, fields, term_stats=False):
+        """Returns multiple term vectors for multiple fields using a single request.
+
+        :param doc_ids: list of document IDs
+        :param fields: list of field names
+        :param term_stats: if True, returns term statistics
+        :return: {'doc_id': {'field': {tv}, ..}, ..}
+        """
+        tv_all = self.__es.mtermvectors(index=self.__index_name, doc_type=self.DOC_TYPE, ids=",".join(doc_ids),
+                                        fields=",".join(fields), term_statistics=term_stats)
+        return self._parse_multi_field_termvectors(tv_all, fields)
+
+    @staticmethod
+    def _parse_multi_field_termvectors(tv_all, fields):
+        """Returns {'doc_id': {'field': {tv}, ..}, ..} from a multi-termvectors response."""
+        result = {}
+        for tv in tv_all["docs"]:
+            doc_tvs = tv.get("term_vectors", {})
+            result[tv["_id"]] = {field: doc_tvs.get(field, {}).get("terms", {}) for field in fields}
+        return result
+
+    def _get_multi_coll_termvectors(self, term_fields):
+        """Returns term vectors containing collection stats for multiple (term, field) pairs.
+        It makes two requests: a multi-search to find a document containing each term, and a multi-termvectors
+        request for all found documents.
+
+        :param term_fields: list of (term, field) pairs
+        :return: {(term, field): {tv}, ..}
+        """
+        term_fields = list(term_fields)
+        if len(term_fields) == 0:
+            return {}
+        responses = self.__es.msearch(index=self.__index_name, doc_type=self.DOC_TYPE,
+                                      body=self._coll_tv_search_body(term_fields))["responses"]
+        term_field_docs, docs = self._coll_tv_docs(term_fields, responses)
+        tv_all = {"docs": []}
+        if len(docs) > 0:
+            tv_all = self.__es.mtermvectors(index=self.__index_name, doc_type=self.DOC_TYPE, body={"docs": docs})
+        return self._parse_coll_termvectors(term_fields, term_field_docs, tv_all)
+
+    @staticmethod
+    def _coll_tv_search_body(term_fields):
+        """Returns the multi-search body for finding a document containing each (term, field)."""
+        body = []
+        for term, field in term_fields:
+            body.append({})
+            body.append({"query": {"bool": {"must": {"term": {field: term}}}}, "size": 1, "_source": False})
+        return body
+
+    @staticmethod
+    def _coll_tv_docs(term_fields, responses):
+        """Returns the found document for each (term, field) and the multi-termvectors request docs.
+
+        :param term_fields: list of (term, field) pairs
+        :param responses: multi-search responses (in the same order as term_fields)
+        :return: {(term, field): doc_id}, [{"_id": doc_id, "fields": [..], "term_statistics": True}, ..]
+        """
+        term_field_docs = {}  # {(term, field): doc_id}
+        doc_fields = {}  # {doc_id: {field, ..}}
+        for (term, field), res in zip(term_fields, responses):
+            hits = res.get("hits", {}).get("hits", [])
+            if len(hits) > 0:
+                term_field_docs[(term, field)] = hits[0]["_id"]
+                doc_fields.setdefault(hits[0]["_id"], set()).add(field)
+        docs = [{"_id": doc_id, "fields": sorted(fields), "term_statistics": True}
+                for doc_id, fields in doc_fields.items()]
+        return term_field_docs, docs
+
+    @staticmethod
+    def _parse_coll_termvectors(term_fields, term_field_docs, tv_all):
+        """Returns {(term, field): {tv}, ..} from a multi-termvectors response."""
+        doc_tvs = {}
+        for tv in tv_all["docs"]:
+            doc_tvs[tv["_id"]] = tv.get("term_vectors", {})
+        result = {}
+        for term, field in term_fields:
+            doc_id = term_field_docs.get((term, field), None)
+            result[(term, field)] = doc_tvs.get(doc_id, {}).get(field, {}).get("terms", {}) if doc_id else {}
+        return result
+
     def num_docs(self):
         """Returns the number of documents in the index."""
         return self.__es.count(index=self.__index_name, doc_type=self.DOC_TYPE)["count"]
@@ -359,7 +633,8 @@ class Elastic(object):
 
     def avg_len(self, field):
         """Returns average length of a field in the collection."""
-        return self.coll_length(field) / self.doc_count(field)
+        stats = self.get_field_stats(field)
+        return stats["sum_total_term_freq"] / stats["doc_count"]
 
     def doc_length(self, doc_id, field):
         """Returns length of a field in a document."""
@@ -367,17 +642,35 @@ class Elastic(object):
 
     def doc_freq(self, term, field, tv=None):
         """Returns document frequency for the given term and field."""
-        coll_tv = tv if tv else self._get_coll_termvector(term, field)
+        coll_tv = tv if tv is not None else self._get_coll_termvector(term, field)
         return coll_tv.get(term, {}).get("doc_freq", 0)
 
     def coll_term_freq(self, term, field, tv=None):
         """ Returns collection term frequency for the given field."""
-        coll_tv = tv if tv else self._get_coll_termvector(term, field)
+        coll_tv = tv if tv is not None else self._get_coll_termvector(term, field)
         return coll_tv.get(term, {}).get("ttf", 0)
 
+    def multi_term_stats(self, term_fields):
+        """Returns document frequency and collection term frequency for multiple (term, field) pairs.
+        All pairs are resolved using two requests; see :func:`Elastic._get_multi_coll_termvectors`.
+
+        :param term_fields: list of (term, field) pairs
+        :return: {(term, field): (doc_freq, coll_term_freq), ..}
+        """
+        return self._parse_term_stats(self._get_multi_coll_termvectors(set(term_fields)))
+
+    @staticmethod
+    def _parse_term_stats(coll_tvs):
+        """Returns {(term, field): (doc_freq, coll_term_freq), ..} from collection term vectors."""
+        stats = {}
+        for (term, field), coll_tv in coll_tvs.items():
+            term_stats = coll_tv.get(term, {})
+            stats[(term, field)] = (term_stats.get("doc_freq", 0), term_stats.get("ttf", 0))
+        return stats
+
     def term_freqs(self, doc_id, field, tv=None):
         """Returns term frequencies of all terms for a given document and field."""
-        doc_tv = tv if tv else self._get_termvector(doc_id, field)
+        doc_tv = tv if tv is not None else self._get_termvector(doc_id, field)
         term_freqs = {}
         for term, val in doc_tv.items():
             term_freqs[term] = val["term_freq"]
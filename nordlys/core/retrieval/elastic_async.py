@@ -0,0 +1,180 @@
+"""
+Elastic Async
+=============
+
+asyncio-native versions of :class:`~nordlys.core.retrieval.elastic.Elastic` and
+:class:`~nordlys.core.retrieval.elastic_cache.ElasticCache`.
+
+The request-level methods (analyze, search, term vectors, and collection stats) are coroutines, so that many queries
+can share a single event loop and overlap their network waits. The statistics fetched by the coroutines are stored
+in the (synchronous) cache tables of :class:`~nordlys.core.retrieval.elastic_cache.ElasticCache`; hence, the
+synchronous stats methods used by the scorers are served from memory after prefetching. All statistics the scorers
+need (term vectors, number of documents, field stats, and term stats) must be prefetched, using
+:func:`AsyncElasticCache.prefetch_termvectors_async` and :func:`AsyncElasticCache.prefetch_stats_async`; otherwise,
+a cache miss is resolved by a synchronous request, which blocks the event loop.
+
+Usage hints
+-----------
+
+  - The async transport is provided by the ``elasticsearch-async`` package (an optional dependency).
+  - Any object with the same coroutine API as ``AsyncElasticsearch`` can be passed as ``es``; e.g.,
+    :class:`~nordlys.bench.async_check.LocalAsyncElasticsearch`, which serves the requests from a local index and is
+    used for checking that queries are processed concurrently (see :py:mod:`nordlys.bench.async_check`).
+  - For async retrieval, see :func:`Retrieval.retrieve_async <nordlys.core.retrieval.retrieval.Retrieval.retrieve_async>`.
+"""
+
+import asyncio
+
+from nordlys.config import ELASTIC_HOSTS
+from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.utils.lru_cache import LRUCache
+
+
+class AsyncElastic(Elastic):
+    """Elastic class with coroutine versions of the request-level methods."""
+
+    def __init__(self, index_name, es=None):
+        """
+        :param index_name: name of the index
+        :param es: async Elasticsearch client (default: AsyncElasticsearch for the configured hosts)
+        """
+        super(AsyncElastic, self).__init__(index_name)
+        self._aes = es
+
+    @property
+    def async_es(self):
+        """Returns the async Elasticsearch client (created on first use)."""
+        if self._aes is None:
+            from elasticsearch_async import AsyncElasticsearch
+            self._aes = AsyncElasticsearch(hosts=ELASTIC_HOSTS)
+        return self._aes
+
+    async def analyze_query_async(self, query, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes the query; see :func:`Elastic.analyze_query`."""
+        local_analyzer = self.local_analyzer(analyzer)
+        if local_analyzer is not None:
+            return local_analyzer.analyze(query)
+        if query.strip() == "":
+            return ""
+        body = {"analyzer": analyzer, "text": query}
+        res = await self.async_es.indices.analyze(index=self.index_name, body=body)
+        return self._parse_tokens(res["tokens"])
+
+    async def search_async(self, query, field, num=100, fields_return="", start=0):
+        """Searches in a given field; see :func:`Elastic.search`."""
+        res = await self.async_es.search(index=self.index_name, q=query, df=field, _source=False, size=num,
+                                         fielddata_fields=fields_return, from_=start)
+        return self._parse_hits(res)
+
+    async def search_complex_async(self, body, num=10, fields_return="", start=0):
+        """Searches using a structured query; see :func:`Elastic.search_complex`."""
+        res = await self.async_es.search(index=self.index_name, body=body, _source=False, size=num,
+                                         fielddata_fields=fields_return, from_=start)
+        return self._parse_hits(res)
+
+    async def num_docs_async(self):
+        """Returns the number of documents in the index."""
+        res = await self.async_es.count(index=self.index_name, doc_type=self.DOC_TYPE)
+        return res["count"]
+
+    async def get_all_field_stats_async(self, fields=None):
+        """Returns stats of all (or the given) fields; see :func:`Elastic.get_all_field_stats`."""
+        fields = ",".join(fields) if fields else "*"
+        res = await self.async_es.field_stats(index=self.index_name, fields=fields)
+        return res["indices"]["_all"]["fields"]
+
+    async def _get_multi_field_termvectors_async(self, doc_ids, fields, term_stats=False):
+        """Returns term vectors for multiple documents and fields; see :func:`Elastic._get_multi_field_termvectors`."""
+        tv_all = await self.async_es.mtermvectors(index=self.index_name, doc_type=self.DOC_TYPE,
+                                                  ids=",".join(doc_ids), fields=",".join(fields),
+                                                  term_statistics=term_stats)
+        return self._parse_multi_field_termvectors(tv_all, fields)
+
+    async def _get_multi_coll_termvectors_async(self, term_fields):
+        """Returns collection term vectors for (term, field) pairs; see :func:`Elastic._get_multi_coll_termvectors`."""
+        term_fields = list(term_fields)
+        if len(term_fields) == 0:
+            return {}
+        res = await self.async_es.msearch(index=self.index_name, doc_type=self.DOC_TYPE,
+                                          body=self._coll_tv_search_body(term_fields))
+        term_field_docs, docs = self._coll_tv_docs(term_fields, res["responses"])
+        tv_all = {"docs": []}
+        if len(docs) > 0:
+            tv_all = await self.async_es.mtermvectors(index=self.index_name, doc_type=self.DOC_TYPE,
+                                                      body={"docs": docs})
+        return self._parse_coll_termvectors(term_fields, term_field_docs, tv_all)
+
+    async def multi_term_stats_async(self, term_fields):
+        """Returns doc frequency and collection term frequency for (term, field) pairs;
+        see :func:`Elastic.multi_term_stats`."""
+        return self._parse_term_stats(await self._get_multi_coll_termvectors_async(set(term_fields)))
+
+
+class AsyncElasticCache(ElasticCache, AsyncElastic):
+    """ElasticCache with coroutines for (pre)fetching the statistics into the cache."""
+
+    def __init__(self, index_name, es=None, **kwargs):
+        """
+        :param index_name: name of the index
+        :param es: async Elasticsearch client (default: AsyncElasticsearch for the configured hosts)
+        :param kwargs: parameters of ElasticCache
+        """
+        super(AsyncElasticCache, self).__init__(index_name, **kwargs)
+        self._aes = es
+
+    async def analyze_query_async(self, query, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes the query and caches the result; cached queries are also served to :func:`analyze_query`."""
+        analyzed = self._get_analyzed(query, analyzer)
+        if analyzed is LRUCache.MISSING:
+            analyzed = await super(AsyncElasticCache, self).analyze_query_async(query, analyzer)
+            self._cache_analyzed(query, analyzer, analyzed)
+        return analyzed
+
+    async def load_field_stats_async(self):
+        """Loads a snapshot of stats of all fields (if not loaded yet); see :func:`ElasticCache.load_field_stats`."""
+        if not self.field_stats_loaded:
+            self._cache_field_stats(await self.get_all_field_stats_async())
+
+    async def multi_term_stats_async(self, term_fields):
+        """Returns doc frequency and collection term frequency for (term, field) pairs; the pairs that are not
+        cached are fetched in a batch. See :func:`ElasticCache.multi_term_stats`."""
+        stats, missing = self._lookup_term_stats(term_fields)
+        fetched = await super(AsyncElasticCache, self).multi_term_stats_async(missing)
+        stats.update(self._cache_term_stats(fetched))
+        return stats
+
+    async def num_docs_async(self):
+        """Returns the number of documents in the index; it is fetched only if not cached."""
+        if not self.num_docs_loaded:
+            self._cache_num_docs(await super(AsyncElasticCache, self).num_docs_async())
+        return self.num_docs()
+
+    async def prefetch_stats_async(self, term_fields):
+        """Loads the collection stats used by the scorers into the cache: number of documents, field stats, and
+        stats of the given (term, field) pairs. The requests are made concurrently.
+
+        :param term_fields: list of (term, field) pairs; see :func:`Scorer.get_term_fields`
+        """
+        await asyncio.gather(self.num_docs_async(), self.load_field_stats_async(),
+                             self.multi_term_stats_async(term_fields))
+
+    async def prefetch_termvectors_async(self, doc_ids, fields, batch=50, num_concurrent=4):
+        """Loads term vectors for a given list of documents and fields into the cache.
+        Batches of documents are fetched concurrently, each with a single request for all fields.
+
+        :param doc_ids: list of document IDs
+        :param fields: list of fields
+        :param batch: number of documents per request
+        :param num_concurrent: max number of concurrent requests
+        """
+        fields = list(fields)
+        missing_ids = self._missing_termvectors(list(doc_ids), fields)
+        semaphore = asyncio.Semaphore(max(1, num_concurrent))
+
+        async def fetch(batch_ids):
+            async with semaphore:
+                tvs = await self._get_multi_field_termvectors_async(batch_ids, fields)
+            self._cache_termvectors(tvs, batch_ids, fields)
+
+        await asyncio.gather(*[fetch(missing_ids[i:i + batch]) for i in range(0, len(missing_ids), batch)])
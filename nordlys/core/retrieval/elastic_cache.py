@@ -11,55 +11,252 @@ usages.
 Usage hints
 -----------
 
-  - Only one instance of Elastic cache needs to be created.
-  - If running out of memory, you need to create a new object of ElasticCache.
+  - Only one instance of Elastic cache needs to be created per index; use :func:`ElasticCache.get_instance` to get the
+    process-wide instance of an index, so that the cached statistics are shared across requests and objects.
+  - Document-level (term vectors, document lengths) and term-level (document and collection frequencies) statistics
+    are kept in bounded LRU caches; see :py:mod:`nordlys.core.utils.lru_cache`. The bounds are read from the
+    ``cache`` section of ``config/elastic.json`` and can be overridden in the constructor.
+  - Empty results (e.g., a document with no content for a field) are cached as well.
+  - Collection statistics (number of documents, field stats and term stats) can be persisted in a
+    :py:mod:`stats store <nordlys.core.retrieval.stats_store>`; they are read from the store at startup (or on cache
+    misses) and newly fetched statistics are written back to it.
+  - Analyzed queries are cached as well; multiple queries can be analyzed using a single request with
+    :func:`ElasticCache.analyze_queries`.
+  - Use :func:`ElasticCache.cache_stats` to get hit/miss/eviction counters and the estimated resident bytes.
+  - Term vectors are cached in a compact form (sorted term ID and term frequency arrays, with a term dictionary shared
+    by all cached term vectors); see :py:mod:`nordlys.core.retrieval.term_vector`. :func:`ElasticCache.term_freqs`
+    returns the cached term vector itself (a read-only mapping {term: tf}), instead of a new dictionary. The term
+    dictionary holds at most ``max_terms`` terms; then, a new dictionary is started (term vectors cached earlier keep
+    their dictionary until they are evicted). Its size is reported by :func:`ElasticCache.cache_stats`.
   - The class also caches termvectors. To further boost efficiency, you can load term vectors for multiple documents using :func:`ElasticCache.multi_termvector`.
+  - Term vectors of multiple documents and fields can be fetched concurrently using
+    :func:`ElasticCache.prefetch_termvectors`; batches are returned as soon as they are loaded, so that they can be
+    scored while the next batches are being fetched.
+  - Similarly, collection stats of multiple (term, field) pairs can be loaded in a batch using :func:`ElasticCache.multi_term_stats`.
 
 
 :Author: Faegheh Hasibi
 """
-from collections import defaultdict
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from nordlys.config import ELASTIC_CACHE
 from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.stats_store import StatsStore
+from nordlys.core.retrieval.term_vector import TermDictionary, TermVector
+from nordlys.core.utils import timing
+from nordlys.core.utils.lru_cache import LRUCache
 
 
 class ElasticCache(Elastic):
-    def __init__(self, index_name):
+    __instances = {}  # {(pid, class, index_name): ElasticCache}; shared instances, see :func:`get_instance`
+    __instances_lock = threading.Lock()
+
+    def __init__(self, index_name, max_docs=None, max_terms=None, max_bytes=None, max_queries=None, stats_store=None):
+        """
+        :param index_name: name of the index
+        :param max_docs: max number of cached (document, field) entries (default: from config; None is unbounded)
+        :param max_terms: max number of cached (field, term) entries, and of terms in the term dictionary of the term
+            vectors (default: from config; None is unbounded)
+        :param max_bytes: max estimated bytes of cached term vectors (default: from config; None is unbounded)
+        :param max_queries: max number of cached analyzed queries (default: from config; None is unbounded)
+        :param stats_store: StatsStore object (default: from config; None is no persistent stats)
+        """
         super(ElasticCache, self).__init__(index_name)
+        max_docs = max_docs if max_docs is not None else ELASTIC_CACHE.get("max_docs", None)
+        max_terms = max_terms if max_terms is not None else ELASTIC_CACHE.get("max_terms", None)
+        max_bytes = max_bytes if max_bytes is not None else ELASTIC_CACHE.get("max_bytes", None)
+        max_queries = max_queries if max_queries is not None else ELASTIC_CACHE.get("max_queries", None)
 
         # Cached variables
+        # Field-level stats are bounded by the number of fields and are kept in plain dictionaries
         self.__num_docs = None
         self.__num_fields = None
         self.__doc_count = {}
         self.__coll_length = {}
         self.__avg_len = {}
-        self.__doc_length = defaultdict(dict)
-        self.__doc_freq = defaultdict(dict)
-        self.__coll_term_freq = defaultdict(dict)
-        self.__tv = defaultdict(dict)
-        self.__coll_tv = defaultdict(dict)
+        self.__fields = None
+        self.__field_stats_loaded = False
+        # Document- and term-level stats grow with the number of requests and are kept in LRU caches
+        self.__doc_length = LRUCache(max_size=max_docs)  # {(doc_id, field): length}
+        self.__doc_freq = LRUCache(max_size=max_terms)  # {(field, term): df}
+        self.__coll_term_freq = LRUCache(max_size=max_terms)  # {(field, term): ctf}
+        self.__max_terms = max_terms
+        self.__term_dict = TermDictionary()
+        self.__term_dict_resets = 0
+        self.__tv = LRUCache(max_size=max_docs, max_bytes=max_bytes)  # {(doc_id, field): TermVector}
+        self.__coll_tv = LRUCache(max_size=max_docs, max_bytes=max_bytes)  # {(doc_id, field): tv with term stats}
+        self.__analyzed = LRUCache(max_size=max_queries)  # {(query, analyzer): analyzed query}
+
+        # Persistent stats
+        if stats_store is None and ELASTIC_CACHE.get("stats_file", None):
+            stats_store = StatsStore(ELASTIC_CACHE["stats_file"], readonly=ELASTIC_CACHE.get("stats_readonly", False))
+        self.__stats_store = stats_store
+        if self.__stats_store is not None:
+            self.__load_stats()
+
+    @classmethod
+    def get_instance(cls, index_name):
+        """Returns the shared (process-wide) cache of the given index; it is created with the default (config)
+        parameters on the first call. As the Elasticsearch client, instances are not shared with forked processes;
+        they are shared by all threads of a process (the LRU caches are thread-safe).
+
+        :param index_name: name of the index
+        """
+        key = (os.getpid(), cls, index_name)
+        if key not in ElasticCache.__instances:
+            with ElasticCache.__instances_lock:
+                if key not in ElasticCache.__instances:
+                    ElasticCache.__instances[key] = cls(index_name)
+        return ElasticCache.__instances[key]
+
+    @property
+    def field_stats_loaded(self):
+        """Returns True if the snapshot of all field stats is loaded."""
+        return self.__field_stats_loaded
+
+    def __load_stats(self):
+        """Warm-starts the cache with the index and field stats from the stats store."""
+        self.__num_docs = self.__stats_store.get_num_docs(self.index_name)
+        field_stats = self.__stats_store.get_all_field_stats(self.index_name)
+        for field, (doc_count, coll_length) in field_stats.items():
+            self.__doc_count[field] = doc_count
+            self.__coll_length[field] = coll_length
+        # the store holds a snapshot of all fields (written by :func:`load_field_stats`)
+        self.__field_stats_loaded = len(field_stats) > 0
+
+    def __set_field_stats(self, field, stats):
+        """Caches (and stores) doc count and collection length of a field."""
+        self.__doc_count[field] = stats["doc_count"]
+        self.__coll_length[field] = stats["sum_total_term_freq"]
+        if self.__stats_store is not None:
+            self.__stats_store.put_field_stats(self.index_name, field, stats["doc_count"], stats["sum_total_term_freq"])
+
+    def __get_field_stats(self, field):
+        """Gets doc count and collection length of a field.
+        On the first call, stats of all fields are loaded using a single request (see :func:`load_field_stats`).
+        """
+        if not self.__field_stats_loaded:
+            self.load_field_stats()
+        if field not in self.__doc_count:
+            self.__set_field_stats(field, self.get_field_stats(field))
+
+    def load_field_stats(self):
+        """Loads a snapshot of stats of all fields in the index using a single request."""
+        self._cache_field_stats(self.get_all_field_stats())
+
+    def _cache_field_stats(self, all_field_stats):
+        """Caches a snapshot of stats of all fields; see :func:`Elastic.get_all_field_stats`."""
+        for field, stats in all_field_stats.items():
+            if "doc_count" in stats and "sum_total_term_freq" in stats:
+                self.__set_field_stats(field, stats)
+        self.__field_stats_loaded = True
+
+    def analyze_query(self, query, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes the query; analyzed queries are cached."""
+        return self.__analyzed.get_or_set((query, analyzer), super(ElasticCache, self).analyze_query, query, analyzer)
+
+    def analyze_queries(self, queries, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes multiple queries; the queries that are not cached are analyzed using a single request."""
+        analyzed = {}
+        for query in queries:
+            analyzed[query] = self._get_analyzed(query, analyzer)
+        missing = [query for query in analyzed if analyzed[query] is LRUCache.MISSING]
+        if len(missing) > 0:
+            for query, analyzed_query in zip(missing, super(ElasticCache, self).analyze_queries(missing, analyzer)):
+                self._cache_analyzed(query, analyzer, analyzed_query)
+                analyzed[query] = analyzed_query
+        return [analyzed[query] for query in queries]
+
+    def _get_analyzed(self, query, analyzer):
+        """Returns the cached analyzed query or ``LRUCache.MISSING``."""
+        return self.__analyzed.lookup((query, analyzer))
+
+    def _cache_analyzed(self, query, analyzer, analyzed_query):
+        """Caches an analyzed query."""
+        self.__analyzed.put((query, analyzer), analyzed_query)
+
+    def get_fields(self):
+        """Returns name of fields in the index."""
+        if self.__fields is None:
+            self.__fields = super(ElasticCache, self).get_fields()
+        return self.__fields
+
+    def __get_term_stats(self, term, field):
+        """Gets doc frequency and collection term frequency of a term from the stats store or the index,
+        and caches them."""
+        stats = None
+        if self.__stats_store is not None:
+            stats = self.__stats_store.get_term_stats(self.index_name, field, term)
+        if stats is None:
+            tv = self.__get_coll_termvector(term, field)
+            stats = (super(ElasticCache, self).doc_freq(term, field, tv=tv),
+                     super(ElasticCache, self).coll_term_freq(term, field, tv=tv))
+            if self.__stats_store is not None:
+                self.__stats_store.put_term_stats(self.index_name, field, term, stats[0], stats[1])
+        self.__doc_freq.put((field, term), stats[0])
+        self.__coll_term_freq.put((field, term), stats[1])
+        return stats
 
     def __get_termvector(self, doc_id, field):
-        """Returns a term vector for a given document and field."""
-        if self.__coll_tv.get(doc_id, {}).get(field, None):
-            return self.__coll_tv[doc_id][field]
-        if self.__tv.get(doc_id, {}).get(field, None) is None:
-            self.__tv[doc_id][field] = self._get_termvector(doc_id, field)
-        return self.__tv[doc_id][field]
+        """Returns a (compact) term vector for a given document and field."""
+        tv = self.__tv.lookup((doc_id, field))
+        if tv is LRUCache.MISSING:
+            if (doc_id, field) in self.__coll_tv:
+                tv = self.__compact(self.__coll_tv.get((doc_id, field)))
+            else:
+                tv = self.__compact(self._get_termvector(doc_id, field))
+            self.__tv.put((doc_id, field), tv)
+        return tv
+
+    def __compact(self, tv):
+        """Converts a term vector of Elasticsearch to a compact term vector."""
+        if self.__max_terms is not None and len(self.__term_dict) >= self.__max_terms:
+            self.__term_dict = TermDictionary()
+            self.__term_dict_resets += 1
+        return TermVector.from_es(self.__term_dict, tv)
 
     def __get_coll_termvector(self, term, field):
         """Returns a term vector containing collection stats of a term."""
         body = {"query": {"bool": {"must": {"term": {field: term}}}}}
         hits = self.search_complex(body, num=1)
         doc_id = next(iter(hits.keys())) if len(hits) > 0 else None
-        if self.__coll_tv.get(doc_id, {}).get(field, None) is None:
-            self.__coll_tv[doc_id][field] = self._get_termvector(doc_id, field, term_stats=True) if doc_id else {}
-        return self.__coll_tv[doc_id][field]
+        if doc_id is None:
+            return {}
+        return self.__coll_tv.get_or_set((doc_id, field), self._get_termvector, doc_id, field, True)
+
+    def cache_stats(self):
+        """Returns hit/miss/eviction counters and estimated resident bytes for each of the cached tables.
+
+        :return: dictionary {table: {"entries": xx, "hits": xx, "misses": xx, ...}, ..., "resident_bytes": xx}
+        """
+        stats = {"doc_length": self.__doc_length.stats(),
+                 "doc_freq": self.__doc_freq.stats(),
+                 "coll_term_freq": self.__coll_term_freq.stats(),
+                 "termvector": self.__tv.stats(),
+                 "coll_termvector": self.__coll_tv.stats(),
+                 "analyzed_query": self.__analyzed.stats(),
+                 "term_dict": {"entries": len(self.__term_dict), "resets": self.__term_dict_resets,
+                               "resident_bytes": self.__term_dict.resident_bytes}}
+        stats["resident_bytes"] = sum(table["resident_bytes"] for table in stats.values())
+        return stats
+
+    @property
+    def num_docs_loaded(self):
+        """Returns True if the number of documents is cached."""
+        return self.__num_docs is not None
+
+    def _cache_num_docs(self, num_docs):
+        """Caches (and stores) the number of documents in the index."""
+        self.__num_docs = num_docs
+        if self.__stats_store is not None:
+            self.__stats_store.put_num_docs(self.index_name, num_docs)
 
     def num_docs(self):
         """Returns the number of documents in the index."""
         if self.__num_docs is None:
-            self.__num_docs = super(ElasticCache, self).num_docs()
+            self._cache_num_docs(super(ElasticCache, self).num_docs())
         return self.__num_docs
 
     def num_fields(self):
@@ -71,58 +268,166 @@ class ElasticCache(Elastic):
     def doc_count(self, field):
         """Returns number of documents with at least one term for the given field."""
         if field not in self.__doc_count:
-            self.__doc_count[field] = super(ElasticCache, self).doc_count(field)
+            self.__get_field_stats(field)
         return self.__doc_count[field]
 
     def coll_length(self, field):
         """Returns length of field in the collection."""
         if field not in self.__coll_length:
-            self.__coll_length[field] = super(ElasticCache, self).coll_length(field)
+            self.__get_field_stats(field)
         return self.__coll_length[field]
 
     def avg_len(self, field):
         """Returns average length of a field in the collection."""
         if field not in self.__avg_len:
-            self.__avg_len[field] = super(ElasticCache, self).avg_len(field)
+            self.__avg_len[field] = self.coll_length(field) / self.doc_count(field)
         return self.__avg_len[field]
 
     def doc_length(self, doc_id, field):
         """Returns length of a field in a document."""
-        if self.__doc_length.get(doc_id, {}).get(field, None) is None:
-            self.__doc_length[doc_id][field] = sum(self.term_freqs(doc_id, field).values())
-        return self.__doc_length[doc_id][field]
+        length = self.__doc_length.lookup((doc_id, field))
+        if length is LRUCache.MISSING:
+            length = self.term_freqs(doc_id, field).length
+            self.__doc_length.put((doc_id, field), length)
+        return length
 
     def doc_freq(self, term, field, tv=None):
         """Returns document frequency for the given term and field."""
-        if self.__doc_freq.get(field, {}).get(term, None) is None:
-            tv = self.__get_coll_termvector(term, field)
-            self.__doc_freq[field][term] = super(ElasticCache, self).doc_freq(term, field, tv=tv)
-        return self.__doc_freq[field][term]
+        df = self.__doc_freq.lookup((field, term))
+        if df is LRUCache.MISSING:
+            df = self.__get_term_stats(term, field)[0]
+        return df
 
     def coll_term_freq(self, term, field, tv=None):
         """ Returns collection term frequency for the given field."""
-        if self.__coll_term_freq.get(field, {}).get(term, None) is None:
-            tv = self.__get_coll_termvector(term, field)
-            self.__coll_term_freq[field][term] = super(ElasticCache, self).coll_term_freq(term, field, tv=tv)
-        return self.__coll_term_freq[field][term]
+        ctf = self.__coll_term_freq.lookup((field, term))
+        if ctf is LRUCache.MISSING:
+            ctf = self.__get_term_stats(term, field)[1]
+        return ctf
+
+    def multi_term_stats(self, term_fields):
+        """Returns document frequency and collection term frequency for multiple (term, field) pairs.
+        Pairs that are neither cached nor in the stats store are fetched from the index in a batch.
+
+        :param term_fields: list of (term, field) pairs
+        :return: {(term, field): (doc_freq, coll_term_freq), ..}
+        """
+        stats, missing = self._lookup_term_stats(term_fields)
+        stats.update(self._cache_term_stats(super(ElasticCache, self).multi_term_stats(missing)))
+        return stats
+
+    def _lookup_term_stats(self, term_fields):
+        """Looks up the stats of (term, field) pairs in the cache and the stats store.
+
+        :param term_fields: list of (term, field) pairs
+        :return: {(term, field): (doc_freq, coll_term_freq), ..} for the found pairs, and the list of missing pairs
+        """
+        stats = {}
+        missing = []
+        for term, field in set(term_fields):
+            df = self.__doc_freq.lookup((field, term))
+            ctf = self.__coll_term_freq.lookup((field, term))
+            if df is not LRUCache.MISSING and ctf is not LRUCache.MISSING:
+                stats[(term, field)] = (df, ctf)
+                continue
+            term_stats = None
+            if self.__stats_store is not None:
+                term_stats = self.__stats_store.get_term_stats(self.index_name, field, term)
+            if term_stats is None:
+                missing.append((term, field))
+            else:
+                stats[(term, field)] = self._cache_term_stats({(term, field): term_stats}, store=False)[(term, field)]
+        return stats, missing
+
+    def _cache_term_stats(self, term_stats, store=True):
+        """Caches (and stores) stats of (term, field) pairs.
+
+        :param term_stats: {(term, field): (doc_freq, coll_term_freq), ..}
+        :param store: if True, the stats are also written to the stats store
+        :return: term_stats
+        """
+        for (term, field), (df, ctf) in term_stats.items():
+            self.__doc_freq.put((field, term), df)
+            self.__coll_term_freq.put((field, term), ctf)
+            if store and self.__stats_store is not None:
+                self.__stats_store.put_term_stats(self.index_name, field, term, df, ctf)
+        return term_stats
 
     def term_freqs(self, doc_id, field, tv=None):
-        """Returns term frequencies for a given document and field."""
-        tv = self.__get_termvector(doc_id, field)
-        return super(ElasticCache, self).term_freqs(doc_id, field, tv)
+        """Returns term frequencies for a given document and field.
+
+        :return: TermVector object (read-only mapping {term: tf})
+        """
+        return self.__get_termvector(doc_id, field)
 
     def term_freq(self, doc_id, field, term):
         """Returns frequency of a term in a given document and field."""
         return self.term_freqs(doc_id, field).get(term, 0)
 
     def multi_termvector(self, doc_ids, field, batch=50):
-        """Returns term vectors for a given document and field."""
+        """Loads term vectors for a given list of documents and field into the cache.
+        Empty term vectors are cached as well, so they are not fetched again one by one.
+        """
+        doc_ids = [doc_id for doc_id in doc_ids if (doc_id, field) not in self.__tv]
         i = 0
         while i < len(doc_ids):
             j = i + batch if i + batch <= len(doc_ids) else len(doc_ids)
             tvs = self._get_multi_termvectors(doc_ids[i:j], field)
-            for doc_id, tv in tvs.items():
-                if tv != {}:
-                    self.__tv[doc_id][field] = tv
+            for doc_id in doc_ids[i:j]:
+                self.__tv.put((doc_id, field), self.__compact(tvs.get(doc_id, {})))
             i += batch
 
+    def prefetch_termvectors(self, doc_ids, fields, batch=50, num_threads=4):
+        """Loads term vectors for a given list of documents and fields into the cache.
+
+        Documents are split into batches; each batch is fetched with a single request (for all fields) and the
+        batches are fetched concurrently on a thread pool. The method returns immediately, and the returned
+        generator yields batches of document IDs (in the given order) as soon as their term vectors are cached.
+
+        :Example:
+
+        .. code-block:: python
+
+            for batch_ids in elastic.prefetch_termvectors(doc_ids, ["names", "catchall"]):
+                scores.update(scorer.score_docs(batch_ids))
+
+        :param doc_ids: list of document IDs
+        :param fields: list of fields
+        :param batch: number of documents per request
+        :param num_threads: max number of concurrent requests
+        :return: generator of lists of document IDs
+        """
+        fields = list(fields)
+        doc_ids = list(doc_ids)
+        batches = [doc_ids[i:i + batch] for i in range(0, len(doc_ids), batch)]
+        executor = ThreadPoolExecutor(max_workers=max(1, num_threads))
+        futures = []
+        for batch_ids in batches:
+            # only the documents that are not cached are fetched
+            missing_ids = self._missing_termvectors(batch_ids, fields)
+            future = executor.submit(self._get_multi_field_termvectors, missing_ids, fields) if missing_ids else None
+            if future is not None:
+                timing.count("es_calls")  # the request is made on a worker thread
+            futures.append((batch_ids, missing_ids, future))
+        executor.shutdown(wait=False)  # submitted requests are still executed
+        return self.__collect_termvectors(futures, fields)
+
+    def __collect_termvectors(self, futures, fields):
+        """Caches fetched term vectors (in the calling thread) and yields the batches of document IDs."""
+        for batch_ids, missing_ids, future in futures:
+            if future is not None:
+                self._cache_termvectors(future.result(), missing_ids, fields)
+            yield batch_ids
+
+    def _missing_termvectors(self, doc_ids, fields):
+        """Returns IDs of documents that have at least one of the given fields not cached."""
+        return [doc_id for doc_id in doc_ids if any((doc_id, f) not in self.__tv for f in fields)]
+
+    def _cache_termvectors(self, tvs, doc_ids, fields):
+        """Caches term vectors of the given documents and fields; missing term vectors are cached as empty.
+
+        :param tvs: {'doc_id': {'field': {tv}, ..}, ..}
+        """
+        for doc_id in doc_ids:
+            for field in fields:
+                self.__tv.put((doc_id, field), self.__compact(tvs.get(doc_id, {}).get(field, {})))
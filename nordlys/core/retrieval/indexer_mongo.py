@@ -11,6 +11,7 @@ See :mod:`~nordlys.core.data.dbpedia.indexer_fsdm` for an example usage of this
 """
 from nordlys.config import MONGO_COLLECTION_DBPEDIA, MONGO_HOST, MONGO_DB, PLOGGER
 from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.elastic_cache import ElasticCache
 from nordlys.core.storage.mongo import Mongo
 # from nordlys.core.utils.logging_utils import PLOGGER
 
@@ -23,7 +24,7 @@ class IndexerMongo(object):
         self.__mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
         self.__model = model
 
-    def build(self, callback_get_doc_content, bulk_size=1000):
+    def build(self, callback_get_doc_content, bulk_size=1000, stats_store=None):
         """Builds the DBpedia index from the mongo collection.
 
         To speedup indexing, we index documents as a bulk.
@@ -31,6 +32,7 @@ class IndexerMongo(object):
 
         :param callback_get_doc_content: a function that get a documet from mongo and return the content for indexing
         :param bulk_size: Number of documents to be added to the index as a bulk
+        :param stats_store: StatsStore object; if given, a snapshot of index and field stats is written to it
         """
         PLOGGER.info("Building " + self.__index_name + " ...")
         elastic = Elastic(self.__index_name)
@@ -54,4 +56,14 @@ class IndexerMongo(object):
                 PLOGGER.info(str(i / 1000) + "K documents indexed")
         # indexing the last bulk of documents
         elastic.add_docs_bulk(docs)
-        PLOGGER.info("Finished indexing (" + str(i) + " documents in total)")
\ No newline at end of file
+        PLOGGER.info("Finished indexing (" + str(i) + " documents in total)")
+
+        # writes a snapshot of the index and field stats next to the index
+        if stats_store is not None:
+            elastic.refresh()
+            stats_store.delete_index(self.__index_name)
+            elastic_cache = ElasticCache(self.__index_name, stats_store=stats_store)
+            elastic_cache.num_docs()
+            elastic_cache.load_field_stats()
+            stats_store.flush()
+            PLOGGER.info("Field stats are written to the stats store")
\ No newline at end of file
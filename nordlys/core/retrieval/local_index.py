@@ -0,0 +1,468 @@
+"""
+Local Index
+===========
+
+In-process inverted index; an alternative backend to Elasticsearch for small and medium-sized collections (up to a
+few million documents), unit testing, and reproducible benchmarking.
+
+:class:`LocalIndex` has the same retrieval and statistics interface as
+:class:`~nordlys.core.retrieval.elastic_cache.ElasticCache` (search, analyze_query, term_freqs, doc_freq,
+coll_term_freq, doc_length, coll_length, multi_termvector, ...). Therefore, it can be passed to
+:class:`~nordlys.core.retrieval.retrieval.Retrieval`, the scorers, and the feature classes instead of an Elastic
+object; all statistics are then read from memory-mapped arrays, without any network round trip.
+
+
+Index layout
+------------
+
+An index is a directory with the following files:
+
+  - ``meta.json``: field names and analyzers, number of documents, and field stats
+  - ``doc_ids.bin`` and ``doc_id_offsets.npy``: external document IDs, UTF-8 encoded and sorted bytewise (position is
+    the internal document ID)
+  - ``<field>.terms.bin`` and ``<field>.term_offsets.npy``: sorted term dictionary of the field (position is the term
+    ID)
+  - ``<field>.npz``-like NumPy arrays (``<field>.<array>.npy``), which are memory-mapped:
+      - postings: ``post_offsets`` (per term), ``post_docs`` (delta-encoded document IDs), ``post_tfs``
+      - forward vectors: ``fwd_offsets`` (per document), ``fwd_terms`` (sorted term IDs), ``fwd_tfs``
+      - ``doc_len`` (per document), ``ctf`` (collection term frequency per term), and ``max_tf`` (highest frequency of
+        the term in a single document; used for the score upper bounds of pruning, see
+        :func:`Scorer.get_max_term_freqs <nordlys.core.retrieval.scorer.Scorer.get_max_term_freqs>`)
+
+Postings and forward vectors are compressed by delta-encoding (document IDs only) and by using the smallest unsigned
+integer type that holds the values. Document IDs and terms are sorted string tables (as in
+:py:mod:`~nordlys.core.storage.sstable`), which are memory-mapped too and looked up by binary search; therefore, opening
+an index does not load anything into Python objects, and all processes using the same index share the same pages.
+
+
+Usage
+-----
+
+Indexing follows the same steps as for Elastic (see :py:mod:`nordlys.core.retrieval.toy_indexer`)::
+
+    index = LocalIndexWriter("path/to/index_dir")
+    index.create_index(mappings)
+    index.add_docs_bulk(docs)
+    index.close()
+
+Retrieval::
+
+    index = LocalIndex.get_instance("path/to/index_dir")
+    Retrieval(config, index).retrieve("gonna friends")
+
+The services select the local index with the ``local_index_dir`` config parameter (see
+:py:mod:`~nordlys.core.retrieval.retrieval`, :py:mod:`~nordlys.services.el`, and :py:mod:`~nordlys.services.tti`),
+which is resolved by :func:`get_index`.
+
+Search uses BM25 (k1=1.2, b=0.75), which is the default similarity of Elasticsearch.
+"""
+
+import functools
+import json
+import math
+import mmap
+import os
+import threading
+from collections import defaultdict
+
+import numpy
+
+from nordlys.core.retrieval.analyzer import Analyzer
+from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.utils.ranked_list import rank_indices
+
+
+def _min_uint_dtype(max_value):
+    """Returns the smallest unsigned integer type that holds the given value."""
+    for dtype in [numpy.uint8, numpy.uint16, numpy.uint32]:
+        if max_value <= numpy.iinfo(dtype).max:
+            return dtype
+    return numpy.uint64
+
+
+def _save_strings(path, offsets_path, strings):
+    """Writes UTF-8 encoded strings (in the given order) to ``path`` and their offsets to ``offsets_path``."""
+    offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+    with open(path, "wb") as f:
+        for i, s in enumerate(strings):
+            s = s.encode("utf-8")
+            f.write(s)
+            offsets[i + 1] = offsets[i] + len(s)
+    numpy.save(offsets_path, offsets)
+
+
+class _StringTable(object):
+    """Memory-mapped table of strings sorted bytewise; maps strings to their positions and back."""
+
+    def __init__(self, path, offsets_path, max_cache=100000):
+        """
+        :param path: path of the strings file
+        :param offsets_path: path of the offsets file
+        :param max_cache: max number of memoized lookups (see :func:`find`)
+        """
+        with open(path, "rb") as f:
+            self.__data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 \
+                else b""
+        # a memoryview of the offsets, as indexing it is much faster than indexing a (memory-mapped) NumPy array
+        self.__offsets = memoryview(numpy.load(offsets_path, mmap_mode="r"))
+        self.__len = len(self.__offsets) - 1
+        self.find = functools.lru_cache(maxsize=max_cache)(self.__find)
+        self.get = functools.lru_cache(maxsize=max_cache)(self.__getitem__)  # memoized version of ``table[i]``
+
+    def __len__(self):
+        return self.__len
+
+    def __getitem__(self, i):
+        return self.__data[self.__offsets[i]:self.__offsets[i + 1]].decode("utf-8")
+
+    def __find(self, s):
+        """Returns the position of the string (or None if the string is not in the table); memoized as :func:`find`.
+        """
+        s = s.encode("utf-8")
+        data, offsets = self.__data, self.__offsets
+        lo, hi = 0, self.__len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_s = data[offsets[mid]:offsets[mid + 1]]
+            if mid_s < s:
+                lo = mid + 1
+            elif mid_s > s:
+                hi = mid
+            else:
+                return mid
+        return None
+
+
+def get_index(index_name, local_index_dir=None):
+    """Returns the shared LocalIndex of the given directory, or the shared ElasticCache of the index if no directory is
+    given (i.e., the ``local_index_dir`` config parameter of the services).
+
+    :param index_name: Elasticsearch index name
+    :param local_index_dir: local index directory (optional)
+    """
+    if local_index_dir:
+        return LocalIndex.get_instance(local_index_dir)
+    return ElasticCache.get_instance(index_name)
+
+
+def _get_analyzer(mapping):
+    """Returns the analyzer name for an Elastic field mapping (None if the field is not searchable)."""
+    if mapping.get("index", None) == "not_analyzed":
+        return None
+    return mapping.get("analyzer", Elastic.ANALYZER_STOP)
+
+
+class LocalIndexWriter(object):
+    """Builds a local index; all postings are kept in memory until :func:`close` is called."""
+
+    def __init__(self, index_dir):
+        self.__index_dir = index_dir
+        self.__analyzers = {}  # {field: Analyzer}
+        self.__doc_ids = []
+        self.__fwd = defaultdict(list)  # {field: [{term: tf}, ...]}
+
+    def create_index(self, mappings, model=Elastic.BM25, model_params=None, force=False):
+        """Defines the fields of the index.
+
+        :param mappings: field mappings (same as for :func:`Elastic.create_index`)
+        :param model: similarity for search; only Elastic.BM25 (with default parameters) is supported
+        :param model_params: not supported (for compatibility with Elastic)
+        :param force: overwrites the index if it already exists
+        """
+        if model != Elastic.BM25 or model_params:
+            raise Exception("Only BM25 with default parameters is supported by the local index.")
+        if os.path.exists(os.path.join(self.__index_dir, "meta.json")) and not force:
+            raise Exception("Index " + self.__index_dir + " already exists.")
+        for field, mapping in mappings.items():
+            analyzer = _get_analyzer(mapping)
+            if analyzer is not None:
+                self.__analyzers[field] = Analyzer(analyzer)
+
+    def add_docs_bulk(self, docs):
+        """Adds a set of documents to the index.
+
+        :param docs: dictionary {doc_id: doc}
+        """
+        for doc_id, doc in docs.items():
+            self.add_doc(doc_id, doc)
+
+    def add_doc(self, doc_id, contents):
+        """Adds a document with the specified contents to the index."""
+        self.__doc_ids.append(str(doc_id))
+        for field, analyzer in self.__analyzers.items():
+            term_freqs = {}
+            for term in analyzer.tokenize(contents.get(field, None)):
+                term_freqs[term] = term_freqs.get(term, 0) + 1
+            self.__fwd[field].append(term_freqs)
+
+    def close(self):
+        """Writes the index to the disk."""
+        if not os.path.exists(self.__index_dir):
+            os.makedirs(self.__index_dir)
+        # documents are renumbered in the (bytewise) order of their IDs
+        order = sorted(range(len(self.__doc_ids)), key=lambda i: self.__doc_ids[i].encode("utf-8"))
+        doc_ids = [self.__doc_ids[i] for i in order]
+        for prev, doc_id in zip(doc_ids, doc_ids[1:]):
+            if prev == doc_id:
+                raise Exception("Duplicate document ID " + doc_id)
+        meta = {"num_docs": len(doc_ids), "fields": {}}
+        for field, analyzer in self.__analyzers.items():
+            fwd = self.__fwd[field]
+            meta["fields"][field] = self.__write_field(field, [fwd[i] for i in order])
+            meta["fields"][field]["analyzer"] = analyzer.name
+        _save_strings(os.path.join(self.__index_dir, "doc_ids.bin"),
+                      os.path.join(self.__index_dir, "doc_id_offsets.npy"), doc_ids)
+        json.dump(meta, open(os.path.join(self.__index_dir, "meta.json"), "w"), indent=4, sort_keys=True)
+
+    def __save(self, field, name, array):
+        numpy.save(os.path.join(self.__index_dir, field + "." + name + ".npy"), array)
+
+    def __write_field(self, field, fwd):
+        """Writes postings and forward vectors of a field; returns the field stats."""
+        terms = sorted({t for term_freqs in fwd for t in term_freqs}, key=lambda t: t.encode("utf-8"))
+        term_ids = {t: i for i, t in enumerate(terms)}
+        _save_strings(os.path.join(self.__index_dir, field + ".terms.bin"),
+                      os.path.join(self.__index_dir, field + ".term_offsets.npy"), terms)
+
+        # forward vectors (term IDs are sorted per document)
+        fwd_offsets = numpy.zeros(len(fwd) + 1, dtype=numpy.int64)
+        fwd_terms, fwd_tfs = [], []
+        postings = [[] for _ in terms]  # [[(doc, tf), ..], ..]
+        for doc, term_freqs in enumerate(fwd):
+            for tid, tf in sorted((term_ids[t], tf) for t, tf in term_freqs.items()):
+                fwd_terms.append(tid)
+                fwd_tfs.append(tf)
+                postings[tid].append((doc, tf))
+            fwd_offsets[doc + 1] = len(fwd_terms)
+        fwd_tfs = numpy.array(fwd_tfs, dtype=numpy.int64)
+        doc_len = numpy.array([sum(term_freqs.values()) for term_freqs in fwd], dtype=numpy.int64)
+        max_tf = int(fwd_tfs.max()) if len(fwd_tfs) > 0 else 0
+        self.__save(field, "fwd_offsets", fwd_offsets)
+        self.__save(field, "fwd_terms", numpy.array(fwd_terms, dtype=_min_uint_dtype(max(len(terms), 1))))
+        self.__save(field, "fwd_tfs", fwd_tfs.astype(_min_uint_dtype(max_tf)))
+        self.__save(field, "doc_len", doc_len.astype(_min_uint_dtype(int(doc_len.max()) if len(doc_len) else 0)))
+
+        # postings (document IDs are delta-encoded)
+        post_offsets = numpy.zeros(len(terms) + 1, dtype=numpy.int64)
+        post_docs, post_tfs, ctf, term_max_tf = [], [], [], []
+        for tid, plist in enumerate(postings):
+            prev = 0
+            for doc, tf in plist:
+                post_docs.append(doc - prev)
+                post_tfs.append(tf)
+                prev = doc
+            post_offsets[tid + 1] = len(post_docs)
+            ctf.append(sum(tf for _, tf in plist))
+            term_max_tf.append(max(tf for _, tf in plist))
+        max_delta = max(post_docs) if post_docs else 0
+        self.__save(field, "post_offsets", post_offsets)
+        self.__save(field, "post_docs", numpy.array(post_docs, dtype=_min_uint_dtype(max_delta)))
+        self.__save(field, "post_tfs", numpy.array(post_tfs, dtype=_min_uint_dtype(max_tf)))
+        self.__save(field, "ctf", numpy.array(ctf, dtype=numpy.int64))
+        self.__save(field, "max_tf", numpy.array(term_max_tf, dtype=_min_uint_dtype(max_tf)))
+        return {"doc_count": int((doc_len > 0).sum()), "sum_total_term_freq": int(doc_len.sum())}
+
+
+class LocalIndex(object):
+    """Read-only access to a local index; implements the retrieval and stats interface of ElasticCache."""
+    BM25_K1 = 1.2
+    BM25_B = 0.75
+    __indices = {}  # {index_dir: LocalIndex}; shared instances, see :func:`get_instance`
+    __indices_lock = threading.Lock()
+
+    def __init__(self, index_dir):
+        self.__index_dir = index_dir
+        self.__meta = json.load(open(os.path.join(index_dir, "meta.json")))
+        self.__doc_ids = _StringTable(os.path.join(index_dir, "doc_ids.bin"),
+                                      os.path.join(index_dir, "doc_id_offsets.npy"))
+        self.__fields = {}  # {field: {array_name: array, "terms": _StringTable}}
+        self.__fields_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance(index_dir):
+        """Returns the shared LocalIndex object of an index directory."""
+        if index_dir not in LocalIndex.__indices:
+            with LocalIndex.__indices_lock:
+                if index_dir not in LocalIndex.__indices:
+                    LocalIndex.__indices[index_dir] = LocalIndex(index_dir)
+        return LocalIndex.__indices[index_dir]
+
+    @property
+    def index_name(self):
+        return os.path.basename(os.path.normpath(self.__index_dir))
+
+    def __field(self, field):
+        """Loads (memory-maps) the arrays of a field."""
+        if field not in self.__fields:
+            if field not in self.__meta["fields"]:
+                raise Exception("Field " + field + " is not in the index.")
+            with self.__fields_lock:
+                if field not in self.__fields:
+                    data = {}
+                    for name in ["fwd_offsets", "fwd_terms", "fwd_tfs", "doc_len", "post_offsets", "post_docs",
+                                 "post_tfs", "ctf"]:
+                        data[name] = numpy.load(os.path.join(self.__index_dir, field + "." + name + ".npy"),
+                                                mmap_mode="r")
+                    # scalar lookups use memoryviews (much faster than indexing memory-mapped NumPy arrays)
+                    data["max_tf"] = self.__load_max_tf(field, data)
+                    data["views"] = {name: memoryview(data[name]) for name in
+                                     ["fwd_offsets", "fwd_terms", "fwd_tfs", "doc_len", "post_offsets", "ctf",
+                                      "max_tf"]}
+                    data["terms"] = _StringTable(os.path.join(self.__index_dir, field + ".terms.bin"),
+                                                 os.path.join(self.__index_dir, field + ".term_offsets.npy"))
+                    self.__fields[field] = data
+        return self.__fields[field]
+
+    def __load_max_tf(self, field, data):
+        """Loads the max term frequencies of a field; they are computed from the postings for indices written
+        without them."""
+        path = os.path.join(self.__index_dir, field + ".max_tf.npy")
+        if os.path.exists(path):
+            return numpy.load(path, mmap_mode="r")
+        post_offsets = numpy.asarray(data["post_offsets"])
+        if len(post_offsets) < 2:
+            return numpy.zeros(0, dtype=numpy.int64)
+        return numpy.maximum.reduceat(numpy.asarray(data["post_tfs"], dtype=numpy.int64), post_offsets[:-1])
+
+    def __postings(self, field, term):
+        """Returns (internal doc IDs, term frequencies) of a term."""
+        data = self.__field(field)
+        tid = data["terms"].find(term)
+        if tid is None:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+        start, end = data["post_offsets"][tid], data["post_offsets"][tid + 1]
+        docs = numpy.cumsum(data["post_docs"][start:end], dtype=numpy.int64)
+        return docs, numpy.asarray(data["post_tfs"][start:end], dtype=numpy.int64)
+
+    # =========================================
+    # ================ Search =================
+    # =========================================
+    def analyze_query(self, query, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes the query."""
+        return Analyzer.get(analyzer).analyze(query)
+
+    def analyze_queries(self, queries, analyzer=Elastic.ANALYZER_STOP):
+        """Analyzes multiple queries."""
+        return [self.analyze_query(query, analyzer) for query in queries]
+
+    def multi_search(self, queries, field, num=100, fields_return="", start=0):
+        """Searches multiple queries in a given field; see :func:`search`."""
+        return [self.search(query, field, num=num, fields_return=fields_return, start=start) for query in queries]
+
+    def search(self, query, field, num=100, fields_return="", start=0):
+        """Searches in a given field using BM25.
+
+        :param query: query string
+        :param field: field to search in
+        :param num: number of hits to return (default: 100)
+        :param fields_return: not supported (for compatibility with Elastic)
+        :param start: starting offset (default: 0)
+        :return: dictionary of document IDs with scores
+        """
+        terms = Analyzer.get(self.__meta["fields"][field]["analyzer"]).tokenize(query)
+        doc_count = self.doc_count(field)
+        avg_len = self.avg_len(field) if doc_count > 0 else 0
+        doc_len = self.__field(field)["doc_len"]
+
+        scores = numpy.zeros(self.num_docs())
+        matched = numpy.zeros(self.num_docs(), dtype=bool)
+        for term in terms:
+            docs, tfs = self.__postings(field, term)
+            if len(docs) == 0:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.BM25_K1 * (1 - self.BM25_B + self.BM25_B * doc_len[docs] / avg_len)
+            numpy.add.at(scores, docs, idf * tfs * (self.BM25_K1 + 1) / (tfs + norm))
+            matched[docs] = True
+
+        candidates = numpy.flatnonzero(matched)
+        ranked = candidates[rank_indices(scores[candidates], num=num, start=start)]
+        return {self.__doc_ids[d]: {"score": float(scores[d]), "fields": {}} for d in ranked}
+
+    # =========================================
+    # ================= Stats =================
+    # =========================================
+    def num_docs(self):
+        """Returns the number of documents in the index."""
+        return self.__meta["num_docs"]
+
+    def num_fields(self):
+        """Returns number of fields in the index."""
+        return len(self.__meta["fields"])
+
+    def get_fields(self):
+        """Returns name of fields in the index."""
+        return list(self.__meta["fields"].keys())
+
+    def get_field_stats(self, field):
+        """Returns stats of the given field."""
+        return self.__meta["fields"][field]
+
+    def get_all_field_stats(self, fields=None):
+        """Returns stats of all (or the given) fields."""
+        return {f: self.__meta["fields"][f] for f in (fields if fields else self.get_fields())}
+
+    def doc_count(self, field):
+        """Returns number of documents with at least one term for the given field."""
+        return self.__meta["fields"][field]["doc_count"]
+
+    def coll_length(self, field):
+        """Returns length of field in the collection."""
+        return self.__meta["fields"][field]["sum_total_term_freq"]
+
+    def avg_len(self, field):
+        """Returns average length of a field in the collection."""
+        return self.coll_length(field) / self.doc_count(field)
+
+    def doc_length(self, doc_id, field):
+        """Returns length of a field in a document."""
+        doc = self.__doc_ids.find(str(doc_id))
+        return self.__field(field)["views"]["doc_len"][doc] if doc is not None else 0
+
+    def doc_freq(self, term, field, tv=None):
+        """Returns document frequency for the given term and field."""
+        data = self.__field(field)
+        tid = data["terms"].find(term)
+        post_offsets = data["views"]["post_offsets"]
+        return post_offsets[tid + 1] - post_offsets[tid] if tid is not None else 0
+
+    def coll_term_freq(self, term, field, tv=None):
+        """Returns collection term frequency for the given field."""
+        data = self.__field(field)
+        tid = data["terms"].find(term)
+        return data["views"]["ctf"][tid] if tid is not None else 0
+
+    def max_term_freq(self, term, field):
+        """Returns the highest frequency of a term in a single document of the given field."""
+        data = self.__field(field)
+        tid = data["terms"].find(term)
+        return data["views"]["max_tf"][tid] if tid is not None else 0
+
+    def multi_term_stats(self, term_fields):
+        """Returns document frequency and collection term frequency for multiple (term, field) pairs."""
+        return {(t, f): (self.doc_freq(t, f), self.coll_term_freq(t, f)) for t, f in set(term_fields)}
+
+    def term_freqs(self, doc_id, field, tv=None):
+        """Returns term frequencies of all terms for a given document and field."""
+        doc = self.__doc_ids.find(str(doc_id))
+        if doc is None:
+            return {}
+        views = self.__field(field)["views"]
+        start, end = views["fwd_offsets"][doc], views["fwd_offsets"][doc + 1]
+        get_term = self.__field(field)["terms"].get
+        return {get_term(tid): tf for tid, tf in zip(views["fwd_terms"][start:end].tolist(),
+                                                     views["fwd_tfs"][start:end].tolist())}
+
+    def term_freq(self, doc_id, field, term):
+        """Returns frequency of a term in a given document and field."""
+        return self.term_freqs(doc_id, field).get(term, 0)
+
+    def multi_termvector(self, doc_ids, field, batch=50):
+        """Term vectors are memory-mapped; nothing needs to be loaded (for compatibility with ElasticCache)."""
+        pass
+
+    def prefetch_termvectors(self, doc_ids, fields, batch=50, num_threads=4):
+        """Yields batches of document IDs (for compatibility with ElasticCache; term vectors are memory-mapped)."""
+        doc_ids = list(doc_ids)
+        return (doc_ids[i:i + batch] for i in range(0, len(doc_ids), batch))
@@ -13,6 +13,16 @@ Usage
 
 If `-q <query>` is passed, it returns the results for the specified query and prints them in terminal.
 
+Async usage
+~~~~~~~~~~~
+
+When an :class:`~nordlys.core.retrieval.elastic_async.AsyncElasticCache` object is passed to :class:`Retrieval`,
+queries can be scored using :func:`Retrieval.retrieve_async` and :func:`Retrieval.batch_retrieval_async`; this way,
+many queries share one event loop and overlap their first-pass searches, analyze calls and term vector fetches::
+
+    retrieval = Retrieval(config, AsyncElasticCache.get_instance(config["index_name"]))
+    asyncio.run(retrieval.batch_retrieval_async(num_concurrent=10))
+
 
 Config parameters
 ------------------
@@ -24,16 +34,41 @@ Config parameters
       - **fields_return**: comma-separated list of fields to return for each hit (default: "")
 - **num_docs**: number of documents to return (default: 100)
 - **start**: starting offset for ranked documents (default:0)
-- **model**: name of retrieval model; accepted values: [lm, mlm, prms] (default: lm)
+- **model**: name of retrieval model; accepted values: [lm, mlm, prms, bm25, bm25f] (default: lm);
+  bm25 returns the first-pass (Elasticsearch) scores, unless a scorer is passed to :func:`Retrieval.retrieve` (see
+  :class:`~nordlys.core.retrieval.scorer.ScorerBM25`)
 - **field**: field name for LM (default: catchall)
 - **fields**: single field name for LM (default: catchall)
               list of fields for PRMS (default: [catchall])
-              dictionary with fields and corresponding weights for MLM (default: {catchall: 1})
+              dictionary with fields and corresponding weights for MLM and BM25F (default: {catchall: 1})
 - **smoothing_method**: accepted values: [jm, dirichlet] (default: dirichlet)
 - **smoothing_param**: value of lambda or mu; accepted values: [float or "avg_len"], (jm default: 0.1, dirichlet default: 2000)
+- **k1**: term frequency saturation parameter of BM25F (default: 1.2)
+- **b**: length normalization parameter of BM25F; a float or a dictionary with a value per field (default: 0.75)
+- **batch_scoring**: if True, second-pass scores of all documents are computed at once using array operations (default: True)
+- **tv_batch_size**: number of documents per term vector request in the second pass (default: 50)
+- **tv_num_threads**: max number of concurrent term vector requests in the second pass (default: 4)
+- **local_index_dir**: directory of a :class:`~nordlys.core.retrieval.local_index.LocalIndex` to be used instead of
+  Elasticsearch (default: None)
+- **pruning**: if True, second-pass scoring skips documents that cannot enter the top-k results, based on score upper
+  bounds computed from document lengths and term stats; only the top-k documents are guaranteed to be in the
+  results, while the number of hits (see :func:`Retrieval.retrieve_with_hits`) is that of the first pass.
+  Supported models: [lm, mlm, bm25f] (default: False).
+  The bounds assume that each query term occurs in the document with its highest frequency in the collection, which
+  is stored in a :class:`~nordlys.core.retrieval.local_index.LocalIndex`; therefore, pruning is effective with a
+  local index and for short queries and small k. With Elasticsearch, the term frequencies are bounded by collection
+  stats only, and LM and MLM documents are hardly ever pruned (see
+  :func:`Scorer.get_max_term_freqs <nordlys.core.retrieval.scorer.Scorer.get_max_term_freqs>`)
+- **pruning_k**: number of top documents preserved by pruning (default: start + num_docs)
 - **query_file**: name of query file (JSON),
 - **output_file**: name of output file,
 - **run_id**: run id for TREC output
+- **query_batch_size**: number of queries that are analyzed and searched (first pass) together in batch retrieval,
+  using a single request each (default: 50)
+- **num_workers**: number of parallel workers in batch retrieval; each worker has its own ElasticCache, in both
+  process and thread mode (default: 1)
+- **parallel_mode**: type of workers; accepted values: [process, thread] (default: process)
+- **resume**: if True, batch retrieval skips the queries that are already in the output file (default: False)
 
 
 Example config
@@ -59,24 +94,76 @@ Example config
 :Authors: Krisztian Balog, Faegheh Hasibi
 """
 import argparse
+import asyncio
+import heapq
 import json
+import os
 import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import time
 from pprint import pprint
 
 from nordlys.core.retrieval.elastic import Elastic
 from nordlys.core.retrieval.elastic_cache import ElasticCache
-from nordlys.core.retrieval.scorer import Scorer, ScorerLM
+from nordlys.core.retrieval.local_index import get_index
+from nordlys.core.retrieval.scorer import Scorer, ScorerLM, ScorerBM25F
 from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.utils.ranked_list import rank, trec_lines
+from nordlys.core.utils.timing import stage, timed, timed_iter
 from nordlys.config import PLOGGER
 
 
+class TopKThreshold(object):
+    """Keeps the k-th highest score seen so far, for pruning documents by their score upper bounds."""
+
+    def __init__(self, k, tolerance=1e-9):
+        """
+        :param k: number of top documents
+        :param tolerance: relative tolerance for rounding errors of the upper bounds
+        """
+        self.__k = k
+        self.__tolerance = tolerance
+        self.__heap = []  # min-heap of the k highest scores
+
+    @property
+    def threshold(self):
+        """Returns the k-th highest score (or None if less than k documents are scored)."""
+        return self.__heap[0] if len(self.__heap) >= self.__k else None
+
+    def update(self, scores):
+        """Adds scores to the top-k; None scores are ignored."""
+        for score in scores:
+            if score is None:
+                continue
+            if len(self.__heap) < self.__k:
+                heapq.heappush(self.__heap, score)
+            elif score > self.__heap[0]:
+                heapq.heapreplace(self.__heap, score)
+
+    def prune(self, doc_ids, upper_bounds):
+        """Splits documents into the ones that can enter the top-k and the ones that cannot.
+
+        :param doc_ids: list of document IDs
+        :param upper_bounds: upper bounds of the document scores (None: no bounds)
+        :return: two lists of document IDs (to be scored, pruned)
+        """
+        threshold = self.threshold
+        if upper_bounds is None or threshold is None:
+            return list(doc_ids), []
+        threshold -= self.__tolerance * abs(threshold)
+        kept, pruned = [], []
+        for doc_id, upper_bound in zip(doc_ids, upper_bounds):
+            (kept if upper_bound >= threshold else pruned).append(doc_id)
+        return kept, pruned
+
+
 class Retrieval(object):
-    FIELDED_MODELS = {"mlm", "prms"}
+    FIELDED_MODELS = {"mlm", "prms", "bm25f"}
     LM_MODELS = {"lm", "mlm", "prms"}
 
-    def __init__(self, config):
+    def __init__(self, config, elastic=None):
         self.check_config(config)
         self.__config = config
         self.__index_name = config["index_name"]
@@ -90,8 +177,20 @@ class Retrieval(object):
         self.__query_file = config.get("query_file", None)
         self.__output_file = config.get("output_file", None)
         self.__run_id = config.get("run_id", self.__model)
-
-        self.__elastic = ElasticCache(self.__index_name)
+        self.__batch_scoring = config.get("batch_scoring", True)
+        self.__tv_batch_size = int(config.get("tv_batch_size", 50))
+        self.__tv_num_threads = int(config.get("tv_num_threads", 4))
+        self.__pruning = config.get("pruning", False)
+        self.__pruning_k = int(config.get("pruning_k", self.__start + self.__num_docs))
+        self.__pruning_stats = {"scored": 0, "pruned": 0}
+        self.__query_batch_size = int(config.get("query_batch_size", 50))
+        self.__num_workers = int(config.get("num_workers", 1))
+        self.__parallel_mode = config.get("parallel_mode", "process")
+        self.__resume = config.get("resume", False)
+
+        if elastic is None:
+            elastic = get_index(self.__index_name, config.get("local_index_dir", None))
+        self.__elastic = elastic
 
     @staticmethod
     def check_config(config):
@@ -137,6 +236,13 @@ class Retrieval(object):
             if config.get("model", None) == "prms":
                 if config.get("fields", None) is None:
                     config["fields"] = [Elastic.FIELD_CATCHALL]
+            if config.get("model", None) == "bm25f":
+                if config.get("fields", None) is None:
+                    config["fields"] = {"similar_entity_names": 0.2, "catchall": 0.8}
+                if config.get("k1", None) is None:
+                    config["k1"] = ScorerBM25F.K1
+                if config.get("b", None) is None:
+                    config["b"] = ScorerBM25F.B
         except Exception as e:
             PLOGGER.error("Error in config file: ", e)
             sys.exit(1)
@@ -153,6 +259,7 @@ class Retrieval(object):
         return fields
 
 
+    @timed("first_pass")
     def _first_pass_scoring(self, analyzed_query):
         """Returns first-pass scoring of documents.
 
@@ -164,6 +271,17 @@ class Retrieval(object):
                                      fields_return=self.__first_pass_fields_return)
         return res1
 
+    @timed("first_pass")
+    def _multi_first_pass_scoring(self, analyzed_queries):
+        """Returns first-pass scoring of documents for multiple queries using a single multi-search request.
+
+        :param analyzed_queries: list of analyzed queries
+        :return: list of first-pass results (in the same order)
+        """
+        PLOGGER.debug("\tFirst pass scoring of " + str(len(analyzed_queries)) + " queries... ", )
+        return self.__elastic.multi_search(analyzed_queries, self.__first_pass_field, num=self.__first_pass_num_docs,
+                                           fields_return=self.__first_pass_fields_return)
+
     def _second_pass_scoring(self, res1, scorer):
         """Returns second-pass scoring of documents.
 
@@ -172,55 +290,240 @@ class Retrieval(object):
         :return: RetrievalResults object
         """
         PLOGGER.debug("\tSecond pass scoring... ", )
-        for field in self.__get_fields():
-            self.__elastic.multi_termvector(list(res1.keys()), field)
-
+        # term vectors are fetched concurrently; collection stats are fetched meanwhile
+        batches = self.__elastic.prefetch_termvectors(list(res1.keys()), self.__get_fields(),
+                                                      batch=self.__tv_batch_size, num_threads=self.__tv_num_threads)
+        if isinstance(scorer, Scorer):
+            with stage("term_stats"):
+                scorer.prefetch_term_stats()
+
+        # each batch is scored as soon as its term vectors are loaded
+        scores = {}
+        top_k = TopKThreshold(self.__pruning_k) if self.__pruning and isinstance(scorer, Scorer) else None
+        num_pruned = 0
+        for batch_ids in timed_iter(batches, "termvector_fetch"):
+            with stage("scoring"):
+                if top_k is not None:
+                    batch_ids, pruned_ids = top_k.prune(batch_ids, scorer.get_upper_bounds(batch_ids))
+                    num_pruned += len(pruned_ids)
+                if self.__batch_scoring and isinstance(scorer, Scorer):
+                    batch_scores = scorer.score_docs(batch_ids)
+                else:
+                    batch_scores = {doc_id: scorer.score_doc(doc_id) for doc_id in batch_ids}
+                scores.update(batch_scores)
+                if top_k is not None:
+                    top_k.update(batch_scores.values())
+
+        if top_k is not None:
+            self.__pruning_stats["scored"] += len(scores)
+            self.__pruning_stats["pruned"] += num_pruned
+            PLOGGER.debug("\t" + str(num_pruned) + " of " + str(len(res1)) + " documents are pruned")
+
+        # pruned documents are not in the results (they cannot be in the top-k)
         res2 = {}
         for doc_id in res1.keys():
-            res2[doc_id] = {"score": scorer.score_doc(doc_id), "fields": res1[doc_id].get("fields", {})}
+            if doc_id in scores:
+                res2[doc_id] = {"score": scores[doc_id], "fields": res1[doc_id].get("fields", {})}
         PLOGGER.debug("done")
         return res2
 
+    @property
+    def pruning_stats(self):
+        """Returns the number of scored and pruned documents in the second pass (summed over all queries)."""
+        return self.__pruning_stats
+
     def retrieve(self, query, scorer=None):
         """Scores documents for the given query."""
-        query = self.__elastic.analyze_query(query)
+        return self.retrieve_with_hits(query, scorer)[0]
+
+    def retrieve_with_hits(self, query, scorer=None):
+        """Scores documents for the given query and returns the number of first-pass hits too; with pruning, the
+        results contain only the documents that are scored in the second pass.
+
+        :return: results, number of first-pass hits
+        """
+        with stage("analyze"):
+            query = self.__elastic.analyze_query(query)
 
         # 1st pass retrieval
         res1 = self._first_pass_scoring(query)
-        if self.__model == "bm25":
-            return res1
+        if self.__model == "bm25" and scorer is None:
+            return res1, len(res1)
 
         # 2nd pass retrieval
         scorer = scorer if scorer else Scorer.get_scorer(self.__elastic, query, self.__config)
         res2 = self._second_pass_scoring(res1, scorer)
+        return res2, len(res1)
+
+    def retrieve_batch(self, queries):
+        """Scores documents for multiple queries.
+
+        All queries are analyzed using a single request and searched (first pass) using a single multi-search
+        request; second-pass scoring is performed per query.
+
+        :param queries: dictionary {query_id: query}
+        :return: dictionary {query_id: results}
+        """
+        query_ids = list(queries.keys())
+        with stage("analyze"):
+            analyzed_queries = self.__elastic.analyze_queries([queries[query_id] for query_id in query_ids])
+
+        # 1st pass retrieval
+        res1_all = self._multi_first_pass_scoring(analyzed_queries)
+        if self.__model == "bm25":
+            return dict(zip(query_ids, res1_all))
+
+        # 2nd pass retrieval
+        if isinstance(self.__elastic, ElasticCache):
+            self.__elastic.analyze_queries(analyzed_queries)  # the scorers analyze the query again
+        results = {}
+        for query_id, query, res1 in zip(query_ids, analyzed_queries, res1_all):
+            scorer = Scorer.get_scorer(self.__elastic, query, self.__config)
+            results[query_id] = self._second_pass_scoring(res1, scorer)
+        return results
+
+    async def retrieve_async(self, query, scorer=None):
+        """Scores documents for the given query (asyncio version of :func:`retrieve`).
+        It requires an :class:`~nordlys.core.retrieval.elastic_async.AsyncElasticCache` object.
+        All statistics needed for scoring are prefetched concurrently; scoring is then served from the cache.
+        """
+        query = await self.__elastic.analyze_query_async(query)
+
+        # 1st pass retrieval
+        res1 = await self.__elastic.search_async(query, self.__first_pass_field, num=self.__first_pass_num_docs,
+                                                 fields_return=self.__first_pass_fields_return)
+        if self.__model == "bm25" and scorer is None:
+            return res1
+
+        # 2nd pass retrieval
+        if scorer is None:
+            await self.__elastic.analyze_query_async(query)  # the scorer analyzes the query again
+            scorer = Scorer.get_scorer(self.__elastic, query, self.__config)
+        # all stats used by the scorer are prefetched, so that scoring does not make (blocking) requests
+        term_fields = scorer.get_term_fields() if isinstance(scorer, Scorer) else []
+        await asyncio.gather(self.__elastic.prefetch_termvectors_async(list(res1.keys()), self.__get_fields(),
+                                                                       batch=self.__tv_batch_size,
+                                                                       num_concurrent=self.__tv_num_threads),
+                             self.__elastic.prefetch_stats_async(term_fields))
+
+        if self.__batch_scoring and isinstance(scorer, Scorer):
+            scores = scorer.score_docs(list(res1.keys()))
+        else:
+            scores = {doc_id: scorer.score_doc(doc_id) for doc_id in res1.keys()}
+        res2 = {}
+        for doc_id in res1.keys():
+            res2[doc_id] = {"score": scores[doc_id], "fields": res1[doc_id].get("fields", {})}
         return res2
 
+    async def batch_retrieval_async(self, num_concurrent=10):
+        """Scores queries in a batch (asyncio version of :func:`batch_retrieval`).
+
+        :param num_concurrent: max number of queries processed concurrently
+        """
+        queries = json.load(open(self.__query_file))
+        semaphore = asyncio.Semaphore(num_concurrent)
+
+        async def retrieve(query_id):
+            async with semaphore:
+                PLOGGER.info("scoring [" + query_id + "] " + queries[query_id])
+                return await self.retrieve_async(queries[query_id])
+
+        query_ids = sorted(queries)
+        results = await asyncio.gather(*[retrieve(query_id) for query_id in query_ids])
+        with open(self.__output_file, "w") as out:
+            for query_id, res in zip(query_ids, results):
+                out.write(self.trec_format(res, query_id, self.__num_docs))
+        PLOGGER.info("Output file:" + self.__output_file)
+
     def batch_retrieval(self):
-        """Scores queries in a batch and outputs results."""
+        """Scores queries in a batch and outputs results.
+
+        Queries are scored in batches of query_batch_size (see :func:`retrieve_batch`), by a pool of workers
+        (if num_workers > 1); the results are written to the output file in query order, as soon as they (and all
+        preceding queries) are finished.
+        """
         queries = json.load(open(self.__query_file))
+        query_ids = sorted(queries)
 
         # init output file
-        open(self.__output_file, "w").write("")
-        out = open(self.__output_file, "w")
+        if self.__resume:
+            done_ids = self.__resume_output()
+            query_ids = [query_id for query_id in query_ids if query_id not in done_ids]
+            PLOGGER.info("Resuming batch retrieval; " + str(len(done_ids)) + " queries are skipped")
+            out = open(self.__output_file, "a")
+        else:
+            out = open(self.__output_file, "w")
 
         # retrieves documents
-        for query_id in sorted(queries):
-            PLOGGER.info("scoring [" + query_id + "] " + queries[query_id])
-            results = self.retrieve(queries[query_id])
-            out.write(self.trec_format(results, query_id, self.__num_docs))
+        batches = [[(query_id, queries[query_id]) for query_id in query_ids[i:i + self.__query_batch_size]]
+                   for i in range(0, len(query_ids), self.__query_batch_size)]
+        if self.__num_workers > 1:
+            executor_class = ThreadPoolExecutor if self.__parallel_mode == "thread" else ProcessPoolExecutor
+            with executor_class(max_workers=self.__num_workers, initializer=_init_worker,
+                                initargs=(self.__config, self.__parallel_mode == "thread")) as executor:
+                for trec_str in executor.map(_retrieve_worker, batches):
+                    out.write(trec_str)
+                    out.flush()
+        else:
+            for batch in batches:
+                out.write(self._retrieve_trec(batch))
+                out.flush()
         out.close()
+        if self.__pruning and self.__num_workers <= 1:
+            PLOGGER.info("Pruning: " + str(self.__pruning_stats["pruned"]) + " documents are pruned, " +
+                         str(self.__pruning_stats["scored"]) + " documents are scored")
         PLOGGER.info("Output file:" + self.__output_file)
 
+    def __resume_output(self):
+        """Returns the IDs of queries in the output file of an interrupted run.
+
+        The last query in the file may be incomplete; its lines are removed and the query is scored again.
+        """
+        if not os.path.exists(self.__output_file):
+            return set()
+        with open(self.__output_file) as f:
+            lines = [line for line in f if line.endswith("\n")]
+        query_ids = [line.split("\t", 1)[0] for line in lines]
+        if len(query_ids) > 0:
+            last_id = query_ids[-1]
+            lines = [line for line, query_id in zip(lines, query_ids) if query_id != last_id]
+            query_ids = [query_id for query_id in query_ids if query_id != last_id]
+        with open(self.__output_file, "w") as f:
+            f.writelines(lines)
+        return set(query_ids)
+
+    def _retrieve_trec(self, queries):
+        """Scores documents for a list of (query_id, query) pairs and returns the results in TREC format."""
+        for query_id, query in queries:
+            PLOGGER.info("scoring [" + query_id + "] " + query)
+        results = self.retrieve_batch(dict(queries))
+        return "".join(self.trec_format(results[query_id], query_id, self.__num_docs) for query_id, _ in queries)
+
     def trec_format(self, results, query_id, max_rank=100):
         """Outputs results in TREC format"""
-        out_str = ""
-        rank = 1
-        for doc_id, score in sorted(results.items(), key=lambda x: x[1]["score"], reverse=True):
-            if rank > max_rank:
-                break
-            out_str += query_id + "\tQ0\t" + doc_id + "\t" + str(rank) + "\t" + str(score["score"]) + "\t" + self.__run_id + "\n"
-            rank += 1
-        return out_str
+        ranked = rank(results, num=max_rank, score_func=lambda res: res["score"])
+        return "".join(trec_lines(query_id, [(doc_id, res["score"]) for doc_id, res in ranked], self.__run_id))
+
+
+_worker = threading.local()  # Retrieval object of a batch retrieval worker (process or thread)
+
+
+def _init_worker(config, thread=False):
+    """Initializes a batch retrieval worker with its own Retrieval object (and ElasticCache).
+
+    :param config: retrieval config
+    :param thread: True if the worker is a thread; since :func:`ElasticCache.get_instance` is shared by all threads of
+        a process, a thread worker creates its own ElasticCache
+    """
+    elastic = None
+    if thread and not config.get("local_index_dir", None):
+        elastic = ElasticCache(config["index_name"])
+    _worker.retrieval = Retrieval(config, elastic)
+
+
+def _retrieve_worker(queries):
+    """Scores a list of (query_id, query) pairs in a batch retrieval worker; returns the results in TREC format."""
+    return _worker.retrieval._retrieve_trec(queries)
 
 
 def arg_parser():
@@ -9,7 +9,7 @@ Result list representation.
 :Authors: Faegheh Hasibi, Krisztian Balog
 """
 
-import operator
+from nordlys.core.utils.ranked_list import rank, trec_lines
 
 
 class RetrievalResults(object):
@@ -43,14 +43,14 @@ class RetrievalResults(object):
         """Returns the score of a document (or None if it's not in the list)."""
         return self.__scores.get(doc_id, None)
 
-    def get_scores_sorted(self):
-        """Returns all results sorted by score"""
-        return sorted(self.__scores.items(), key=operator.itemgetter(1), reverse=True)
+    def get_scores_sorted(self, num=None, start=0):
+        """Returns results sorted by score
+
+        :param num: number of results (default: all)
+        :param start: starting offset
+        """
+        return rank(self.__scores, num=num, start=start)
 
     def write_trec_format(self, query_id, run_id, out, max_rank=100):
         """Outputs results in TREC format"""
-        rank = 1
-        for doc_id, score in self.get_scores_sorted():
-            if rank <= max_rank:
-                out.write(query_id + "\tQ0\t" + doc_id + "\t" + str(rank) + "\t" + str(score) + "\t" + run_id + "\n")
-            rank += 1
\ No newline at end of file
+        out.write("".join(trec_lines(query_id, self.get_scores_sorted(max_rank), run_id)))
\ No newline at end of file
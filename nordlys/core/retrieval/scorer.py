@@ -4,13 +4,25 @@ Scorer
 
 Various retrieval models for scoring a individual document for a given query.
 
+Implemented models: LM, MLM, PRMS, BM25 (single field), and BM25F.
+
+Besides scoring individual documents (:func:`score_doc`), all scorers can score a set of documents
+at once (:func:`score_docs`). The batch scoring packs the term vectors of all documents into dense NumPy arrays
+(documents x query terms, for each field) and computes the smoothed log-likelihoods with array operations; it
+follows the exact order of operations of the per-document scoring. Logarithms are taken with :func:`math.log` (as in
+the per-document scoring), since :func:`numpy.log` may differ in the last bit; therefore, batch scores are identical
+to per-document scores (this is checked by the ``scorer.score_docs`` benchmark in :py:mod:`nordlys.bench.micro`).
+
 :Authors: Faegheh Hasibi, Krisztian Balog
 """
 import math
 import sys
 
+import numpy
+
 from nordlys.core.retrieval.elastic import Elastic
 from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.term_vector import TermVector
 from nordlys.config import PLOGGER
 
 
@@ -31,6 +43,23 @@ class Scorer(object):
         else:
             self._query_terms = []
 
+    def _get_fields(self):
+        """Returns the fields used by the scorer (to be overridden in subclasses)."""
+        return []
+
+    def get_term_fields(self):
+        """Returns all (term, field) pairs, for which the scorer needs collection stats."""
+        fields = self._get_fields()
+        return [(t, f) for t in set(self._query_terms) for f in fields]
+
+    def prefetch_term_stats(self):
+        """Fetches collection stats of all query terms in all fields of the scorer in a batch.
+
+        The stats are kept in memory only if the elastic object caches them (i.e., an ElasticCache object).
+        """
+        if isinstance(self._elastic, ElasticCache):
+            self._elastic.multi_term_stats(self.get_term_fields())
+
     # def score_doc(self, doc_id):
     #     """Scorer method to be implemented in each subclass."""
     #     # should use elastic scoring
@@ -39,6 +68,72 @@ class Scorer(object):
     #     res = self._elastic.search(query, field, num=self.__first_pass_num_docs, start=start)
     #     return
 
+    def get_tf_matrix(self, doc_ids, field, terms):
+        """Packs term frequencies and lengths of a field for a set of documents into arrays.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param terms: list of terms
+        :return: numpy arrays of term frequencies (len(doc_ids) x len(terms)) and lengths (len(doc_ids) x 1)
+        """
+        tf_t_d_f = numpy.zeros((len(doc_ids), len(terms)))
+        len_d_f = numpy.zeros((len(doc_ids), 1))
+        tv_rows, tvs = [], []  # compact term vectors are looked up together
+        for i, doc_id in enumerate(doc_ids):
+            term_freqs = self._elastic.term_freqs(doc_id, field)
+            if isinstance(term_freqs, TermVector):
+                tv_rows.append(i)
+                tvs.append(term_freqs)
+            else:
+                for j, t in enumerate(terms):
+                    tf_t_d_f[i, j] = term_freqs.get(t, 0)
+            len_d_f[i, 0] = self._elastic.doc_length(doc_id, field)
+        if len(tvs) > 0:
+            tf_t_d_f[tv_rows] = TermVector.multi_get_counts(tvs, terms)
+        return tf_t_d_f, len_d_f
+
+    def score_docs(self, doc_ids):
+        """Scores a set of documents; subclasses may override it with a more efficient implementation.
+
+        :param doc_ids: list of document IDs
+        :return: dictionary {doc_id: score, ...}
+        """
+        return {doc_id: self.score_doc(doc_id) for doc_id in doc_ids}
+
+    def get_upper_bounds(self, doc_ids):
+        """Returns upper bounds of the scores of a set of documents, computed without scoring the documents
+        (used for dynamic pruning); subclasses that support pruning override it.
+
+        :param doc_ids: list of document IDs
+        :return: numpy array of upper bounds, or None if bounds are not available
+        """
+        return None
+
+    def get_max_term_freqs(self, terms, field):
+        """Returns upper bounds of term frequencies in a single document.
+        A :class:`~nordlys.core.retrieval.local_index.LocalIndex` stores the highest term frequency of each term, which
+        is used as it is. Otherwise, the bound is computed from collection stats:
+        tf(t,d_f) <= tf(t,C_f) - df(t,f) + 1, as each of the other documents containing the term has it at least once;
+        this bound is close to tf(t,C_f) for frequent terms, therefore, it is hardly ever lower than |d_f|.
+
+        :param terms: list of terms
+        :param field: field name
+        :return: numpy array of size len(terms)
+        """
+        max_term_freq = getattr(self._elastic, "max_term_freq", None)
+        if max_term_freq is not None:
+            return numpy.array([max_term_freq(t, field) for t in terms], dtype=float)
+        max_tfs = []
+        for t in terms:
+            df = self._elastic.doc_freq(t, field)
+            max_tfs.append(self._elastic.coll_term_freq(t, field) - df + 1 if df > 0 else 0)
+        return numpy.array(max_tfs, dtype=float)
+
+    def get_doc_lengths(self, doc_ids, field):
+        """Returns lengths of a field for a set of documents as a numpy array of size len(doc_ids) x 1."""
+        return numpy.array([self._elastic.doc_length(doc_id, field) for doc_id in doc_ids],
+                           dtype=float).reshape(len(doc_ids), 1)
+
     @staticmethod
     def get_scorer(elastic, query, config):
         """Returns Scorer object (Scorer factory).
@@ -57,6 +152,12 @@ class Scorer(object):
         elif model == "prms":
             PLOGGER.debug("\tPRMS scoring ...")
             return ScorerPRMS(elastic, query, config)
+        elif model == "bm25":
+            PLOGGER.debug("\tBM25 scoring ...")
+            return ScorerBM25(elastic, query, config)
+        elif model == "bm25f":
+            PLOGGER.debug("\tBM25F scoring ...")
+            return ScorerBM25F(elastic, query, config)
         elif model is None:
             return None
         else:
@@ -86,6 +187,10 @@ class ScorerLM(Scorer):
 
         self._tf = {}
 
+    def _get_fields(self):
+        """Returns the fields used by the scorer."""
+        return [self._field]
+
     @staticmethod
     def get_jm_prob(tf_t_d, len_d, tf_t_C, len_C, lambd):
         """Computes JM-smoothed probability.
@@ -178,6 +283,129 @@ class ScorerLM(Scorer):
             p_t_theta_d_f[t] = self.get_lm_term_prob(doc_id, field, t)
         return p_t_theta_d_f
 
+    def get_lm_term_prob_matrix(self, doc_ids, field, terms):
+        """Returns term probabilities of the given terms for a set of documents and a field; i.e., p(t|theta_d_f)
+        This is the vectorized version of :func:`get_lm_term_prob`.
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param terms: list of terms
+        :return: numpy array of size len(doc_ids) x len(terms)
+        """
+        tf_t_d_f, len_d_f = self.get_tf_matrix(doc_ids, field, terms)
+        len_C_f = self._elastic.coll_length(field)
+        tf_t_C_f = numpy.array([self._elastic.coll_term_freq(t, field) for t in terms], dtype=float)
+        p_t_C_f = tf_t_C_f / len_C_f if len_C_f > 0 else numpy.zeros(len(terms))
+
+        # JM smoothing: p(t|theta_d_f) = [(1-lambda) tf(t, d_f)/|d_f|] + [lambda tf(t, C_f)/|C_f|]
+        if self._smoothing_method == self.JM:
+            lambd = self._smoothing_param
+            p_t_d_f = numpy.divide(tf_t_d_f, len_d_f, out=numpy.zeros_like(tf_t_d_f), where=len_d_f > 0)
+            return (1 - lambd) * p_t_d_f + lambd * p_t_C_f
+
+        # Dirichlet smoothing
+        elif self._smoothing_method == self.DIRICHLET:
+            mu = self._smoothing_param if self._smoothing_param != "avg_len" else self._elastic.avg_len(field)
+            if mu == 0:  # i.e. field does not have any content in the collection
+                return numpy.zeros((len(doc_ids), len(terms)))
+            return (tf_t_d_f + mu * p_t_C_f) / (len_d_f + mu)
+        return numpy.zeros((len(doc_ids), len(terms)))
+
+    def get_lm_term_prob_bounds(self, doc_ids, field, terms):
+        """Returns lower and upper bounds of p(t|theta_d_f) for a set of documents, computed from document lengths
+        and term stats only; tf(t,d_f) is bounded by 0 and min(|d_f|, max tf(t,d'_f)) (see :func:`get_max_term_freqs`).
+
+        :param doc_ids: list of document IDs
+        :param field: field name
+        :param terms: list of terms
+        :return: two numpy arrays (lower and upper bounds) of size len(doc_ids) x len(terms)
+        """
+        len_d_f = self.get_doc_lengths(doc_ids, field)
+        len_C_f = self._elastic.coll_length(field)
+        tf_t_C_f = numpy.array([self._elastic.coll_term_freq(t, field) for t in terms], dtype=float)
+        p_t_C_f = tf_t_C_f / len_C_f if len_C_f > 0 else numpy.zeros(len(terms))
+        max_tf_t_d_f = numpy.minimum(len_d_f, self.get_max_term_freqs(terms, field))
+        zeros = numpy.zeros((len(doc_ids), len(terms)))
+
+        if self._smoothing_method == self.JM:
+            lambd = self._smoothing_param
+            max_p_t_d_f = numpy.divide(max_tf_t_d_f, len_d_f, out=numpy.zeros_like(zeros), where=len_d_f > 0)
+            return zeros + lambd * p_t_C_f, (1 - lambd) * max_p_t_d_f + lambd * p_t_C_f
+
+        elif self._smoothing_method == self.DIRICHLET:
+            mu = self._smoothing_param if self._smoothing_param != "avg_len" else self._elastic.avg_len(field)
+            if mu == 0:
+                return zeros, zeros
+            return zeros + mu * p_t_C_f / (len_d_f + mu), (max_tf_t_d_f + mu * p_t_C_f) / (len_d_f + mu)
+        return zeros, zeros
+
+    @staticmethod
+    def log(p, where):
+        """Returns the elementwise natural logarithm of an array, using :func:`math.log` (bitwise identical to the
+        per-document scoring); elements where the condition does not hold are 0.
+
+        :param p: numpy array
+        :param where: boolean numpy array of the same size
+        """
+        return numpy.array([math.log(x) if w else 0.0 for x, w in zip(p.tolist(), where.tolist())])
+
+    @staticmethod
+    def log_likelihood_bounds(min_p_t_theta_d, max_p_t_theta_d, terms, query_terms):
+        """Returns upper bounds of the log-likelihood of the query (see :func:`log_likelihoods`).
+        A term contributes log(max p(t|theta_d)) if its probability cannot be zero, and at most 0 otherwise
+        (terms with zero probability are skipped).
+
+        :param min_p_t_theta_d: lower bounds of term probabilities; numpy array of size num_docs x len(terms)
+        :param max_p_t_theta_d: upper bounds of term probabilities; numpy array of size num_docs x len(terms)
+        :param terms: list of (unique) terms
+        :param query_terms: list of query terms (possibly with duplicates)
+        :return: numpy array of upper bounds
+        """
+        term_index = {t: j for j, t in enumerate(terms)}
+        upper_bounds = numpy.zeros(max_p_t_theta_d.shape[0])
+        for t in query_terms:
+            j = term_index[t]
+            p = max_p_t_theta_d[:, j]
+            upper_bounds += ScorerLM.log(p, min_p_t_theta_d[:, j] > 0)
+        return upper_bounds
+
+    def get_upper_bounds(self, doc_ids):
+        """Returns upper bounds of LM scores for a set of documents; see :func:`Scorer.get_upper_bounds`."""
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        min_p, max_p = self.get_lm_term_prob_bounds(doc_ids, self._field, terms)
+        return self.log_likelihood_bounds(min_p, max_p, terms, self._query_terms)
+
+    @staticmethod
+    def log_likelihoods(p_t_theta_d, terms, query_terms):
+        r"""Computes log-likelihood of the query for a set of documents, given term probabilities.
+        p(q|theta_d) = \sum log(p(t|theta_d)); terms with zero probability are skipped, and the score of documents
+        that none of the query terms have a non-zero probability is None.
+
+        :param p_t_theta_d: numpy array of size num_docs x len(terms)
+        :param terms: list of (unique) terms
+        :param query_terms: list of query terms (possibly with duplicates)
+        :return: list of scores
+        """
+        term_index = {t: j for j, t in enumerate(terms)}
+        p_q_theta_d = numpy.zeros(p_t_theta_d.shape[0])
+        for t in query_terms:
+            p = p_t_theta_d[:, term_index[t]]
+            p_q_theta_d += ScorerLM.log(p, p > 0)
+        has_match = (p_t_theta_d > 0).any(axis=1)
+        return [float(score) if match else None for score, match in zip(p_q_theta_d, has_match)]
+
+    def score_docs(self, doc_ids):
+        """Scores a set of documents using LM; see :func:`score_doc`.
+
+        :param doc_ids: list of document IDs
+        :return: dictionary {doc_id: score, ...}
+        """
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        p_t_theta_d = self.get_lm_term_prob_matrix(doc_ids, self._field, terms)
+        return dict(zip(doc_ids, self.log_likelihoods(p_t_theta_d, terms, self._query_terms)))
+
     def score_doc(self, doc_id):
         """Scores the given document using LM.
         p(q|theta_d) = \sum log(p(t|theta_d))
@@ -224,6 +452,10 @@ class ScorerMLM(ScorerLM):
         if "fields" not in params:
             raise Exception("Field weights are not defined for MLM scoring!")
 
+    def _get_fields(self):
+        """Returns the fields used by the scorer."""
+        return list(self._field_weights.keys())
+
     def get_mlm_term_prob(self, doc_id, t):
         """Returns MLM probability for the given term and field-weights.
         p(t|theta_d) = sum(mu_f * p(t|theta_d_f))
@@ -251,6 +483,32 @@ class ScorerMLM(ScorerLM):
             p_t_theta_d[t] = self.get_mlm_term_prob(doc_id, t)
         return p_t_theta_d
 
+    def get_upper_bounds(self, doc_ids):
+        """Returns upper bounds of MLM scores for a set of documents; see :func:`Scorer.get_upper_bounds`."""
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        min_p = numpy.zeros((len(doc_ids), len(terms)))
+        max_p = numpy.zeros((len(doc_ids), len(terms)))
+        for f, mu_f in self._field_weights.items():
+            min_p_f, max_p_f = self.get_lm_term_prob_bounds(doc_ids, f, terms)
+            min_p += mu_f * min_p_f
+            max_p += mu_f * max_p_f
+        return self.log_likelihood_bounds(min_p, max_p, terms, self._query_terms)
+
+    def score_docs(self, doc_ids):
+        """Scores a set of documents using MLM; see :func:`score_doc`.
+
+        :param doc_ids: list of document IDs
+        :return: dictionary {doc_id: score, ...}
+        """
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        # p(t|theta_d) = sum(mu_f * p(t|theta_d_f))
+        p_t_theta_d = numpy.zeros((len(doc_ids), len(terms)))
+        for f, mu_f in self._field_weights.items():
+            p_t_theta_d += mu_f * self.get_lm_term_prob_matrix(doc_ids, f, terms)
+        return dict(zip(doc_ids, self.log_likelihoods(p_t_theta_d, terms, self._query_terms)))
+
     def score_doc(self, doc_id):
         """Scores the given document using MLM model.
         p(q|theta_d) = \sum log(p(t|theta_d))
@@ -295,6 +553,10 @@ class ScorerPRMS(ScorerLM):
         self.total_field_freq = None
         self.mapping_probs = None
 
+    def _get_fields(self):
+        """Returns the fields used by the scorer."""
+        return list(self._fields)
+
     def score_doc(self, doc_id):
         """
         Scores the given document using PRMS model.
@@ -338,6 +600,36 @@ class ScorerPRMS(ScorerLM):
                 print("\t\tP(t|theta_d)= {}".format(p_t_theta_d))
         return p_q_theta_d
 
+    def get_upper_bounds(self, doc_ids):
+        """Bounds are not available for PRMS (no pruning)."""
+        return None
+
+    def score_docs(self, doc_ids):
+        """Scores a set of documents using PRMS; see :func:`score_doc`.
+
+        :param doc_ids: list of document IDs
+        :return: dictionary {doc_id: score, ...}
+        """
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        p_f_t = self.get_mapping_probs()
+        p_t_theta_d_f = {f: self.get_lm_term_prob_matrix(doc_ids, f, terms) for f in self._fields}
+
+        # p(t|theta_d) = sum(p(f|t) * p(t|theta_d_f))
+        p_t_theta_d = numpy.zeros((len(doc_ids), len(terms)))
+        for j, t in enumerate(terms):
+            for f in self._fields:
+                if f in p_f_t[t]:
+                    p_t_theta_d[:, j] += p_f_t[t][f] * p_t_theta_d_f[f][:, j]
+        scores = self.log_likelihoods(p_t_theta_d, terms, self._query_terms)
+
+        # none of query terms are in the field collection
+        has_match = numpy.zeros(len(doc_ids), dtype=bool)
+        for f in self._fields:
+            has_match |= (p_t_theta_d_f[f] > 0).any(axis=1)
+        return {doc_id: (score if score is not None else 0) if match else None
+                for doc_id, score, match in zip(doc_ids, scores, has_match)}
+
     def get_mapping_probs(self):
         """Gets (cached) mapping probabilities for all query terms."""
         if self.mapping_probs is None:
@@ -394,6 +686,177 @@ class ScorerPRMS(ScorerLM):
         return self.total_field_freq
 
 
+# =========================================
+# ================= BM25 ==================
+# =========================================
+class ScorerBM25(Scorer):
+    """BM25 scorer for a single field.
+
+    It implements the BM25 similarity of Lucene, but with exact document lengths: Lucene (and thus Elasticsearch)
+    encodes field lengths lossily in a single byte, so Elasticsearch scores differ slightly. The scores are equal (up
+    to floating-point rounding) to those of
+    :func:`LocalIndex.search <nordlys.core.retrieval.local_index.LocalIndex.search>`.
+
+    Mind that :class:`~nordlys.core.retrieval.retrieval.Retrieval` returns the first-pass scores for the ``bm25`` model;
+    this scorer is only used when it is created explicitly (e.g., by :func:`Scorer.get_scorer`) and passed to
+    :func:`Retrieval.retrieve <nordlys.core.retrieval.retrieval.Retrieval.retrieve>`, or for batch scoring.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, elastic, query, params):
+        super(ScorerBM25, self).__init__(elastic, query, params)
+        self._field_weights = self._get_field_weights(params)
+        self._k1 = float(params.get("k1", self.K1))
+        self._b = params.get("b", self.B)
+        self._idf = None
+
+    @staticmethod
+    def _get_field_weights(params):
+        """Returns the field weights; BM25 uses a single field with weight 1."""
+        return {params.get("fields", Elastic.FIELD_CATCHALL): 1}
+
+    def _get_fields(self):
+        """Returns the fields used by the scorer."""
+        return list(self._field_weights.keys())
+
+    def get_b(self, field):
+        """Returns the length normalization parameter b of a field."""
+        return float(self._b.get(field, self.B) if isinstance(self._b, dict) else self._b)
+
+    def get_length_norm(self, len_d_f, field):
+        """Returns the length normalization of a field.
+        B_f = (1 - b_f) + b_f * |d_f| / avg(|d_f|)
+
+        :param len_d_f: |d_f| (number or numpy array)
+        :param field: field name
+        """
+        avg_len_f = self._elastic.avg_len(field) if self._elastic.doc_count(field) > 0 else 0
+        if avg_len_f == 0:  # i.e. field does not have any content in the collection
+            return 1
+        b_f = self.get_b(field)
+        return (1 - b_f) + b_f * len_d_f / avg_len_f
+
+    def get_idf(self, t):
+        """Returns the inverse document frequency of a term.
+        idf(t) = log(1 + (N - df(t) + 0.5) / (df(t) + 0.5))
+        """
+        field = self._get_fields()[0]
+        n = self._elastic.doc_count(field)
+        df = self._elastic.doc_freq(t, field)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def get_idfs(self):
+        """Returns (cached) inverse document frequencies of all query terms."""
+        if self._idf is None:
+            self._idf = {t: self.get_idf(t) for t in set(self._query_terms)}
+        return self._idf
+
+    def get_term_freq(self, doc_id, t):
+        """Returns the (pseudo) term frequency: the weighted sum of length-normalized term frequencies of the fields.
+        tf(t,d) = sum(w_f * tf(t,d_f) / B_f)
+
+        :param doc_id: document ID
+        :param t: term
+        """
+        tf_t_d = 0
+        for f, w_f in self._field_weights.items():
+            tf_t_d_f = self._elastic.term_freqs(doc_id, f).get(t, 0)
+            tf_t_d += w_f * tf_t_d_f / self.get_length_norm(self._elastic.doc_length(doc_id, f), f)
+        return tf_t_d
+
+    def get_term_freq_matrix(self, doc_ids, terms):
+        """Returns the (pseudo) term frequencies of the given terms for a set of documents.
+        This is the vectorized version of :func:`get_term_freq`.
+
+        :param doc_ids: list of document IDs
+        :param terms: list of terms
+        :return: numpy array of size len(doc_ids) x len(terms)
+        """
+        tf_t_d = numpy.zeros((len(doc_ids), len(terms)))
+        for f, w_f in self._field_weights.items():
+            tf_t_d_f, len_d_f = self.get_tf_matrix(doc_ids, f, terms)
+            tf_t_d += w_f * tf_t_d_f / self.get_length_norm(len_d_f, f)
+        return tf_t_d
+
+    def get_upper_bounds(self, doc_ids):
+        """Returns upper bounds of BM25(F) scores for a set of documents; see :func:`Scorer.get_upper_bounds`.
+        The scores increase with term frequencies, which are bounded by |d_f| and :func:`get_max_term_freqs`.
+        """
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        term_index = {t: j for j, t in enumerate(terms)}
+        max_tf_t_d = numpy.zeros((len(doc_ids), len(terms)))
+        for f, w_f in self._field_weights.items():
+            len_d_f = self.get_doc_lengths(doc_ids, f)
+            max_tf_t_d_f = numpy.minimum(len_d_f, self.get_max_term_freqs(terms, f))
+            max_tf_t_d += w_f * max_tf_t_d_f / self.get_length_norm(len_d_f, f)
+        idf = self.get_idfs()
+        upper_bounds = numpy.zeros(len(doc_ids))
+        for t in self._query_terms:
+            tf = max_tf_t_d[:, term_index[t]]
+            upper_bounds += idf[t] * tf * (self._k1 + 1) / (self._k1 + tf)
+        return upper_bounds
+
+    def score_docs(self, doc_ids):
+        """Scores a set of documents using BM25(F); see :func:`score_doc`.
+
+        :param doc_ids: list of document IDs
+        :return: dictionary {doc_id: score, ...}
+        """
+        doc_ids = list(doc_ids)
+        terms = list(set(self._query_terms))
+        term_index = {t: j for j, t in enumerate(terms)}
+        tf_t_d = self.get_term_freq_matrix(doc_ids, terms)
+        idf = self.get_idfs()
+        scores = numpy.zeros(len(doc_ids))
+        for t in self._query_terms:
+            tf = tf_t_d[:, term_index[t]]
+            scores += idf[t] * tf * (self._k1 + 1) / (self._k1 + tf)
+        return dict(zip(doc_ids, scores.tolist()))
+
+    def score_doc(self, doc_id):
+        """Scores the given document using BM25(F).
+        score(d,q) = sum(idf(t) * tf(t,d) * (k1 + 1) / (k1 + tf(t,d)))
+
+        :param doc_id: document ID
+        :return: BM25(F) score
+        """
+        if self.SCORER_DEBUG:
+            print("Scoring doc ID=" + doc_id)
+        idf = self.get_idfs()
+        score = 0
+        for t in self._query_terms:
+            tf_t_d = self.get_term_freq(doc_id, t)
+            score += idf[t] * tf_t_d * (self._k1 + 1) / (self._k1 + tf_t_d)
+            if self.SCORER_DEBUG:
+                print("\tt= {}\ttf(t,d)= {}\tidf(t)= {}".format(t, tf_t_d, idf[t]))
+        return score
+
+
+class ScorerBM25F(ScorerBM25):
+    """BM25F scorer; term frequencies of the fields are length-normalized per field and linearly combined.
+
+    Implemented based on:
+        Robertson, Zaragoza, Taylor. Simple BM25 extension to multiple weighted fields. CIKM 2004.
+    """
+
+    @staticmethod
+    def _get_field_weights(params):
+        """Returns the field weights."""
+        if not isinstance(params.get("fields", None), dict):
+            raise Exception("Field weights are not defined for BM25F scoring!")
+        return params["fields"]
+
+    def get_idf(self, t):
+        """Returns the inverse document frequency of a term, computed over the whole collection.
+        The document frequency is estimated by the maximum document frequency over the fields.
+        """
+        n = self._elastic.num_docs()
+        df = max([self._elastic.doc_freq(t, f) for f in self._field_weights] + [0])
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+
 if __name__ == "__main__":
     query = "gonna friends"
     doc_id = "4"
@@ -0,0 +1,207 @@
+"""
+Stats Store
+===========
+
+Persistent (SQLite-backed) store for collection statistics of Elasticsearch indices.
+
+The store keeps the statistics that are otherwise learnt one Elasticsearch round trip at a time:
+
+  - index stats: number of documents
+  - field stats: document count and collection length (sum of total term frequencies) per field
+  - term stats: document frequency and collection term frequency, keyed by (index, field, term)
+
+:class:`~nordlys.core.retrieval.elastic_cache.ElasticCache` reads the store on cache misses and writes newly fetched
+statistics back to it. This way, new processes start warm after restarts and scale-outs.
+
+
+Usage hints
+-----------
+
+  - The store file is set by the ``stats_file`` parameter in the ``cache`` section of ``config/elastic.json``
+    (or passed to the constructor of :class:`~nordlys.core.retrieval.elastic_cache.ElasticCache`).
+  - Several processes (e.g., API workers) can share the same file in read-only mode (``stats_readonly: true``).
+  - The store can be filled lazily (by running retrieval) or built for a set of queries using the command line:
+
+::
+
+  python -m nordlys.core.retrieval.stats_store <stats_file> -i <index_name> -f <field1,field2,..> [-q <query_file>]
+"""
+
+import argparse
+import atexit
+import json
+import os
+import sqlite3
+import threading
+
+from nordlys.config import PLOGGER
+
+
+class StatsStore(object):
+    """SQLite-backed store for index, field, and term statistics."""
+
+    COMMIT_EVERY = 100  # number of writes between two commits
+
+    def __init__(self, stats_file, readonly=False):
+        """
+        :param stats_file: path to the SQLite file
+        :param readonly: if True, the file is opened in read-only mode (it can be shared by several processes)
+        """
+        self.__stats_file = stats_file
+        self.__readonly = readonly
+        self.__lock = threading.Lock()
+        self.__num_writes = 0
+
+        if readonly:
+            uri = "file:" + os.path.abspath(stats_file) + "?mode=ro"
+            self.__conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            if os.path.dirname(stats_file) and not os.path.exists(os.path.dirname(stats_file)):
+                os.makedirs(os.path.dirname(stats_file))
+            self.__conn = sqlite3.connect(stats_file, check_same_thread=False)
+            # WAL mode lets read-only processes read the file while it is being written
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("PRAGMA synchronous=NORMAL")
+            self.__create_tables()
+            atexit.register(self.close)
+
+    @property
+    def readonly(self):
+        return self.__readonly
+
+    def __create_tables(self):
+        """Creates the tables (if they don't exist)."""
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS index_stats "
+                            "(idx TEXT, num_docs INTEGER, PRIMARY KEY (idx))")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS field_stats "
+                            "(idx TEXT, field TEXT, doc_count INTEGER, coll_length INTEGER, "
+                            "PRIMARY KEY (idx, field))")
+        self.__conn.execute("CREATE TABLE IF NOT EXISTS term_stats "
+                            "(idx TEXT, field TEXT, term TEXT, doc_freq INTEGER, coll_term_freq INTEGER, "
+                            "PRIMARY KEY (idx, field, term)) WITHOUT ROWID")
+        self.__conn.commit()
+
+    def __fetch_one(self, sql, params):
+        with self.__lock:
+            return self.__conn.execute(sql, params).fetchone()
+
+    def __write(self, sql, params):
+        """Executes a write statement; commits every COMMIT_EVERY writes. Ignored in read-only mode."""
+        if self.__readonly:
+            return
+        with self.__lock:
+            self.__conn.execute(sql, params)
+            self.__num_writes += 1
+            if self.__num_writes % self.COMMIT_EVERY == 0:
+                self.__conn.commit()
+
+    # =========================================
+    # ================= Read ==================
+    # =========================================
+    def get_num_docs(self, index_name):
+        """Returns number of documents for the index (or None if not stored)."""
+        row = self.__fetch_one("SELECT num_docs FROM index_stats WHERE idx=?", (index_name,))
+        return row[0] if row else None
+
+    def get_field_stats(self, index_name, field):
+        """Returns (doc_count, coll_length) for the given field (or None if not stored)."""
+        return self.__fetch_one("SELECT doc_count, coll_length FROM field_stats WHERE idx=? AND field=?",
+                                (index_name, field))
+
+    def get_all_field_stats(self, index_name):
+        """Returns all stored field stats of the index.
+
+        :return: dictionary {field: (doc_count, coll_length), ...}
+        """
+        with self.__lock:
+            rows = self.__conn.execute("SELECT field, doc_count, coll_length FROM field_stats WHERE idx=?",
+                                       (index_name,)).fetchall()
+        return {field: (doc_count, coll_length) for field, doc_count, coll_length in rows}
+
+    def get_term_stats(self, index_name, field, term):
+        """Returns (doc_freq, coll_term_freq) for the given term and field (or None if not stored)."""
+        return self.__fetch_one("SELECT doc_freq, coll_term_freq FROM term_stats WHERE idx=? AND field=? AND term=?",
+                                (index_name, field, term))
+
+    # =========================================
+    # ================= Write =================
+    # =========================================
+    def put_num_docs(self, index_name, num_docs):
+        """Stores number of documents of the index."""
+        self.__write("INSERT OR REPLACE INTO index_stats VALUES (?, ?)", (index_name, num_docs))
+
+    def put_field_stats(self, index_name, field, doc_count, coll_length):
+        """Stores field stats."""
+        self.__write("INSERT OR REPLACE INTO field_stats VALUES (?, ?, ?, ?)",
+                     (index_name, field, doc_count, coll_length))
+
+    def put_term_stats(self, index_name, field, term, doc_freq, coll_term_freq):
+        """Stores term stats."""
+        self.__write("INSERT OR REPLACE INTO term_stats VALUES (?, ?, ?, ?, ?)",
+                     (index_name, field, term, doc_freq, coll_term_freq))
+
+    def delete_index(self, index_name):
+        """Deletes all stats of the index (to be called when the index is rebuilt)."""
+        if self.__readonly:
+            return
+        with self.__lock:
+            for table in ["index_stats", "field_stats", "term_stats"]:
+                self.__conn.execute("DELETE FROM " + table + " WHERE idx=?", (index_name,))
+            self.__conn.commit()
+
+    def flush(self):
+        """Commits pending writes."""
+        if not self.__readonly:
+            with self.__lock:
+                self.__conn.commit()
+
+    def close(self):
+        """Commits pending writes and closes the connection."""
+        if self.__conn is not None:
+            self.flush()
+            self.__conn.close()
+            self.__conn = None
+
+
+def build(stats_file, index_name, fields, query_file=None):
+    """Builds the stats store for an index: index and (all) field stats, plus term stats for the terms of queries.
+
+    :param stats_file: path to the SQLite file
+    :param index_name: name of the index
+    :param fields: list of fields for term stats
+    :param query_file: JSON file with queries {qid: query, ...} (optional)
+    """
+    from nordlys.core.retrieval.elastic_cache import ElasticCache
+
+    store = StatsStore(stats_file)
+    store.delete_index(index_name)
+    elastic = ElasticCache(index_name, stats_store=store)
+    elastic.num_docs()
+    elastic.load_field_stats()
+
+    if query_file:
+        queries = json.load(open(query_file))
+        for qid in sorted(queries):
+            PLOGGER.info("Adding term stats for [" + qid + "] " + queries[qid])
+            terms = set(elastic.analyze_query(queries[qid]).split())
+            elastic.multi_term_stats([(term, field) for term in terms for field in fields])
+    store.close()
+    PLOGGER.info("Stats file: " + stats_file)
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("stats_file", help="stats file (SQLite)", type=str)
+    parser.add_argument("-i", "--index", help="index name", type=str)
+    parser.add_argument("-f", "--fields", help="comma-separated list of fields", type=str)
+    parser.add_argument("-q", "--query_file", help="query file (JSON)", type=str, default=None)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    build(args.stats_file, args.index, args.fields.split(","), args.query_file)
+
+
+if __name__ == "__main__":
+    main(arg_parser())
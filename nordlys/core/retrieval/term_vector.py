@@ -0,0 +1,188 @@
+"""
+Term Vector
+===========
+
+Compact in-memory representation of term vectors, used by :class:`~nordlys.core.retrieval.elastic_cache.ElasticCache`.
+
+  - Terms are mapped to integer IDs by a :class:`TermDictionary`, which is shared by all term vectors of a cache.
+  - A :class:`TermVector` holds the sorted term IDs (int32) and term frequencies of a document field in two NumPy
+    arrays, and the precomputed length of the field.
+  - :class:`TermVector` is a read-only mapping {term: term frequency}; therefore, it can be used wherever the
+    dictionary returned by :func:`Elastic.term_freqs <nordlys.core.retrieval.elastic.Elastic.term_freqs>` is used,
+    without creating a new dictionary on each access.
+  - Looking up a single term (:func:`TermVector.get`) is much slower than a dictionary lookup; hot paths should map
+    the terms to IDs once and look them up in all term vectors at once (:func:`TermVector.multi_get_counts`), as done
+    by :func:`Scorer.get_tf_matrix <nordlys.core.retrieval.scorer.Scorer.get_tf_matrix>`.
+
+Compared to the term vector JSON of Elasticsearch (a nested dictionary per term), the memory footprint is about
+8 bytes per term plus a fixed overhead per term vector.
+"""
+
+import sys
+import threading
+from collections.abc import Mapping
+
+import numpy
+
+
+class TermDictionary(object):
+    """Bidirectional mapping between terms and integer IDs."""
+
+    def __init__(self):
+        self.__ids = {}  # {term: id}
+        self.__terms = []  # [term, ...]; list index is the term ID
+        self.__term_bytes = 0  # size of the term strings and IDs
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__terms)
+
+    @property
+    def resident_bytes(self):
+        """Returns the estimated memory footprint of the dictionary (in bytes)."""
+        return sys.getsizeof(self.__ids) + sys.getsizeof(self.__terms) + self.__term_bytes
+
+    def get_id(self, term):
+        """Returns ID of the term (or None if the term is not in the dictionary)."""
+        return self.__ids.get(term, None)
+
+    def get_ids(self, terms):
+        """Returns IDs of the terms as an int32 array; -1 for terms that are not in the dictionary."""
+        return numpy.array([self.__ids.get(term, -1) for term in terms], dtype=numpy.int32)
+
+    def get_term(self, term_id):
+        """Returns the term for the given ID."""
+        return self.__terms[term_id]
+
+    def add(self, term):
+        """Adds the term (if it is not in the dictionary) and returns its ID."""
+        term_id = self.__ids.get(term, None)
+        if term_id is None:
+            with self.__lock:
+                term_id = self.__ids.get(term, None)
+                if term_id is None:
+                    term_id = len(self.__terms)
+                    self.__terms.append(term)
+                    self.__ids[term] = term_id
+                    self.__term_bytes += sys.getsizeof(term) + sys.getsizeof(term_id)
+        return term_id
+
+
+class TermVector(Mapping):
+    """Term frequencies of a document field, stored as sorted term ID and count arrays."""
+    __slots__ = ["__term_dict", "__term_ids", "__counts", "__length"]
+
+    EMPTY_IDS = numpy.zeros(0, dtype=numpy.int32)
+
+    def __init__(self, term_dict, term_ids, counts):
+        """
+        :param term_dict: TermDictionary object
+        :param term_ids: sorted numpy array of term IDs (int32)
+        :param counts: numpy array of term frequencies
+        """
+        self.__term_dict = term_dict
+        self.__term_ids = term_ids
+        self.__counts = counts
+        self.__length = int(counts.sum())
+
+    @classmethod
+    def from_term_freqs(cls, term_dict, term_freqs):
+        """Creates a term vector from a dictionary {term: term frequency}."""
+        if len(term_freqs) == 0:
+            return cls(term_dict, cls.EMPTY_IDS, cls.EMPTY_IDS)
+        pairs = sorted((term_dict.add(term), tf) for term, tf in term_freqs.items())
+        term_ids = numpy.array([term_id for term_id, _ in pairs], dtype=numpy.int32)
+        counts = numpy.array([tf for _, tf in pairs])
+        dtype = numpy.uint16 if counts.max() <= numpy.iinfo(numpy.uint16).max else numpy.int32
+        return cls(term_dict, term_ids, counts.astype(dtype))
+
+    @classmethod
+    def from_es(cls, term_dict, tv):
+        """Creates a term vector from the term vector JSON of Elasticsearch ({term: {"term_freq": xx, ..}, ..})."""
+        return cls.from_term_freqs(term_dict, {term: val["term_freq"] for term, val in tv.items()})
+
+    @property
+    def length(self):
+        """Returns the length of the field (sum of term frequencies)."""
+        return self.__length
+
+    @property
+    def term_dict(self):
+        return self.__term_dict
+
+    @property
+    def term_ids(self):
+        return self.__term_ids
+
+    @property
+    def counts(self):
+        return self.__counts
+
+    def __index(self, term):
+        """Returns position of the term in the arrays (or None if the term is not in the term vector)."""
+        term_id = self.__term_dict.get_id(term)
+        if term_id is None:
+            return None
+        i = int(self.__term_ids.searchsorted(term_id))
+        return i if i < len(self.__term_ids) and self.__term_ids[i] == term_id else None
+
+    def __getitem__(self, term):
+        i = self.__index(term)
+        if i is None:
+            raise KeyError(term)
+        return int(self.__counts[i])
+
+    def get(self, term, default=None):
+        i = self.__index(term)
+        return default if i is None else int(self.__counts[i])
+
+    def __contains__(self, term):
+        return self.__index(term) is not None
+
+    def __len__(self):
+        return len(self.__term_ids)
+
+    def __iter__(self):
+        return (self.__term_dict.get_term(term_id) for term_id in self.__term_ids.tolist())
+
+    def values(self):
+        return self.__counts.tolist()
+
+    def get_counts(self, term_ids):
+        """Returns term frequencies for an array of term IDs (vectorized lookup; 0 for missing terms)."""
+        term_ids = numpy.asarray(term_ids, dtype=numpy.int32)
+        if len(self.__term_ids) == 0:
+            return numpy.zeros(len(term_ids))
+        pos = numpy.minimum(self.__term_ids.searchsorted(term_ids), len(self.__term_ids) - 1)
+        return numpy.where(self.__term_ids[pos] == term_ids, self.__counts[pos], 0)
+
+    @staticmethod
+    def multi_get_counts(term_vectors, terms):
+        """Returns term frequencies of the given terms for multiple term vectors (0 for missing terms).
+        All term vectors are searched at once: (row, term ID) keys of all vectors are concatenated into a single sorted
+        array.
+
+        :param term_vectors: list of TermVector objects
+        :param terms: list of terms
+        :return: numpy array of size len(term_vectors) x len(terms)
+        """
+        if len(term_vectors) == 0 or len(terms) == 0:
+            return numpy.zeros((len(term_vectors), len(terms)))
+        term_dicts = {}  # {TermDictionary: index}; term vectors may use different dictionaries
+        dict_index = [term_dicts.setdefault(tv.term_dict, len(term_dicts)) for tv in term_vectors]
+        term_ids = numpy.array([term_dict.get_ids(terms) for term_dict in term_dicts], dtype=numpy.int64)
+        rows = numpy.arange(len(term_vectors), dtype=numpy.int64) << 32
+        lengths = [len(tv.term_ids) for tv in term_vectors]
+        keys = numpy.concatenate([tv.term_ids for tv in term_vectors]).astype(numpy.int64) + numpy.repeat(rows, lengths)
+        if len(keys) == 0:
+            return numpy.zeros((len(term_vectors), len(terms)))
+        counts = numpy.concatenate([tv.counts for tv in term_vectors])
+        query_keys = rows[:, None] + term_ids[dict_index]  # missing terms (-1) do not match any key
+        pos = numpy.minimum(keys.searchsorted(query_keys), len(keys) - 1)
+        return numpy.where(keys[pos] == query_keys, counts[pos], 0)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.__term_ids) + sys.getsizeof(self.__counts)
+
+    def __repr__(self):
+        return "TermVector(" + repr(dict(self.items())) + ")"
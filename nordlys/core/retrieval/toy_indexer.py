@@ -4,12 +4,20 @@ Toy Indexer
 
 Toy indexing example for testing purposes.
 
+The toy index is built in Elasticsearch; if a directory is given as argument, a
+:class:`~nordlys.core.retrieval.local_index.LocalIndex` is built instead (no Elasticsearch needed)::
+
+    python -m nordlys.core.retrieval.toy_indexer [local_index_dir]
+
 :Authors: Krisztian Balog, Faegheh Hasibi
 """
+import sys
+
 from nordlys.core.retrieval.elastic import Elastic
+from nordlys.core.retrieval.local_index import LocalIndexWriter
 
 
-def main():
+def main(local_index_dir=None):
     index_name = "toy_index"
 
     mappings = {
@@ -35,12 +43,18 @@ def main():
             }
     }
 
-    elastic = Elastic(index_name)
-    elastic.create_index(mappings, force=True)
-    elastic.add_docs_bulk(docs)
+    if local_index_dir:
+        index = LocalIndexWriter(local_index_dir)
+        index.create_index(mappings, force=True)
+        index.add_docs_bulk(docs)
+        index.close()
+    else:
+        elastic = Elastic(index_name)
+        elastic.create_index(mappings, force=True)
+        elastic.add_docs_bulk(docs)
     print("index has been built")
 
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,206 @@
+"""
+ID Mapping
+==========
+
+Compact, memory-mapped bidirectional mapping between two sets of IDs (e.g., Freebase and DBpedia IDs); an
+alternative to looking up the mapping in MongoDB.
+
+  - IDs of each side are interned in a string table and indexed by a 64-bit hash: lookups are a hash, a binary
+    search over a sorted array of hashes, and a comparison with the stored ID; no Python objects are created per ID.
+  - Each side is stored as a set of files ``<side>.*`` (``forward`` and ``inverse``):
+
+      - ``<side>.hashes.npy``: sorted hashes of the IDs
+      - ``<side>.ids.bin`` and ``<side>.id_offsets.npy``: UTF-8 encoded IDs (in the order of the hashes)
+      - ``<side>.value_offsets.npy`` and ``<side>.values.npy``: mapped IDs (as positions in the other side)
+
+  - The files are memory-mapped read-only, so all processes using the same mapping share the same pages.
+
+Usage
+-----
+
+Building the Freebase to DBpedia mapping from the MongoDB collection::
+
+  python -m nordlys.core.storage.id_mapping <collection> <output_dir>
+
+The mapping can also be built from the mapping files; see :py:mod:`nordlys.core.data.dbpedia.freebase2dbpedia2mongo`.
+It is used by :class:`~nordlys.logic.entity.entity.Entity` if ``fb2dbp_index_dir`` is set in ``config/mongo.json``.
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import threading
+from array import array
+
+import numpy
+
+from nordlys.config import MONGO_HOST, MONGO_DB, PLOGGER
+from nordlys.core.storage.mongo import Mongo
+
+FORWARD = "forward"
+INVERSE = "inverse"
+
+
+def get_hash(s):
+    """Returns a 64-bit hash of a string (stable across processes)."""
+    return int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class IDMappingWriter(object):
+    """Builds an ID mapping; all pairs are kept in memory until :func:`close` is called."""
+
+    def __init__(self, mapping_dir):
+        self.__mapping_dir = mapping_dir
+        self.__ids = {FORWARD: {}, INVERSE: {}}  # {side: {ID: number}}
+        self.__pairs = array("q")  # forward and inverse numbers, interleaved
+
+    def add(self, key, values):
+        """Adds the mapping of a key.
+
+        :param key: ID (forward side)
+        :param values: list of mapped IDs (inverse side)
+        """
+        forward, inverse = self.__ids[FORWARD], self.__ids[INVERSE]
+        key_num = forward.setdefault(key, len(forward))
+        for value in values:
+            self.__pairs.append(key_num)
+            self.__pairs.append(inverse.setdefault(value, len(inverse)))
+
+    def __save(self, name, values):
+        numpy.save(os.path.join(self.__mapping_dir, name + ".npy"), values)
+
+    def __write_side(self, side, ids, order, pairs, positions):
+        """Writes a side of the mapping.
+
+        :param ids: IDs of the side (in insertion order)
+        :param order: order of the IDs in the table
+        :param pairs: numpy array of (number on this side, number on the other side) pairs
+        :param positions: positions of the IDs of the other side in their table
+        """
+        with open(os.path.join(self.__mapping_dir, side + ".ids.bin"), "wb") as f:
+            id_offsets = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+            for i, num in enumerate(order):
+                id_bytes = ids[num].encode("utf-8")
+                f.write(id_bytes)
+                id_offsets[i + 1] = id_offsets[i] + len(id_bytes)
+        self.__save(side + ".id_offsets", id_offsets)
+
+        rank = numpy.zeros(len(ids), dtype=numpy.int64)  # position of each ID in the table
+        rank[order] = numpy.arange(len(ids))
+        pair_pos = rank[pairs[:, 0]]
+        sort = numpy.argsort(pair_pos, kind="stable")  # mapped IDs are kept in insertion order
+        value_offsets = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+        value_offsets[1:] = numpy.cumsum(numpy.bincount(pair_pos, minlength=len(ids)))
+        self.__save(side + ".value_offsets", value_offsets)
+        self.__save(side + ".values", positions[pairs[sort, 1]].astype(numpy.uint32))
+
+    def close(self):
+        """Writes the mapping to the disk."""
+        if not os.path.exists(self.__mapping_dir):
+            os.makedirs(self.__mapping_dir)
+        pairs = numpy.frombuffer(self.__pairs, dtype=numpy.int64).reshape(-1, 2)
+        ids, orders, positions = {}, {}, {}
+        for side in [FORWARD, INVERSE]:
+            ids[side] = sorted(self.__ids[side], key=self.__ids[side].get)
+            hashes = numpy.array([get_hash(i) for i in ids[side]], dtype=numpy.uint64)
+            orders[side] = numpy.argsort(hashes, kind="stable")
+            positions[side] = numpy.zeros(len(ids[side]), dtype=numpy.int64)
+            positions[side][orders[side]] = numpy.arange(len(ids[side]))
+            self.__save(side + ".hashes", hashes[orders[side]])
+        self.__write_side(FORWARD, ids[FORWARD], orders[FORWARD], pairs, positions[INVERSE])
+        self.__write_side(INVERSE, ids[INVERSE], orders[INVERSE], pairs[:, ::-1], positions[FORWARD])
+        meta = {FORWARD: len(ids[FORWARD]), INVERSE: len(ids[INVERSE]), "pairs": len(pairs)}
+        json.dump(meta, open(os.path.join(self.__mapping_dir, "meta.json"), "w"), indent=4, sort_keys=True)
+        PLOGGER.info(str(len(pairs)) + " ID pairs are written to " + self.__mapping_dir)
+
+
+class IDMapping(object):
+    """Read-only access to an ID mapping."""
+    __mappings = {}  # {mapping_dir: IDMapping}; shared instances, see :func:`get_instance`
+    __mappings_lock = threading.Lock()
+
+    def __init__(self, mapping_dir):
+        self.__mapping_dir = mapping_dir
+        self.__sides = {}
+        for side in [FORWARD, INVERSE]:
+            with open(os.path.join(mapping_dir, side + ".ids.bin"), "rb") as f:
+                ids = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b""
+            self.__sides[side] = {"ids": ids}
+            for name in ["hashes", "id_offsets", "value_offsets", "values"]:
+                # plain array views of the mapped files; indexing numpy.memmap objects is considerably slower
+                self.__sides[side][name] = numpy.asarray(
+                    numpy.load(os.path.join(mapping_dir, side + "." + name + ".npy"), mmap_mode="r"))
+
+    @staticmethod
+    def get_instance(mapping_dir):
+        """Returns the shared IDMapping object of a mapping directory."""
+        if mapping_dir not in IDMapping.__mappings:
+            with IDMapping.__mappings_lock:
+                if mapping_dir not in IDMapping.__mappings:
+                    IDMapping.__mappings[mapping_dir] = IDMapping(mapping_dir)
+        return IDMapping.__mappings[mapping_dir]
+
+    @staticmethod
+    def exists(mapping_dir):
+        """Checks whether a mapping is in the given directory."""
+        return os.path.exists(os.path.join(mapping_dir, "meta.json"))
+
+    @staticmethod
+    def __get_id(data, pos):
+        return data["ids"][int(data["id_offsets"][pos]):int(data["id_offsets"][pos + 1])].decode("utf-8")
+
+    def __find(self, data, id):
+        """Returns the position of an ID (or -1)."""
+        h = numpy.uint64(get_hash(id))
+        hashes = data["hashes"]
+        pos = int(hashes.searchsorted(h))
+        while pos < len(hashes) and hashes[pos] == h:  # checks the ID (in case of hash collisions)
+            if self.__get_id(data, pos) == id:
+                return pos
+            pos += 1
+        return -1
+
+    def __lookup(self, side, id):
+        data = self.__sides[side]
+        pos = self.__find(data, id)
+        if pos < 0:
+            return None
+        other = self.__sides[INVERSE if side == FORWARD else FORWARD]
+        start, end = int(data["value_offsets"][pos]), int(data["value_offsets"][pos + 1])
+        return [self.__get_id(other, i) for i in data["values"][start:end].tolist()]
+
+    def get(self, key):
+        """Returns the list of IDs mapped to a key (None if the key is not in the mapping)."""
+        return self.__lookup(FORWARD, key)
+
+    def get_inverse(self, value):
+        """Returns the list of keys mapped to an ID (None if the ID is not in the mapping)."""
+        return self.__lookup(INVERSE, value)
+
+
+def build_from_mongo(collection, mapping_dir, predicate="!<owl:sameAs>"):
+    """Builds a mapping from a MongoDB collection (e.g., Freebase to DBpedia)."""
+    writer = IDMappingWriter(mapping_dir)
+    mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+    for mdoc in mongo.find_all(no_timeout=True):
+        doc = Mongo.unescape_doc(mdoc)
+        writer.add(doc[Mongo.ID_FIELD], doc.get(predicate, []))
+    writer.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("collection", help="name of the collection (e.g., Freebase to DBpedia)", type=str)
+    parser.add_argument("output_dir", help="the mapping is written to <output_dir>/<collection>", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    build_from_mongo(args.collection, os.path.join(args.output_dir, args.collection))
+
+
+if __name__ == "__main__":
+    main(arg_parser())
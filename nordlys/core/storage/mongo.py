@@ -4,6 +4,8 @@ Mongo
 
 Tools for working with MongoDB.
 
+Lookups can be recorded and replayed without a MongoDB server; see :py:mod:`nordlys.core.utils.replay`.
+
 :Authors: Krisztian Balog, Faegheh Hasibi
 """
 
@@ -11,6 +13,38 @@ import argparse
 from nordlys.config import MONGO_DB, MONGO_HOST
 from pymongo import MongoClient
 from nordlys.config import PLOGGER
+from nordlys.core.utils import replay, timing
+
+
+class ReplayCollection(object):
+    """Collection whose lookups (``find_one`` and ``find`` with a filter) are recorded or replayed.
+    Other operations are passed to the underlying collection (and are not supported in replay mode)."""
+
+    def __init__(self, collection, db, collection_name, recording):
+        """
+        :param collection: pymongo collection (None in replay mode)
+        :param db: name of the database
+        :param collection_name: name of the collection
+        :param recording: Recording object
+        """
+        self.__collection = collection
+        self.__name = db + "." + collection_name
+        self.__recording = recording
+
+    def find_one(self, filter):
+        key = self.__recording.get_key("find_one", self.__name, filter)
+        return self.__recording.call(key, lambda: self.__collection.find_one(filter))
+
+    def find(self, filter=None, *args, **kwargs):
+        if filter is None:
+            return self.__getattr__("find")(filter, *args, **kwargs)
+        key = self.__recording.get_key("find", self.__name, filter, args, kwargs)
+        return self.__recording.call(key, lambda: list(self.__collection.find(filter, *args, **kwargs)))
+
+    def __getattr__(self, name):
+        if self.__collection is None:
+            raise Exception("Operation " + name + " is not supported in replay mode.")
+        return getattr(self.__collection, name)
 
 
 class Mongo(object):
@@ -18,9 +52,16 @@ class Mongo(object):
     ID_FIELD = "_id"
 
     def __init__(self, host, db, collection):
-        self.__client = MongoClient(host)
-        self.__db = self.__client[db]
-        self.__collection = self.__db[collection]
+        recording = replay.get_recording(replay.BACKEND_MONGO)
+        if recording is not None and recording.mode == replay.MODE_REPLAY:
+            self.__client = None
+            self.__collection = ReplayCollection(None, db, collection, recording)
+        else:
+            self.__client = MongoClient(host)
+            self.__db = self.__client[db]
+            self.__collection = self.__db[collection]
+            if recording is not None:
+                self.__collection = ReplayCollection(self.__collection, db, collection, recording)
         self.__db_name = db
         self.__collection_name = collection
         # PLOGGER.info("Connected to " + self.__db_name + "." + self.__collection_name)
@@ -142,8 +183,25 @@ class Mongo(object):
 
     def find_by_id(self, doc_id):
         """Returns unescaped document content for a given document id."""
+        timing.count("mongo_lookups")
         return self.unescape_doc(self.__collection.find_one({Mongo.ID_FIELD: self.__escape(doc_id)}))
 
+    def find_by_ids(self, doc_ids):
+        """Returns unescaped document contents for multiple document ids, using a single query.
+
+        :param doc_ids: list of document ids
+        :return: dictionary {doc_id: document}; ids that are not found are omitted
+        """
+        doc_ids = sorted(set(doc_ids))
+        if len(doc_ids) == 0:
+            return {}
+        timing.count("mongo_lookups")
+        docs = {}
+        for mdoc in self.__collection.find({Mongo.ID_FIELD: {"$in": [self.__escape(doc_id) for doc_id in doc_ids]}}):
+            doc = self.unescape_doc(mdoc)
+            docs[doc[Mongo.ID_FIELD]] = doc
+        return docs
+
     def find_all(self, no_timeout=False):
         """Returns a Cursor instance that allows us to iterate over all documents."""
         return self.__collection.find(no_cursor_timeout=no_timeout)
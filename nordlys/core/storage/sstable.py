@@ -0,0 +1,257 @@
+"""
+SSTable
+=======
+
+Sorted string table: a read-only, memory-mapped alternative to the surface form collections in MongoDB.
+
+Surface form documents ``{surface_form: {predicate: {entity_id: count}}}`` are compiled into a directory of flat
+files, which are memory-mapped by :class:`SSTable`. Lookups are binary searches over the sorted keys, without any
+MongoDB round trip. Since the files are mapped read-only, all processes using the same table share the same pages.
+
+Table layout
+------------
+
+  - ``meta.json``: number of keys and predicates (list index is the predicate ID)
+  - ``keys.bin`` and ``key_offsets.npy``: UTF-8 encoded keys, sorted bytewise
+  - ``ids.bin`` and ``id_offsets.npy``: string table of the (sorted) entity IDs
+  - packed candidate lists: ``cand_offsets.npy`` (per key), ``cand_preds.npy`` (predicate IDs), ``cand_ids.npy``
+    (entity IDs) and ``cand_counts.npy``; the smallest unsigned integer type that holds the values is used
+
+Usage
+-----
+
+Compiling a surface form collection (the table is written to ``<output_dir>/<collection>``)::
+
+  python -m nordlys.core.storage.sstable <collection> <output_dir>
+
+Lookups are served from the tables if ``sf_index_dir`` is set to the output directory in ``config/mongo.json``
+(see :class:`~nordlys.logic.entity.entity.Entity`).
+"""
+
+import argparse
+import json
+import mmap
+import os
+import threading
+from array import array
+
+import numpy
+
+from nordlys.config import MONGO_HOST, MONGO_DB, PLOGGER
+from nordlys.core.storage.mongo import Mongo
+
+
+def _min_uint_dtype(max_value):
+    """Returns the smallest unsigned integer type that holds the given value."""
+    for dtype in [numpy.uint8, numpy.uint16, numpy.uint32]:
+        if max_value <= numpy.iinfo(dtype).max:
+            return dtype
+    return numpy.uint64
+
+
+class SSTableWriter(object):
+    """Builds a sorted string table; all entries are kept in (compact) memory until :func:`close` is called."""
+
+    def __init__(self, table_dir):
+        self.__table_dir = table_dir
+        self.__keys = {}  # {key: entry number}
+        self.__predicates = {}  # {predicate: predicate ID}
+        self.__ids = {}  # {entity ID: number (in insertion order)}
+        self.__cand_offsets = array("q", [0])
+        self.__cand_preds = array("q")
+        self.__cand_ids = array("q")
+        self.__cand_counts = array("q")
+
+    def add(self, key, doc):
+        """Adds a surface form document.
+
+        :param key: surface form
+        :param doc: dictionary {predicate: {entity_id: count, ..}, ..}; the "_id" field is ignored
+        """
+        if key in self.__keys:
+            raise Exception("Duplicate key " + key)
+        self.__keys[key] = len(self.__keys)
+        for predicate, ens in sorted(doc.items()):
+            if predicate == Mongo.ID_FIELD:
+                continue
+            pred_id = self.__predicates.setdefault(predicate, len(self.__predicates))
+            for en_id, count in ens.items():
+                self.__cand_preds.append(pred_id)
+                self.__cand_ids.append(self.__ids.setdefault(en_id, len(self.__ids)))
+                self.__cand_counts.append(int(count))
+        self.__cand_offsets.append(len(self.__cand_ids))
+
+    def __save(self, name, values):
+        numpy.save(os.path.join(self.__table_dir, name + ".npy"), values)
+
+    def __save_strings(self, name, offsets_name, strings):
+        """Writes the strings (in the given order) to ``<name>.bin`` and their offsets to ``<offsets_name>.npy``."""
+        offsets = numpy.zeros(len(strings) + 1, dtype=numpy.int64)
+        with open(os.path.join(self.__table_dir, name + ".bin"), "wb") as f:
+            for i, s in enumerate(strings):
+                f.write(s)
+                offsets[i + 1] = offsets[i] + len(s)
+        self.__save(offsets_name, offsets)
+
+    def close(self):
+        """Writes the table to the disk."""
+        if not os.path.exists(self.__table_dir):
+            os.makedirs(self.__table_dir)
+
+        # entity IDs are sorted and renumbered
+        ids = sorted(self.__ids, key=lambda en_id: en_id.encode("utf-8"))
+        renumber = numpy.zeros(len(ids), dtype=numpy.int64)
+        for new_id, en_id in enumerate(ids):
+            renumber[self.__ids[en_id]] = new_id
+        self.__save_strings("ids", "id_offsets", [en_id.encode("utf-8") for en_id in ids])
+
+        # keys are sorted bytewise; candidate lists are reordered accordingly
+        keys = sorted((key.encode("utf-8"), entry) for key, entry in self.__keys.items())
+        self.__save_strings("keys", "key_offsets", [key for key, _ in keys])
+        offsets = numpy.frombuffer(self.__cand_offsets, dtype=numpy.int64)
+        cand_preds = numpy.frombuffer(self.__cand_preds, dtype=numpy.int64)
+        cand_ids = renumber[numpy.frombuffer(self.__cand_ids, dtype=numpy.int64)]
+        cand_counts = numpy.frombuffer(self.__cand_counts, dtype=numpy.int64)
+        entries = numpy.array([entry for _, entry in keys], dtype=numpy.int64)
+        lengths = (offsets[1:] - offsets[:-1])[entries]
+        cand_offsets = numpy.zeros(len(keys) + 1, dtype=numpy.int64)
+        cand_offsets[1:] = numpy.cumsum(lengths)
+        # position of each candidate in the insertion order
+        order = numpy.repeat(offsets[entries] - cand_offsets[:-1], lengths) + numpy.arange(cand_offsets[-1])
+        self.__save("cand_offsets", cand_offsets)
+        self.__save("cand_preds", cand_preds[order].astype(_min_uint_dtype(len(self.__predicates))))
+        self.__save("cand_ids", cand_ids[order].astype(_min_uint_dtype(len(ids))))
+        max_count = int(cand_counts.max()) if len(cand_counts) > 0 else 0
+        if len(cand_counts) > 0 and cand_counts.min() < 0:
+            raise Exception("Negative counts are not supported.")
+        self.__save("cand_counts", cand_counts[order].astype(_min_uint_dtype(max_count)))
+
+        predicates = sorted(self.__predicates, key=self.__predicates.get)
+        meta = {"num_keys": len(keys), "num_ids": len(ids), "predicates": predicates}
+        json.dump(meta, open(os.path.join(self.__table_dir, "meta.json"), "w"), indent=4, sort_keys=True)
+        PLOGGER.info(str(len(keys)) + " keys are written to " + self.__table_dir)
+
+
+class SSTable(object):
+    """Read-only access to a sorted string table; lookups have the same output as :func:`Mongo.find_by_id`."""
+    __tables = {}  # {table_dir: SSTable}; shared instances, see :func:`get_instance`
+    __tables_lock = threading.Lock()
+
+    def __init__(self, table_dir):
+        self.__table_dir = table_dir
+        self.__meta = json.load(open(os.path.join(table_dir, "meta.json")))
+        self.__predicates = self.__meta["predicates"]
+        self.__keys, self.__key_offsets = self.__load_strings("keys", "key_offsets")
+        self.__ids, self.__id_offsets = self.__load_strings("ids", "id_offsets")
+        self.__cand_offsets = self.__load("cand_offsets")
+        self.__cand_preds = self.__load("cand_preds")
+        self.__cand_ids = self.__load("cand_ids")
+        self.__cand_counts = self.__load("cand_counts")
+
+    @staticmethod
+    def get_instance(table_dir):
+        """Returns the shared SSTable object of a table directory."""
+        if table_dir not in SSTable.__tables:
+            with SSTable.__tables_lock:
+                if table_dir not in SSTable.__tables:
+                    SSTable.__tables[table_dir] = SSTable(table_dir)
+        return SSTable.__tables[table_dir]
+
+    @staticmethod
+    def exists(table_dir):
+        """Checks whether a table is in the given directory."""
+        return os.path.exists(os.path.join(table_dir, "meta.json"))
+
+    def __load(self, name):
+        return numpy.load(os.path.join(self.__table_dir, name + ".npy"), mmap_mode="r")
+
+    def __load_strings(self, name, offsets_name):
+        """Memory-maps a string table; returns the mapped bytes and the offsets."""
+        with open(os.path.join(self.__table_dir, name + ".bin"), "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > 0 else b""
+        return data, self.__load(offsets_name)
+
+    def __len__(self):
+        return self.__meta["num_keys"]
+
+    def __find(self, key):
+        """Returns the position of a key (or -1)."""
+        key = key.encode("utf-8")
+        offsets, keys = self.__key_offsets, self.__keys
+        lo, hi = 0, self.__meta["num_keys"]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = keys[int(offsets[mid]):int(offsets[mid + 1])]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def __get_id(self, i):
+        return self.__ids[int(self.__id_offsets[i]):int(self.__id_offsets[i + 1])].decode("utf-8")
+
+    def __contains__(self, key):
+        return self.__find(key) >= 0
+
+    def find_by_id(self, doc_id):
+        """Returns the document of a key (None if the key is not in the table).
+
+        :param doc_id: key (surface form)
+        :return: dictionary {"_id": doc_id, predicate: {entity_id: count, ..}, ..}
+        """
+        pos = self.__find(doc_id)
+        if pos < 0:
+            return None
+        start, end = int(self.__cand_offsets[pos]), int(self.__cand_offsets[pos + 1])
+        doc = {Mongo.ID_FIELD: doc_id}
+        for pred_id, i, count in zip(self.__cand_preds[start:end].tolist(), self.__cand_ids[start:end].tolist(),
+                                     self.__cand_counts[start:end].tolist()):
+            predicate = self.__predicates[pred_id]
+            if predicate not in doc:
+                doc[predicate] = {}
+            doc[predicate][self.__get_id(i)] = count
+        return doc
+
+    def find_by_ids(self, doc_ids):
+        """Returns the documents of multiple keys; see :func:`Mongo.find_by_ids`.
+
+        :param doc_ids: list of keys
+        :return: dictionary {doc_id: document}; keys that are not in the table are omitted
+        """
+        docs = {}
+        for doc_id in set(doc_ids):
+            doc = self.find_by_id(doc_id)
+            if doc is not None:
+                docs[doc_id] = doc
+        return docs
+
+
+def build_from_mongo(collection, table_dir):
+    """Compiles a surface form collection into a table."""
+    writer = SSTableWriter(table_dir)
+    mongo = Mongo(MONGO_HOST, MONGO_DB, collection)
+    for i, mdoc in enumerate(mongo.find_all(no_timeout=True)):
+        doc = Mongo.unescape_doc(mdoc)
+        writer.add(doc[Mongo.ID_FIELD], doc)
+        if (i + 1) % 1000000 == 0:
+            PLOGGER.info(str(i + 1) + " documents are read")
+    writer.close()
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("collection", help="name of the surface form collection", type=str)
+    parser.add_argument("output_dir", help="the table is written to <output_dir>/<collection>", type=str)
+    args = parser.parse_args()
+    return args
+
+
+def main(args):
+    build_from_mongo(args.collection, os.path.join(args.output_dir, args.collection))
+
+
+if __name__ == "__main__":
+    main(arg_parser())
@@ -0,0 +1,146 @@
+"""
+LRU Cache
+=========
+
+A size- and byte-bounded least-recently-used (LRU) cache with instrumentation.
+
+  - Entries are evicted in LRU order when either the maximum number of entries or the maximum (estimated)
+    number of bytes is exceeded.
+  - ``None`` is a valid value; use :func:`LRUCache.lookup` to tell cached negative results apart from misses.
+  - Hit/miss/eviction counters and the estimated resident bytes are available via :func:`LRUCache.stats`.
+  - The cache is thread-safe; all operations on the entries hold a lock. :func:`LRUCache.get_or_set` does not hold
+    the lock while computing a missing value, so the value may be computed by multiple threads at the same time.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from nordlys.core.utils import timing
+
+
+def estimate_size(obj):
+    """Returns a (rough) estimate of the memory footprint of an object in bytes.
+
+    Tuples are traversed recursively. Other containers (dict, list, set) are estimated from their length and their
+    first item, assuming items of similar size; this keeps the cost of an estimate independent of the size of large
+    values (e.g., term vectors). Shared objects are counted multiple times.
+
+    :param obj: any Python object
+    :return: estimated size in bytes
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, tuple):
+        for item in obj:
+            size += estimate_size(item)
+    elif isinstance(obj, dict):
+        if len(obj) > 0:
+            key, value = next(iter(obj.items()))
+            size += len(obj) * (estimate_size(key) + estimate_size(value))
+    elif isinstance(obj, (list, set, frozenset)):
+        if len(obj) > 0:
+            size += len(obj) * estimate_size(next(iter(obj)))
+    return size
+
+
+class LRUCache(object):
+    """Least-recently-used cache bounded by number of entries and/or estimated bytes."""
+
+    MISSING = object()  # marker for cache misses (``None`` is a valid cached value)
+
+    def __init__(self, max_size=None, max_bytes=None, sizeof=estimate_size):
+        """
+        :param max_size: maximum number of entries (None: unbounded)
+        :param max_bytes: maximum number of estimated bytes (None: unbounded)
+        :param sizeof: function estimating the size of a (key, value) pair in bytes
+        """
+        self.__max_size = max_size
+        self.__max_bytes = max_bytes
+        self.__sizeof = sizeof
+        self.__data = OrderedDict()  # {key: (value, size)}
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    @property
+    def resident_bytes(self):
+        """Returns estimated number of bytes held by the cache entries."""
+        return self.__bytes
+
+    def lookup(self, key):
+        """Returns the cached value or ``LRUCache.MISSING``; updates the counters and the LRU order."""
+        with self.__lock:
+            entry = self.__data.get(key, None)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.__data.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            timing.count("cache_misses")
+            return self.MISSING
+        timing.count("cache_hits")
+        return entry[0]
+
+    def get(self, key, default=None):
+        """Returns the cached value or the default value."""
+        value = self.lookup(key)
+        return default if value is self.MISSING else value
+
+    def put(self, key, value):
+        """Adds (or replaces) an entry and evicts the least recently used entries if needed."""
+        size = self.__sizeof((key, value))
+        with self.__lock:
+            if key in self.__data:
+                self.__bytes -= self.__data.pop(key)[1]
+            self.__data[key] = (value, size)
+            self.__bytes += size
+            self.__evict()
+
+    def get_or_set(self, key, callback_func, *args):
+        """Returns the cached value; computes and caches it using the callback function if missing."""
+        value = self.lookup(key)
+        if value is self.MISSING:
+            value = callback_func(*args)
+            self.put(key, value)
+        return value
+
+    def delete(self, key):
+        """Removes an entry (if it exists)."""
+        with self.__lock:
+            if key in self.__data:
+                self.__bytes -= self.__data.pop(key)[1]
+
+    def __evict(self):
+        """Removes least recently used entries until the cache is within its bounds (the lock must be held)."""
+        while len(self.__data) > 0 and \
+                ((self.__max_size is not None and len(self.__data) > self.__max_size) or
+                 (self.__max_bytes is not None and self.__bytes > self.__max_bytes)):
+            _, (_, size) = self.__data.popitem(last=False)
+            self.__bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all entries (counters are kept)."""
+        with self.__lock:
+            self.__data.clear()
+            self.__bytes = 0
+
+    def stats(self):
+        """Returns cache statistics."""
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.__data),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups > 0 else 0,
+                    "resident_bytes": self.__bytes}
@@ -0,0 +1,111 @@
+"""
+Ranked List
+===========
+
+Utilities for ranking scored items and writing TREC run files.
+
+  - :func:`rank` selects the top (start + num) items using a heap (``heapq.nlargest``), instead of sorting all
+    items; the result is the same as that of a full (stable) sort, i.e., ties keep their original order.
+  - :func:`rank_indices` does the same for NumPy arrays of scores using ``numpy.argpartition``.
+  - :class:`TrecWriter` writes ranked lists in TREC format through a buffer.
+"""
+
+import heapq
+from operator import itemgetter
+
+import numpy
+
+
+def rank(scores, num=None, start=0, score_func=None):
+    """Ranks items by score (in descending order) and returns a page of the ranked list.
+
+    :param scores: dictionary {item_id: score} or list of (item_id, score) pairs
+    :param num: number of items to return (None: all items)
+    :param start: starting offset (for pagination)
+    :param score_func: function that returns the score for a value (default: the value itself is the score);
+        e.g., ``lambda v: v["score"]`` for {item_id: {"score": score, ...}}
+    :return: list of (item_id, value) pairs, ranked from position start to start + num
+    """
+    items = scores.items() if isinstance(scores, dict) else scores
+    key = itemgetter(1) if score_func is None else (lambda item: score_func(item[1]))
+    if num is None:
+        return sorted(items, key=key, reverse=True)[start:]
+    return heapq.nlargest(start + num, items, key=key)[start:]
+
+
+def rank_indices(scores, num=None, start=0):
+    """Ranks the indices of a score array (in descending order of scores; ties by index).
+
+    :param scores: 1-D NumPy array of scores
+    :param num: number of indices to return (None: all)
+    :param start: starting offset (for pagination)
+    :return: NumPy array of indices, ranked from position start to start + num
+    """
+    scores = numpy.asarray(scores)
+    k = len(scores) if num is None else min(start + num, len(scores))
+    if k <= 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    candidates = numpy.arange(len(scores))
+    if k < len(scores):
+        # all items scoring at least the k-th highest score are candidates, so that ties are resolved as in sorting
+        threshold = scores[numpy.argpartition(-scores, k - 1)[k - 1]]
+        candidates = numpy.flatnonzero(scores >= threshold)
+    ranked = candidates[numpy.lexsort((candidates, -scores[candidates]))]
+    return ranked[start:k]
+
+
+def trec_lines(query_id, ranked, run_id, start=0, score_format=str):
+    """Returns TREC-formatted lines for a ranked list.
+
+    :param query_id: query ID
+    :param ranked: list of (doc_id, score) pairs (see :func:`rank`)
+    :param run_id: run ID
+    :param start: rank offset of the first item (ranks start from start + 1)
+    :param score_format: function converting the score to string
+    :return: list of lines
+    """
+    return [query_id + "\tQ0\t" + doc_id + "\t" + str(r) + "\t" + score_format(score) + "\t" + run_id + "\n"
+            for r, (doc_id, score) in enumerate(ranked, start + 1)]
+
+
+class TrecWriter(object):
+    """Buffered writer for TREC run files."""
+
+    def __init__(self, out, run_id, score_format=str, buffer_lines=10000):
+        """
+        :param out: output file name or file object
+        :param run_id: run ID
+        :param score_format: function converting scores to string
+        :param buffer_lines: number of lines buffered before writing to the file
+        """
+        self.__close_out = isinstance(out, str)
+        self.__out = open(out, "w") if self.__close_out else out
+        self.__run_id = run_id
+        self.__score_format = score_format
+        self.__buffer_lines = buffer_lines
+        self.__buffer = []
+
+    def write(self, query_id, ranked, start=0):
+        """Writes a ranked list of (doc_id, score) pairs for a query."""
+        self.__buffer += trec_lines(query_id, ranked, self.__run_id, start, self.__score_format)
+        if len(self.__buffer) >= self.__buffer_lines:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered lines to the file."""
+        if len(self.__buffer) > 0:
+            self.__out.write("".join(self.__buffer))
+            self.__buffer = []
+        self.__out.flush()
+
+    def close(self):
+        """Flushes the buffer; closes the file if it was opened by the writer."""
+        self.flush()
+        if self.__close_out:
+            self.__out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,192 @@
+"""
+Replay
+======
+
+Record-and-replay of backend (Elasticsearch and MongoDB) requests.
+
+  - In ``record`` mode, the requests made by :class:`~nordlys.core.retrieval.elastic.Elastic` and
+    :class:`~nordlys.core.storage.mongo.Mongo` are sent to the backends as usual, and the request/response pairs
+    (together with the measured latencies) are saved to a recording file per backend.
+  - In ``replay`` mode, responses are served from the recording files, without connecting to the backends; the
+    latency of the backends is simulated by sleeping before each response (see below).
+  - Recordings are gzip-compressed JSON lines ``{"key": xx, "latency": xx, "response": xx}``; requests are keyed by
+    the SHA-1 digest of their canonical JSON representation.
+  - Requests that are not in the recording raise an exception in replay mode.
+
+Settings are read from ``config/replay.json`` and can be overridden with :func:`configure` (which must be called
+before the Elastic and Mongo objects are created):
+
+  - **mode**: null (disabled), "record", or "replay"
+  - **dir**: directory of the recording files (``elastic.jsonl.gz`` and ``mongo.jsonl.gz``)
+  - **latency**: latency injected in replay mode, per backend {"elastic": xx, "mongo": xx}; accepted values are
+    null (no latency), "recorded" (the latency measured during recording), or a fixed latency in milliseconds
+  - **latency_scale**: factor applied to the injected latencies (default: 1.0)
+"""
+
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from nordlys.config import PLOGGER, REPLAY_CONFIG
+
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+BACKEND_ELASTIC = "elastic"
+BACKEND_MONGO = "mongo"
+
+_settings = dict(REPLAY_CONFIG)
+_recordings = {}  # {backend: Recording}
+_lock = threading.Lock()
+
+
+class Recording(object):
+    """Request/response pairs of a backend, stored in a recording file."""
+
+    def __init__(self, file_name, mode, latency=None, latency_scale=1.0):
+        """
+        :param file_name: recording file
+        :param mode: MODE_RECORD or MODE_REPLAY
+        :param latency: injected latency in replay mode: None, "recorded", or milliseconds
+        :param latency_scale: factor applied to the injected latencies
+        """
+        if mode not in {MODE_RECORD, MODE_REPLAY}:
+            raise Exception("Unknown replay mode: " + str(mode))
+        self.__file_name = file_name
+        self.__mode = mode
+        self.__latency = latency
+        self.__latency_scale = latency_scale
+        self.__entries = {}  # {key: (latency, response JSON)}
+        self.__lock = threading.Lock()
+        self.__modified = False
+        if mode == MODE_REPLAY or os.path.exists(file_name):
+            self.load()
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @staticmethod
+    def get_key(*request):
+        """Returns the key of a request, given as JSON-serializable components (e.g., method, url, and body)."""
+        request_json = json.dumps(request, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha1(request_json.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """Loads the recording file."""
+        if not os.path.exists(self.__file_name):
+            raise Exception("Recording file " + self.__file_name + " does not exist.")
+        with gzip.open(self.__file_name, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.__entries[entry["key"]] = (entry["latency"], json.dumps(entry["response"]))
+        PLOGGER.info("Loaded " + str(len(self.__entries)) + " recorded responses from " + self.__file_name)
+
+    def save(self):
+        """Writes the recording file (if new responses are recorded)."""
+        with self.__lock:
+            if not self.__modified:
+                return
+            dir_name = os.path.dirname(self.__file_name)
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+            with gzip.open(self.__file_name, "wt", encoding="utf-8") as f:
+                for key, (latency, response_json) in self.__entries.items():
+                    f.write("{\"key\": " + json.dumps(key) + ", \"latency\": " + json.dumps(latency) +
+                            ", \"response\": " + response_json + "}\n")
+            self.__modified = False
+        PLOGGER.info("Recorded " + str(len(self.__entries)) + " responses to " + self.__file_name)
+
+    def record(self, key, response, latency):
+        """Adds a response to the recording.
+
+        :param key: request key (see :func:`get_key`)
+        :param response: JSON-serializable response
+        :param latency: latency of the request in seconds
+        """
+        response_json = json.dumps(response)
+        with self.__lock:
+            self.__entries[key] = (latency, response_json)
+            self.__modified = True
+
+    def replay(self, key):
+        """Returns the recorded response (a new object on each call), after sleeping for the injected latency."""
+        entry = self.__entries.get(key, None)
+        if entry is None:
+            raise Exception("Request " + key + " is not in the recording " + self.__file_name)
+        latency, response_json = entry
+        if self.__latency is not None:
+            delay = latency if self.__latency == "recorded" else float(self.__latency) / 1000
+            if delay > 0:
+                time.sleep(delay * self.__latency_scale)
+        return json.loads(response_json)
+
+    def call(self, key, func, *args, **kwargs):
+        """Replays the response of a request, or performs and records it (depending on the mode)."""
+        if self.__mode == MODE_REPLAY:
+            return self.replay(key)
+        start = time.perf_counter()
+        response = func(*args, **kwargs)
+        self.record(key, response, time.perf_counter() - start)
+        return response
+
+
+def configure(mode=None, record_dir=None, latency=None, latency_scale=None):
+    """Overrides the settings of ``config/replay.json``; recordings that are already open are saved and closed.
+
+    :param mode: None, "record", or "replay"
+    :param record_dir: directory of the recording files
+    :param latency: injected latency per backend, e.g. {"elastic": "recorded", "mongo": 1.5}
+    :param latency_scale: factor applied to the injected latencies
+    """
+    with _lock:
+        for recording in _recordings.values():
+            recording.save()
+        _recordings.clear()
+        _settings["mode"] = mode
+        if record_dir is not None:
+            _settings["dir"] = record_dir
+        if latency is not None:
+            _settings["latency"] = latency
+        if latency_scale is not None:
+            _settings["latency_scale"] = latency_scale
+
+
+def get_mode():
+    """Returns the replay mode (None if record-and-replay is disabled)."""
+    return _settings.get("mode", None)
+
+
+def get_recording(backend):
+    """Returns the recording of a backend (None if record-and-replay is disabled).
+
+    :param backend: BACKEND_ELASTIC or BACKEND_MONGO
+    """
+    mode = get_mode()
+    if mode is None:
+        return None
+    recording = _recordings.get(backend, None)
+    if recording is None:
+        with _lock:
+            if backend not in _recordings:
+                file_name = os.path.join(_settings.get("dir", "data/replay"), backend + ".jsonl.gz")
+                latency = (_settings.get("latency", None) or {}).get(backend, None)
+                _recordings[backend] = Recording(file_name, mode, latency, _settings.get("latency_scale", 1.0))
+            recording = _recordings[backend]
+    return recording
+
+
+def save():
+    """Saves all recordings."""
+    for recording in list(_recordings.values()):
+        recording.save()
+
+
+atexit.register(save)
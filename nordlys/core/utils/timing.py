@@ -0,0 +1,225 @@
+"""
+Timing
+======
+
+Lightweight per-request instrumentation: wall time per stage and counters of backend calls.
+
+  - A :class:`Trace` is started for the current thread with :func:`start_trace` (or the :func:`tracing` context
+    manager); it records the time spent in each stage and the counters, until :func:`stop_trace` is called.
+  - Stages are marked with the :func:`timed` decorator (for methods), the :class:`stage` context manager (for code
+    blocks) and :func:`timed_iter` (for the time spent waiting on an iterator, e.g., for prefetched term vectors).
+    Stages may be nested; the time of a stage includes that of its nested stages.
+  - Counters (Elasticsearch calls, Mongo lookups, cache hits/misses) are incremented with :func:`count`. Requests
+    made on worker threads (e.g., prefetching term vectors) are counted by the thread that submits them.
+  - When no trace is active, the instrumented code only performs a thread-local attribute lookup.
+  - Traces of multiple requests are aggregated by :class:`Metrics`.
+
+Stages and counters:
+
+  ================================  =========================================================================
+  ``analyze``                       query analysis
+  ``first_pass``                    first-pass retrieval (:func:`Retrieval._first_pass_scoring`)
+  ``termvector_fetch``              waiting for term vectors (:func:`ElasticCache.prefetch_termvectors`)
+  ``term_stats``                    fetching collection stats of the query terms
+  ``scoring``                       second-pass scoring
+  ``candidate_generation``          candidate entities of the mentions (:func:`Mention.get_cand_ens`)
+  ``feature_extraction``            LTR features (:func:`LTR.get_features`)
+  ``model_apply``                   applying the LTR model (:func:`ML.apply_model`)
+  ``disambiguation``                entity linking disambiguation
+  ``fusion``                        scoring objects from the retrieved documents (late fusion; entity-centric TTI)
+  ``es_calls``                      number of Elasticsearch requests
+  ``mongo_lookups``                 number of Mongo lookups
+  ``cache_hits``, ``cache_misses``  lookups in the LRU caches
+  ================================  =========================================================================
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+class _Local(threading.local):
+    trace = None  # active trace of the thread
+
+
+_local = _Local()
+
+
+class Trace(object):
+    """Stage times (in seconds) and counters of a single request."""
+
+    def __init__(self):
+        self.stages = {}  # {stage: [time, calls]}
+        self.counts = {}  # {counter: value}
+        self.__start = time.perf_counter()
+        self.total = None
+
+    def add_time(self, name, elapsed):
+        """Adds the elapsed time (in seconds) to a stage."""
+        stage_time = self.stages.get(name, None)
+        if stage_time is None:
+            self.stages[name] = [elapsed, 1]
+        else:
+            stage_time[0] += elapsed
+            stage_time[1] += 1
+
+    def count(self, name, n=1):
+        """Increments a counter."""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def stop(self):
+        """Sets the total wall time of the request."""
+        self.total = time.perf_counter() - self.__start
+
+    def to_dict(self):
+        """Returns the trace (times in milliseconds)."""
+        total = self.total if self.total is not None else time.perf_counter() - self.__start
+        return {"total_ms": round(total * 1000, 3),
+                "stages": {name: {"ms": round(t * 1000, 3), "calls": calls} for name, (t, calls) in self.stages.items()},
+                "counts": dict(self.counts)}
+
+
+def start_trace():
+    """Starts a new trace for the current thread and returns it."""
+    _local.trace = Trace()
+    return _local.trace
+
+
+def stop_trace():
+    """Stops the trace of the current thread and returns it (None if no trace is active)."""
+    trace = _local.trace
+    _local.trace = None
+    if trace is not None:
+        trace.stop()
+    return trace
+
+
+def current_trace():
+    """Returns the active trace of the current thread (or None)."""
+    return _local.trace
+
+
+@contextmanager
+def tracing(enabled=True):
+    """Context manager that traces the enclosed block; yields the trace (or None, if not enabled)."""
+    if not enabled:
+        yield None
+        return
+    trace = start_trace()
+    try:
+        yield trace
+    finally:
+        stop_trace()
+
+
+def count(name, n=1):
+    """Increments a counter of the active trace (if any)."""
+    trace = _local.trace
+    if trace is not None:
+        trace.count(name, n)
+
+
+class stage(object):
+    """Context manager measuring the wall time of a stage (if a trace is active)."""
+    __slots__ = ["__name", "__trace", "__start"]
+
+    def __init__(self, name):
+        self.__name = name
+        self.__trace = None
+
+    def __enter__(self):
+        self.__trace = _local.trace
+        if self.__trace is not None:
+            self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.__trace is not None:
+            self.__trace.add_time(self.__name, time.perf_counter() - self.__start)
+        return False
+
+
+def timed(name):
+    """Decorator measuring the wall time of a function as a stage (if a trace is active)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _local.trace
+            if trace is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, name):
+    """Returns the iterable; if a trace is active, the time spent in getting each item is added to the stage."""
+    trace = _local.trace
+    if trace is None:
+        return iterable
+    return _timed_iter(iter(iterable), name, trace)
+
+
+def _timed_iter(iterator, name, trace):
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            trace.add_time(name, time.perf_counter() - start)
+        yield item
+
+
+class Metrics(object):
+    """Aggregates the traces of multiple requests (per service)."""
+
+    def __init__(self):
+        self.__metrics = {}  # {service: {"requests": xx, "total": xx, "max": xx, "stages": {..}, "counts": {..}}}
+        self.__lock = threading.Lock()
+
+    def add(self, service, trace):
+        """Adds the trace of a request to the metrics of the service."""
+        with self.__lock:
+            metrics = self.__metrics.setdefault(service, {"requests": 0, "total": 0, "max": 0,
+                                                          "stages": {}, "counts": {}})
+            metrics["requests"] += 1
+            metrics["total"] += trace.total
+            metrics["max"] = max(metrics["max"], trace.total)
+            for name, (elapsed, calls) in trace.stages.items():
+                stage_metrics = metrics["stages"].setdefault(name, {"total": 0, "max": 0, "calls": 0})
+                stage_metrics["total"] += elapsed
+                stage_metrics["max"] = max(stage_metrics["max"], elapsed)
+                stage_metrics["calls"] += calls
+            for name, value in trace.counts.items():
+                metrics["counts"][name] = metrics["counts"].get(name, 0) + value
+
+    def stats(self):
+        """Returns the aggregated metrics (times in milliseconds; mean values are per request).
+
+        :return: {service: {"requests": xx, "mean_ms": xx, "max_ms": xx, "stages": {stage: {..}}, "counts": {..}}}
+        """
+        stats = {}
+        with self.__lock:
+            for service, metrics in self.__metrics.items():
+                n = metrics["requests"]
+                stats[service] = {
+                    "requests": n,
+                    "mean_ms": round(metrics["total"] * 1000 / n, 3),
+                    "max_ms": round(metrics["max"] * 1000, 3),
+                    "stages": {name: {"mean_ms": round(s["total"] * 1000 / n, 3),
+                                      "max_ms": round(s["max"] * 1000, 3),
+                                      "calls": s["calls"]} for name, s in metrics["stages"].items()},
+                    "counts": {name: {"total": value, "mean": value / n} for name, value in metrics["counts"].items()}}
+        return stats
+
+    def clear(self):
+        """Removes all aggregated metrics."""
+        with self.__lock:
+            self.__metrics = {}
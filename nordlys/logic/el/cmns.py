@@ -10,6 +10,7 @@ from collections import defaultdict
 
 import sys
 
+from nordlys.core.utils.timing import timed
 from nordlys.logic.el.el_utils import is_name_entity
 from nordlys.logic.entity.entity import Entity
 from nordlys.logic.query.mention import Mention
@@ -23,6 +24,7 @@ class Cmns(object):
         self.__threshold = threshold
         self.__cmns_th = cmns_th
         self.__ngrams = None
+        self.__cand_ens = None
         self.__ranked_ens = {}
         self.__mentions = set()
 
@@ -38,6 +40,8 @@ class Cmns(object):
     def rank_ens(self):
         """Detects mention and rank entities for each mention"""
         self.__get_ngrams()
+        # candidate entities of all n-grams are fetched together
+        self.__cand_ens = Mention.multi_get_cand_ens(self.__query.get_ngrams(), self.__entity, self.__cmns_th)
         self.__recursive_rank_ens(len(self.__query.query.split()))
 
     def __get_ngrams(self):
@@ -64,7 +68,7 @@ class Cmns(object):
 
         for ngram in self.__ngrams[n]:
             if not self.__is_overlapping(ngram):
-                all_cand_ens = Mention(ngram, self.__entity, self.__cmns_th).get_cand_ens()
+                all_cand_ens = self.__cand_ens[ngram]
                 # Keeps only proper named entities (if applicable)
                 cand_ens = {}
                 for en_id, commonness in all_cand_ens.items():
@@ -77,6 +81,7 @@ class Cmns(object):
                     self.__mentions.add(ngram)
         self.__recursive_rank_ens(n - 1)
 
+    @timed("disambiguation")
     def disambiguate(self):
         """Selects only one entity per mention.
 
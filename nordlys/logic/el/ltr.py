@@ -13,7 +13,8 @@ from nordlys.config import PLOGGER, ELASTIC_INDICES
 from nordlys.core.ml.instance import Instance
 from nordlys.core.ml.instances import Instances
 from nordlys.core.ml.ml import ML
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.local_index import get_index
+from nordlys.core.utils.timing import timed
 from nordlys.logic.el.el_utils import is_name_entity
 from nordlys.logic.el.greedy import Greedy
 from nordlys.logic.entity.entity import Entity
@@ -60,7 +61,7 @@ class LTR(object):
         LTR.__check_config(config)
         if config.get("gen_training_set", False):
             gt = LTR.load_yerd(config["ground_truth"])
-            LTR.gen_train_set(gt, config["query_file"], config["training_set"])
+            LTR.gen_train_set(gt, config["query_file"], config["training_set"], config.get("local_index_dir", None))
 
         instances = Instances.from_json(config["training_set"])
         ML(config).train_model(instances)
@@ -86,9 +87,12 @@ class LTR(object):
         return gt
 
     @staticmethod
-    def gen_train_set(gt, query_file, train_set):
-        """Trains LTR model for entity linking."""
-        entity, elastic, fcache = Entity(), ElasticCache(ELASTIC_INDICES[0]), FeatureCache()
+    def gen_train_set(gt, query_file, train_set, local_index_dir=None):
+        """Trains LTR model for entity linking.
+
+        :param local_index_dir: directory of a local index of the entities to be used instead of Elasticsearch
+        """
+        entity, elastic, fcache = Entity(), get_index(ELASTIC_INDICES[0], local_index_dir), FeatureCache()
         inss = Instances()
         positive_annots = set()
 
@@ -133,14 +137,19 @@ class LTR(object):
         :return: Instances object
         """
         instances = Instances()
-        for ngram in self.__query.get_ngrams():
-            cand_ens = Mention(ngram, self.__entity, self.__cmns_th).get_cand_ens()
+        # candidate entities of all n-grams and their documents are fetched together
+        ngrams = self.__query.get_ngrams()
+        ngram_cand_ens = Mention.multi_get_cand_ens(ngrams, self.__entity, self.__cmns_th)
+        en_docs = self.__entity.multi_lookup_en({en_id for cand_ens in ngram_cand_ens.values()
+                                                 for en_id in cand_ens if is_name_entity(en_id)})
+        for ngram in ngrams:
+            cand_ens = ngram_cand_ens[ngram]
             for en_id, commonness in cand_ens.items():
                 if not is_name_entity(en_id):
                     continue
                 self.__fcache.set_feature_val("commonness", en_id + "_" + ngram, commonness)
                 ins = self.__gen_raw_ins(en_id, ngram)
-                ins.features = self.get_features(ins, cand_ens)
+                ins.features = self.get_features(ins, cand_ens, en_docs.get(en_id, {}))
                 instances.add_instance(ins)
         return instances
 
@@ -157,6 +166,7 @@ class LTR(object):
         ML({}).apply_model(inss, self.__model)
         return inss
 
+    @timed("disambiguation")
     def disambiguate(self, inss):
         """Performs disambiguation"""
         greedy = Greedy(self.__threshold)
@@ -172,11 +182,13 @@ class LTR(object):
                 linked_ens.append({"mention": men_en[0], "entity": men_en[1], "score": score})
         return linked_ens
 
-    def get_features(self, ins, cand_ens=None):
+    @timed("feature_extraction")
+    def get_features(self, ins, cand_ens=None, en_doc=None):
         """Generates the features set for each instance.
 
         :param ins: instance object
         :param cand_ens: dictionary of candidate entities {en_id: cmns, ...}
+        :param en_doc: entity document (if None, it is looked up)
         :return: dictionary of features {ftr_name: value, ...}
         """
         e = ins.get_property("en_id")
@@ -185,7 +197,7 @@ class LTR(object):
 
         features = {}
         # --- entity features ---
-        ftr_entity = FtrEntity(e, self.__entity)
+        ftr_entity = FtrEntity(e, self.__entity, en_doc)
         features["outlinks"] = self.__fcache.get_feature_val("outlinks", e, ftr_entity.outlinks)
         features["redirects"] = self.__fcache.get_feature_val("redirects", e, ftr_entity.redirects)
         # --- mention features ---
@@ -194,7 +206,7 @@ class LTR(object):
         features["len"] = ftr_mention.mention_len()
         features["matches"] = self.__fcache.get_feature_val("matches", m, ftr_mention.matches)
         # --- mention-entity features ---
-        ftr_entity_mention = FtrEntityMention(e, m, self.__entity)
+        ftr_entity_mention = FtrEntityMention(e, m, self.__entity, en_doc)
         key = e + "_" + m
         features["commonness"] = self.__fcache.get_feature_val("commonness", key, ftr_entity_mention.commonness)
         features["mct"] = ftr_entity_mention.mct()
@@ -204,7 +216,7 @@ class LTR(object):
         ftr_sim_mention = FtrEntitySimilarity(m, e, self.__elastic)
         features["sim_m"] = self.__fcache.get_feature_val("sim", key, ftr_sim_mention.lm_score)
         # --- entity-query features ---
-        ftr_entity_query = FtrEntityMention(e, q, self.__entity)
+        ftr_entity_query = FtrEntityMention(e, q, self.__entity, en_doc)
         features["qct"] = ftr_entity_query.mct()
         features["tcq"] = ftr_entity_query.tcm()
         features["teq"] = ftr_entity_query.tem()
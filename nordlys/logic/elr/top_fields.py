@@ -29,8 +29,9 @@ class TopFields(object):
         doc_freq = {}
         if self.DEBUG:
             PLOGGER.info("Entity:[" + en + "]")
-        for field in self.fields:
-            df = self.elastic.doc_freq(en, field)
+        # gets doc frequencies for all fields in a batch
+        term_stats = self.elastic.multi_term_stats([(en, field) for field in self.fields])
+        for (_, field), (df, _) in term_stats.items():
             if df > 0:
                 doc_freq[field] = df
         top_fields = self.__get_top_n(doc_freq, n)
@@ -4,19 +4,35 @@ Entity
 
 Provides access to entity catalogs (DBpedia and surface forms).
 
+Surface forms are looked up in MongoDB, or in memory-mapped tables if ``sf_index_dir`` is set in
+``config/mongo.json`` (see :py:mod:`nordlys.core.storage.sstable`).  Likewise, Freebase and DBpedia IDs are
+mapped using a memory-mapped ID mapping if ``fb2dbp_index_dir`` is set (see :py:mod:`nordlys.core.storage.id_mapping`).
+
 :Author: Faegheh Hasibi
 """
 
+import os
 import sys
 from nordlys.config import MONGO_HOST, MONGO_DB, MONGO_COLLECTION_DBPEDIA, MONGO_COLLECTION_SF_FACC, \
-    MONGO_COLLECTION_FREEBASE2DBPEDIA, MONGO_COLLECTION_SF_DBPEDIA
+    MONGO_COLLECTION_FREEBASE2DBPEDIA, MONGO_COLLECTION_SF_DBPEDIA, MONGO_SF_INDEX_DIR, \
+    MONGO_FB2DBP_INDEX_DIR, PLOGGER
+from nordlys.core.storage.id_mapping import IDMapping
 from nordlys.core.storage.mongo import Mongo
+from nordlys.core.storage.sstable import SSTable
 import json
 
 
 class Entity(object):
 
-    def __init__(self):
+    def __init__(self, sf_index_dir=MONGO_SF_INDEX_DIR, fb2dbp_index_dir=MONGO_FB2DBP_INDEX_DIR):
+        """
+        :param sf_index_dir: directory of the surface form tables (None: surface forms are looked up in MongoDB)
+        :param fb2dbp_index_dir: directory of the Freebase to DBpedia mapping (None: IDs are looked up in MongoDB)
+        """
+        self.__sf_index_dir = sf_index_dir
+        self.__fb2dbp_index_dir = fb2dbp_index_dir
+        self.__fb2dbp_mapping = None
+        self.__fb2dbp_mapping_checked = False
         self.__coll_dbpedia = None
         self.__coll_sf_facc = None
         self.__coll_sf_dbpedia = None
@@ -27,21 +43,41 @@ class Entity(object):
         if self.__coll_dbpedia is None:
             self.__coll_dbpedia = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_DBPEDIA)
 
+    def __get_sf_coll(self, collection):
+        """Returns the table of a surface form collection if available, otherwise connects to the collection."""
+        if self.__sf_index_dir:
+            table_dir = os.path.join(self.__sf_index_dir, collection)
+            if SSTable.exists(table_dir):
+                return SSTable.get_instance(table_dir)
+        return Mongo(MONGO_HOST, MONGO_DB, collection)
+
     def __init_coll_sf_facc(self):
         """Makes connection to the surface form collection."""
         if self.__coll_sf_facc is None:
-            self.__coll_sf_facc = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_SF_FACC)
+            self.__coll_sf_facc = self.__get_sf_coll(MONGO_COLLECTION_SF_FACC)
 
     def __init_coll_sf_dbpedia(self):
         """Makes connection to the surface form collection."""
         if self.__coll_sf_dbpedia is None:
-            self.__coll_sf_dbpedia = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_SF_DBPEDIA)
+            self.__coll_sf_dbpedia = self.__get_sf_coll(MONGO_COLLECTION_SF_DBPEDIA)
 
     def __init_coll_fb2dbp(self):
         """Makes connection to Freebase2DBpedia collection."""
         if self.__coll_fb2dbp is None:
             self.__coll_fb2dbp = Mongo(MONGO_HOST, MONGO_DB, MONGO_COLLECTION_FREEBASE2DBPEDIA)
 
+    def __get_fb2dbp_mapping(self):
+        """Returns the Freebase to DBpedia ID mapping if available, otherwise None."""
+        if not self.__fb2dbp_mapping_checked and self.__fb2dbp_index_dir:
+            mapping_dir = os.path.join(self.__fb2dbp_index_dir, MONGO_COLLECTION_FREEBASE2DBPEDIA)
+            if IDMapping.exists(mapping_dir):
+                self.__fb2dbp_mapping = IDMapping.get_instance(mapping_dir)
+            else:
+                PLOGGER.warning("fb2dbp_index_dir is set, but there is no ID mapping in " + mapping_dir +
+                                "; Freebase IDs are looked up in MongoDB.")
+            self.__fb2dbp_mapping_checked = True
+        return self.__fb2dbp_mapping
+
     def lookup_en(self, entity_id):
         """Looks up an entity by its identifier.
 
@@ -65,14 +101,78 @@ class Entity(object):
 
     def fb_to_dbp(self, fb_id):
         """Converts Freebase id to DBpedia; it returns list of DBpedia IDs."""
+        mapping = self.__get_fb2dbp_mapping()
+        if mapping is not None:
+            return mapping.get(fb_id)
         self.__init_coll_fb2dbp()
         res = self.__coll_fb2dbp.find_by_id(fb_id)
         return res["!<owl:sameAs>"] if res else None
 
     def dbp_to_fb(self, dbp_id):
-        """Converts DBpedia id to Freebase; it returns list of Freebase IDs."""
+        """Converts DBpedia id to Freebase; it returns list of Freebase IDs.
+        If the ID mapping is available, it is used instead of the entity document (``fb:<owl:sameAs>``).
+        """
+        mapping = self.__get_fb2dbp_mapping()
+        if mapping is not None:
+            return mapping.get_inverse(dbp_id)
         en = self.lookup_en(dbp_id)
         if en is None:
             return None
         return en.get("fb:<owl:sameAs>", None)
 
+    # =========================
+    # Batched lookups (a single request per collection)
+    # =========================
+    def multi_lookup_en(self, entity_ids):
+        """Looks up multiple entities.
+
+        :param entity_ids: list of entity identifiers
+        :return: dictionary {entity_id: entity document}; entities that are not found are omitted
+        """
+        self.__init_coll_dbpedia()
+        return self.__coll_dbpedia.find_by_ids(entity_ids)
+
+    def multi_lookup_name_facc(self, names):
+        """Looks up multiple names in the FACC surface form dictionary.
+
+        :param names: list of names
+        :return: dictionary {name: candidate entities}; see :func:`lookup_name_facc`
+        """
+        self.__init_coll_sf_facc()
+        res = self.__coll_sf_facc.find_by_ids([name.lower() for name in names])
+        return {name: res.get(name.lower(), {}) for name in names}
+
+    def multi_lookup_name_dbpedia(self, names):
+        """Looks up multiple names in the DBpedia surface form dictionary.
+
+        :param names: list of names
+        :return: dictionary {name: candidate entities}; see :func:`lookup_name_dbpedia`
+        """
+        self.__init_coll_sf_dbpedia()
+        res = self.__coll_sf_dbpedia.find_by_ids([name.lower() for name in names])
+        return {name: res.get(name.lower(), {}) for name in names}
+
+    def multi_fb_to_dbp(self, fb_ids):
+        """Converts multiple Freebase ids to DBpedia.
+
+        :param fb_ids: list of Freebase ids
+        :return: dictionary {fb_id: list of DBpedia IDs or None}
+        """
+        mapping = self.__get_fb2dbp_mapping()
+        if mapping is not None:
+            return {fb_id: mapping.get(fb_id) for fb_id in fb_ids}
+        self.__init_coll_fb2dbp()
+        res = self.__coll_fb2dbp.find_by_ids(fb_ids)
+        return {fb_id: res[fb_id]["!<owl:sameAs>"] if fb_id in res else None for fb_id in fb_ids}
+
+    def multi_dbp_to_fb(self, dbp_ids):
+        """Converts multiple DBpedia ids to Freebase.
+
+        :param dbp_ids: list of DBpedia ids
+        :return: dictionary {dbp_id: list of Freebase IDs or None}
+        """
+        mapping = self.__get_fb2dbp_mapping()
+        if mapping is not None:
+            return {dbp_id: mapping.get_inverse(dbp_id) for dbp_id in dbp_ids}
+        ens = self.multi_lookup_en(dbp_ids)
+        return {dbp_id: ens[dbp_id].get("fb:<owl:sameAs>", None) if dbp_id in ens else None for dbp_id in dbp_ids}
@@ -189,7 +189,7 @@ def arg_parser():
 
 def main(args):
     config = FileUtils.load_config(args.config)
-    elastic_term = ElasticCache(config["text_index"])
+    elastic_term = ElasticCache.get_instance(config["text_index"])
     lambdas = config.get("lambdas", [0.9, 0.1])
 
     queries = json.load(open(config["query_file"], "r"))
@@ -205,7 +205,7 @@ def main(args):
         print("Scoring ", qid, "...")
         results, libsvm_str = {}, ""
         query_len = len(elastic_term.analyze_query(query).split())
-        scorer = ScorerELR(ElasticCache(config["uri_index"]), annots[qid], query_len, lambdas)
+        scorer = ScorerELR(ElasticCache.get_instance(config["uri_index"]), annots[qid], query_len, lambdas)
         for doc_id, p_T_d in sorted(run[qid].items()):
             query_mappings = get_mapping_query(annots[qid], mappings)
             p_E_d = scorer.score_doc(doc_id, query_mappings)
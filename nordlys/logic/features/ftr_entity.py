@@ -13,9 +13,14 @@ WIKILINKS = "<dbo:wikiPageWikiLink>"
 
 class FtrEntity(object):
 
-    def __init__(self, en_id, entity):
+    def __init__(self, en_id, entity, en_doc=None):
+        """
+        :param en_id: entity ID
+        :param entity: Entity object
+        :param en_doc: entity document (if None, it is looked up)
+        """
         self.__en_id = en_id
-        self.__en_doc = entity.lookup_en(en_id)
+        self.__en_doc = en_doc if en_doc is not None else entity.lookup_en(en_id)
 
     def redirects(self):
         """Number of redirect pages linking to the entity"""
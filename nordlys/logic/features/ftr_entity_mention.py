@@ -16,11 +16,17 @@ SHORT_ABS = "<rdfs:comment>"
 
 class FtrEntityMention(object):
 
-    def __init__(self, en_id, mention, entity):
+    def __init__(self, en_id, mention, entity, en_doc=None):
+        """
+        :param en_id: entity ID
+        :param mention: mention
+        :param entity: Entity object
+        :param en_doc: entity document (if None, it is looked up when needed)
+        """
         self.__en_id = en_id
         self.__mention = mention
         self.__entity = entity
-        self.__en_doc = None
+        self.__en_doc = en_doc
 
     def __load_en(self):
         if self.__en_doc is None:
@@ -31,7 +37,8 @@ class FtrEntityMention(object):
         """Computes probability of entity e being linked by mention: link (e,m)/link(m)
         Returns zero if link(m) = 0
         """
-        fb_ids = self.__entity.dbp_to_fb(self.__en_id)
+        fb_ids = self.__en_doc.get("fb:<owl:sameAs>", None) if self.__en_doc is not None \
+            else self.__entity.dbp_to_fb(self.__en_id)
         if fb_ids is None:
             return 0
         matches = self.__entity.lookup_name_facc(self.__mention).get("facc12", {})
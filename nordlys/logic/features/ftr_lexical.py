@@ -11,12 +11,16 @@ from __future__ import division
 import argparse
 from statistics import mean
 from scipy import spatial
+import jellyfish as jf
 import numpy as np
 
 from nordlys.config import MONGO_HOST, MONGO_DB, MONGO_COLLECTION_WORD2VEC
 from nordlys.core.storage.mongo import Mongo
 from nordlys.logic.features.word2vec import Word2Vec
 
+# jaro_distance is renamed to jaro_similarity in jellyfish 0.8
+jaro_similarity = jf.jaro_similarity if hasattr(jf, "jaro_similarity") else jf.jaro_distance
+
 
 class FtrLexical(object):
     __MAX = "max"
@@ -112,7 +116,7 @@ class FtrLexical(object):
         res = []
         for t1 in s1.split():
             for t2 in s2.split():
-                res.append(jf.jaro_distance(t1, t2))
+                res.append(jaro_similarity(t1, t2))
         return self.agg(res, agg_func)
 
     def w2v_sim_agg(self, s1, s2, agg_func=__AVG):
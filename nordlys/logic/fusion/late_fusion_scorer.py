@@ -7,16 +7,17 @@ Class for late fusion scorer (i.e., document-centric model).
 :Authors: Shuo Zhang, Krisztian Balog, Dario Garigliotti
 """
 from nordlys.logic.fusion.fusion_scorer import FusionScorer
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.local_index import get_index
 from nordlys.core.retrieval.retrieval_results import RetrievalResults
 from nordlys.core.retrieval.scorer import Scorer, ScorerLM
 from nordlys.core.retrieval.retrieval import Retrieval
+from nordlys.core.utils.timing import stage
 
 
 class LateFusionScorer(FusionScorer):
     def __init__(self, index_name, retr_model, retr_params, num_docs=None,
                  field="content", run_id="fusion", num_objs=100, assoc_mode=FusionScorer.ASSOC_MODE_BINARY,
-                 assoc_file=None):
+                 assoc_file=None, local_index_dir=None):
         """
 
         :param index_name: name of index
@@ -27,6 +28,7 @@ class LateFusionScorer(FusionScorer):
         :param num_objs: the number of ranked objects for a query
         :param assoc_mode: the fusion weights, which could be binary or uniform
         :param assoc_file: object-doc association file
+        :param local_index_dir: directory of a local index to be used instead of Elasticsearch (optional)
         """
         super(LateFusionScorer, self).__init__(index_name, association_file=assoc_file, run_id=run_id)
         self.__config = {
@@ -35,6 +37,7 @@ class LateFusionScorer(FusionScorer):
                 "num_docs": num_docs,
                 "field": field
             },
+            "local_index_dir": local_index_dir
         }
         self._field = field
         self._num_docs = num_docs
@@ -42,15 +45,17 @@ class LateFusionScorer(FusionScorer):
         self._params = retr_params
         self._assoc_mode = assoc_mode
         self._num = num_objs
-        self._elastic = ElasticCache(self._index_name)
+        self._elastic = get_index(self._index_name, local_index_dir)
 
-    def score_query(self, query, assoc_fun=None):
+    def score_query(self, query, assoc_fun=None, multi_assoc_fun=None):
         """
         Scores a given query.
 
         :param query: query string.
         :return: a RetrievalResults instance.
         :func assoc_fun: function to return a list of docs for an obeject
+        :func multi_assoc_fun: function to return the lists of objects for multiple docs {doc_id: [obj, ..]};
+            used instead of assoc_fun, to get the associations of all retrieved docs at once
         """
         scorer = None
         # setting the configurations
@@ -73,26 +78,29 @@ class LateFusionScorer(FusionScorer):
         # retrieving documents
         res = Retrieval(self.__config).retrieve(query, scorer)
 
-        # getting the doc-to-object mappings
-        if assoc_fun is not None:
-            for doc_id, _ in res.items():
-                self.assoc_doc[doc_id] = assoc_fun(doc_id)
+        with stage("fusion"):
+            # getting the doc-to-object mappings
+            if multi_assoc_fun is not None:
+                self.assoc_doc.update(multi_assoc_fun(list(res.keys())))
+            elif assoc_fun is not None:
+                for doc_id, _ in res.items():
+                    self.assoc_doc[doc_id] = assoc_fun(doc_id)
 
-        # scoring objects, i.e., computing P(q|o)
-        pqo = dict()
-        for i, item in enumerate(list(res.keys())):
-            if self._num_docs is not None and i + 1 == self._num_docs:  # consider only top documents
-                break
-            doc_id = item
-            doc_score = res[doc_id].get("score", 0)
-            if doc_id in self.assoc_doc:
-                for object_id in self.assoc_doc[doc_id]:
-                    if self._assoc_mode == FusionScorer.ASSOC_MODE_BINARY:
-                        w_do = 1
-                    elif self._assoc_mode == FusionScorer.ASSOC_MODE_UNIFORM:
-                        w_do = 1 / len(self.assoc_obj[object_id])
-                    else:
-                        w_do = 0  # this should never happen
-                    pqo[object_id] = pqo.get(object_id, 0) + doc_score * w_do
+            # scoring objects, i.e., computing P(q|o)
+            pqo = dict()
+            for i, item in enumerate(list(res.keys())):
+                if self._num_docs is not None and i + 1 == self._num_docs:  # consider only top documents
+                    break
+                doc_id = item
+                doc_score = res[doc_id].get("score", 0)
+                if doc_id in self.assoc_doc:
+                    for object_id in self.assoc_doc[doc_id]:
+                        if self._assoc_mode == FusionScorer.ASSOC_MODE_BINARY:
+                            w_do = 1
+                        elif self._assoc_mode == FusionScorer.ASSOC_MODE_UNIFORM:
+                            w_do = 1 / len(self.assoc_obj[object_id])
+                        else:
+                            w_do = 0  # this should never happen
+                        pqo[object_id] = pqo.get(object_id, 0) + doc_score * w_do
 
         return RetrievalResults(pqo)
@@ -10,6 +10,7 @@ Class for entity mentions (used for entity linking)
 import sys
 from pprint import pprint
 
+from nordlys.core.utils.timing import timed
 from nordlys.logic.entity.entity import Entity
 
 
@@ -19,15 +20,46 @@ class Mention(object):
         self.__entity = entity
         self.__cmns_th = cmns_th
 
+    @timed("candidate_generation")
     def get_cand_ens(self):
         """Returns all candidate entities for the mention
 
         :return: {en:cmn_score}
         """
-        facc_matches = self.__get_facc_matches(self.__entity.lookup_name_facc(self.__mention))
+        return self.__get_cand_ens(self.__entity.lookup_name_facc(self.__mention),
+                                   self.__entity.lookup_name_dbpedia(self.__mention))
+
+    @staticmethod
+    @timed("candidate_generation")
+    def multi_get_cand_ens(mentions, entity, cmns_th=None):
+        """Returns candidate entities for multiple mentions (e.g., all n-grams of a query).
+        Surface forms and Freebase IDs of all mentions are looked up together (three requests in total).
+
+        :param mentions: list of mentions
+        :param entity: Entity object
+        :param cmns_th: commonness threshold
+        :return: {mention: {en: cmn_score}}
+        """
+        mentions = list(mentions)
+        facc = entity.multi_lookup_name_facc([m.lower() for m in mentions])
+        dbpedia = entity.multi_lookup_name_dbpedia([m.lower() for m in mentions])
+        fb_ids = {fb_id for matches in facc.values() for fb_id in matches.get("facc12", {})}
+        fb_to_dbp = entity.multi_fb_to_dbp(fb_ids)
+        return {m: Mention(m, entity, cmns_th).__get_cand_ens(facc[m.lower()], dbpedia[m.lower()], fb_to_dbp)
+                for m in mentions}
+
+    def __get_cand_ens(self, facc_doc, dbpedia_doc, fb_to_dbp=None):
+        """Returns candidate entities, given the surface form documents of the mention.
+
+        :param facc_doc: FACC surface form document
+        :param dbpedia_doc: DBpedia surface form document
+        :param fb_to_dbp: Freebase to DBpedia mapping {fb_id: [dbp_id, ..]} (if None, it is looked up)
+        :return: {en:cmn_score}
+        """
+        facc_matches = self.__get_facc_matches(facc_doc, fb_to_dbp)
         cand_ens = self.__filter_uncommon_ens(facc_matches) if self.__cmns_th else facc_matches
 
-        dbpedia_matches = self.__get_dbpedia_matches(self.__entity.lookup_name_dbpedia(self.__mention))
+        dbpedia_matches = self.__get_dbpedia_matches(dbpedia_doc)
         for en_id in dbpedia_matches:
             if en_id not in facc_matches:
                 cand_ens[en_id] = 0
@@ -44,10 +76,10 @@ class Mention(object):
             dbp_ens += list(match.keys())
         return set(dbp_ens)
 
-    def __get_facc_matches(self, matches):
+    def __get_facc_matches(self, matches, fb_to_dbp=None):
         """Returns entities matching the mention according to FACC.
         - Computes commonness for each entity (if needed)
-        - Converts Freebase IDs to DBpedia
+        - Converts Freebase IDs to DBpedia (using the given mapping, if any)
         """
         # computes the denominator for commonness
         facc_matches = matches.get("facc12", {})
@@ -57,7 +89,7 @@ class Mention(object):
         # converts freebased IDs to DBpedia
         facc_ens = {}
         for entity_id, val in facc_matches.items():
-            dbp_ids = self.__entity.fb_to_dbp(entity_id)
+            dbp_ids = fb_to_dbp.get(entity_id, None) if fb_to_dbp is not None else self.__entity.fb_to_dbp(entity_id)
             if dbp_ids is None:
                 continue
             for dbp_id in dbp_ids:
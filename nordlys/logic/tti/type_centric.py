@@ -13,14 +13,14 @@ class TypeCentric(object):
     def __init__(self, query, retrieval_config):
         self.__query = query
         self.__retrieval_config = retrieval_config
-        self.__elasttic = ElasticCache(TC_INDEX)
+        self.__elasttic = ElasticCache.get_instance(TC_INDEX)
 
     def __type_centric(self, query):
         """Type-centric TTI."""
         types = dict()
         model = self.__config.get("model", TTI_MODEL_BM25)
 
-        elastic = ElasticCache(self.__tc_config.get("index", DEFAULT_TTI_TC_INDEX))
+        elastic = ElasticCache.get_instance(self.__tc_config.get("index", DEFAULT_TTI_TC_INDEX))
         if model == TTI_MODEL_BM25:
             print("TTI, TC, BM25")
             scorer = Scorer.get_scorer(elastic, query, self.__tc_config)
@@ -7,15 +7,18 @@ This is the main console application for the Nordlys API.
 :Authors: Krisztian Balog, Faegheh Hasibi, Shuo Zhang
 """
 
-from nordlys.config import LOGGING_PATH, PLOGGER, ELASTIC_INDICES
+from nordlys.config import LOGGING_PATH, PLOGGER, ELASTIC_INDICES, API_RESULT_CACHE, API_METRICS
 from nordlys.core.retrieval.elastic_cache import ElasticCache
 from nordlys.core.utils.logging_utils import RequestHandler
+from nordlys.core.utils.timing import Metrics, tracing
 from nordlys.logic.entity.entity import Entity
 from nordlys.logic.features.feature_cache import FeatureCache
 from nordlys.services.el import EL
 from nordlys.services.er import ER
+from nordlys.services.result_cache import ResultCache
 from nordlys.services.tti import TTI
 
+import json
 import logging
 import os
 import traceback
@@ -25,8 +28,10 @@ from time import strftime
 
 DBPEDIA_INDEX = ELASTIC_INDICES[0]
 __entity = Entity()
-__elastic = ElasticCache(DBPEDIA_INDEX)
+__elastic = ElasticCache.get_instance(DBPEDIA_INDEX)
 __fcache = FeatureCache()
+__result_cache = ResultCache(max_size=API_RESULT_CACHE.get("max_size", 10000), ttl=API_RESULT_CACHE.get("ttl", 3600))
+__metrics = Metrics()
 app = Flask(__name__)
 
 
@@ -41,6 +46,20 @@ def error(str):
     return jsonify(**res)
 
 
+def traced(service, func, *args):
+    """Calls the service function; the request is traced if metrics are enabled or ``debug=timing`` is given.
+    Traces are added to the metrics and, with ``debug=timing``, returned under the "timing" key of the response."""
+    debug_timing = request.args.get("debug", None) == "timing"
+    if not (API_METRICS or debug_timing):
+        return func(*args)
+    with tracing() as trace:
+        res = func(*args)
+    __metrics.add(service, trace)
+    if debug_timing:
+        res["timing"] = trace.to_dict()
+    return res
+
+
 @app.route("/")
 def index():
     return "This is the Nordlys API"
@@ -88,7 +107,8 @@ def catalog_dbp2fb(dbp_id):
     return jsonify(**res)
 
 
-# /er?q=xx[&start=xx&field=xx&model=xx&smoothing_method=xx&smoothing_param=xx]
+# /er?q=xx[&start=xx&field=xx&model=xx&smoothing_method=xx&smoothing_param=xx&k1=xx&b=xx&debug=timing]
+# fields can be given as a JSON list or dictionary (e.g. fields={"names":0.5,"catchall":0.5} for MLM and BM25F)
 @app.route("/er")
 def retrieval():
     query = request.args.get("q", None)
@@ -101,12 +121,14 @@ def retrieval():
             config["first_pass"][param] = request.args.get(param)
 
     for param in ["index_name", "start", "num_docs", "model", "fields",
-                  "smoothing_method", "smoothing_param"]:
+                  "smoothing_method", "smoothing_param", "k1", "b"]:
         if request.args.get(param, None) is not None:
             config[param] = request.args.get(param)
+    if config.get("fields", "").startswith(("{", "[")):
+        config["fields"] = json.loads(config["fields"])
 
-    er = ER(config, __elastic)
-    res = er.retrieve(query)
+    er = ER(config, __elastic, __result_cache)
+    res = traced("er", er.retrieve, query)
     return jsonify(**res)
 
 
@@ -120,8 +142,8 @@ def entity_linking():
         "method": request.args.get("method", None),
         "threshold": request.args.get("threshold", 0.1)
     }
-    el = EL(config, __entity, __elastic, __fcache)
-    res = el.link(query)
+    el = EL(config, __entity, __elastic, __fcache, __result_cache)
+    res = traced("el", el.link, query)
     PLOGGER.debug(res)
     return jsonify(**res)
 
@@ -138,8 +160,21 @@ def entity_types():
     for param in params:
         if request.args.get(param, None) is not None:
             config[param] = request.args.get(param)
-    tti = TTI(config)
-    res = tti.identify(query)
+    tti = TTI(config, __result_cache)
+    res = traced("tti", tti.identify, query)
+    return jsonify(**res)
+
+
+@app.route("/cache_stats")
+def cache_stats():
+    res = {"result_cache": __result_cache.stats(),
+           "elastic_cache": __elastic.cache_stats()}
+    return jsonify(**res)
+
+
+@app.route("/metrics")
+def metrics():
+    res = __metrics.stats()
     return jsonify(**res)
 
 
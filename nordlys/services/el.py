@@ -31,6 +31,8 @@ Config parameters
 - **ground_truth**: The ground truth file; *(optional)*
 - **gen_training_set**: If True, generates the training set from the groundtruth and query files; *(default: False)*
 - **gen_model**: If True, trains the model from the training set; *(default: False)*
+- **local_index_dir**: directory of a :py:mod:`local index <nordlys.core.retrieval.local_index>` of the entities, used
+  for the features instead of Elasticsearch *(optional)*
 - The other parameters are similar to the nordlys.core.ml.ml settings
 
 
@@ -59,8 +61,9 @@ import pickle
 
 from nordlys.config import ELASTIC_INDICES, PLOGGER
 from nordlys.core.ml.instances import Instances
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.local_index import get_index
 from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.utils.timing import stage
 from nordlys.logic.el.cmns import Cmns
 from nordlys.logic.el.el_utils import load_kb_snapshot, to_elq_eval
 from nordlys.logic.el.ltr import LTR
@@ -73,8 +76,10 @@ DBPEDIA_INDEX = ELASTIC_INDICES[0]
 
 
 class EL(object):
+    # config parameters that affect the linked entities; see :py:mod:`nordlys.services.result_cache`
+    CACHE_PARAMS = ["method", "threshold", "step", "model_file", "kb_snapshot"]
 
-    def __init__(self, config, entity, elastic=None, fcache=None):
+    def __init__(self, config, entity, elastic=None, fcache=None, result_cache=None):
         self.__check_config(config)
         self.__config = config
         self.__method = config["method"]
@@ -85,6 +90,7 @@ class EL(object):
         self.__entity = entity
         self.__elastic = elastic
         self.__fcache = fcache
+        self.__result_cache = result_cache
         self.__model = None
         if "kb_snapshot" in self.__config:
             load_kb_snapshot(self.__config["kb_snapshot"])
@@ -127,10 +133,17 @@ class EL(object):
         :return: annotated query
         """
         PLOGGER.info("Linking query " + qid + " [" + query + "] ")
-        q = Query(query, qid)
+        with stage("analyze"):
+            q = Query(query, qid)
         linker = self.__get_linker(q)
         if self.__config["step"] == "ranking":
             res = linker.rank_ens()
+        elif self.__result_cache is not None:
+            key = self.__result_cache.get_key("el", query, self.__config, self.CACHE_PARAMS)
+            linked_ens = self.__result_cache.get_or_set(key, linker.link)
+            res = {"query": q.raw_query,
+                   "processed_query": q.query,
+                   "results": linked_ens}
         else:
             linked_ens = linker.link()
             res = {"query": q.raw_query,
@@ -184,7 +197,7 @@ def arg_parser():
 
 def main(args):
     conf = FileUtils.load_config(args.config)
-    el = EL(conf, Entity(), ElasticCache(DBPEDIA_INDEX), FeatureCache())
+    el = EL(conf, Entity(), get_index(DBPEDIA_INDEX, conf.get("local_index_dir", None)), FeatureCache())
 
     if conf.get("gen_model", False):
         LTR.train(conf)
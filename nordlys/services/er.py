@@ -24,13 +24,15 @@ Config parameters
       - **fields_return**: comma-separated list of fields to return for each hit (default: "")
 - **num_docs**: number of documents to return (default: 100)
 - **start**: starting offset for ranked documents (default:0)
-- **model**: name of retrieval model; accepted values: [lm, mlm, prms] (default: lm)
+- **model**: name of retrieval model; accepted values: [lm, mlm, prms, bm25, bm25f] (default: lm)
 - **field**: field name for LM (default: catchall)
 - **fields**: list of fields for PRMS (default: [catchall])
-- **field_weights**: dictionary with fields and corresponding weights for MLM (default: {catchall: 1})
+- **field_weights**: dictionary with fields and corresponding weights for MLM and BM25F (default: {catchall: 1})
+- **k1**, **b**: parameters of BM25F (default: 1.2 and 0.75)
 - **smoothing_method**: accepted values: [jm, dirichlet] (default: dirichlet)
 - **smoothing_param**: value of lambda or mu; accepted values: [float or "avg_len"], (jm default: 0.1, dirichlet default: 2000)
 - **query_file**: name of query file (JSON),
+- **query_batch_size**: number of queries that are analyzed and searched together in batch mode (default: 50)
 - **output_file**: name of output file,
 - **run_id**: run id for TREC output
 
@@ -67,20 +69,24 @@ from nordlys.core.retrieval.elastic_cache import ElasticCache
 from nordlys.core.retrieval.retrieval import Retrieval
 from nordlys.core.retrieval.scorer import Scorer
 from nordlys.core.utils.file_utils import FileUtils
+from nordlys.core.utils.ranked_list import rank
 
 # Constants
 DBPEDIA_INDEX = ELASTIC_INDICES[0]
 
 
 class ER(object):
-    def __init__(self, config, elastic=None):
+    # config parameters that affect the (full) ranked list; see :py:mod:`nordlys.services.result_cache`
+    CACHE_PARAMS = ["index_name", "first_pass", "model", "fields", "smoothing_method", "smoothing_param", "k1", "b"]
+
+    def __init__(self, config, elastic=None, result_cache=None):
         self.__check_config(config)
         self.__config = config
         self.__num_docs = int(config["num_docs"])
         self.__start = int(config["start"])
-        self.__er = Retrieval(config)
-
         self.__elastic = elastic
+        self.__result_cache = result_cache
+        self.__er = Retrieval(config, elastic)
 
     @staticmethod
     def __check_config(config):
@@ -106,14 +112,25 @@ class ER(object):
         scorer = Scorer.get_scorer(self.__elastic, query, self.__config)
         return scorer
 
-    def retrieve(self, query):
-        """Retrieves entities for a query"""
+    def __retrieve(self, query):
+        """Returns the full ranked list of entities for a query and the number of (first-pass) hits."""
         scorer = self.__get_scorer(query)
-        ens = self.__er.retrieve(query, scorer)
+        return self.__er.retrieve_with_hits(query, scorer)
 
-        # converts to output format
+    def retrieve(self, query):
+        """Retrieves entities for a query.
+        If a result cache is given, the full ranked list is cached and the requested page is sliced from it."""
+        if self.__result_cache is not None:
+            # with pruning, only the top (start + num_docs) entities are ranked
+            params = self.CACHE_PARAMS + (["start", "num_docs"] if self.__config.get("pruning", False) else [])
+            key = self.__result_cache.get_key("er", query, self.__config, params)
+            ens, total_hits = self.__result_cache.get_or_set(key, self.__retrieve, query)
+        else:
+            ens, total_hits = self.__retrieve(query)
+
+        # converts to output format; with pruning, total_hits includes the pruned entities
         res = {"query": query,
-               "total_hits": len(ens),
+               "total_hits": total_hits,
                "results": {}}
         if len(ens) != 0:
             res["results"] = self.__get_top_k(ens)
@@ -121,11 +138,9 @@ class ER(object):
 
     def __get_top_k(self, ens):
         """Returns top-k results."""
-        sorted_ens = sorted(ens.items(), key=lambda item: item[1]["score"], reverse=True)
         results = {}
-        end = min(self.__num_docs, len(ens))
-        for i in range(self.__start, self.__start + end):
-            en_id, en = sorted_ens[i][0], sorted_ens[i][1]
+        ranked = rank(ens, num=self.__num_docs, start=self.__start, score_func=lambda en: en["score"])
+        for i, (en_id, en) in enumerate(ranked, self.__start):
             results[i] = {"entity": en_id, "score": en["score"]}
             if en.get("fields", {}) != {}:
                 results[i]["fields"] = en["fields"]
@@ -133,7 +148,7 @@ class ER(object):
 
 
     def batch_retrieval(self):
-        """Performs batch retrieval for a set of queries"""
+        """Performs batch retrieval for a set of queries; see :func:`Retrieval.batch_retrieval`."""
         # todo: integrate ELR approach
         self.__er.batch_retrieval()
 
@@ -148,7 +163,7 @@ def arg_parser():
 
 def main(args):
     config = FileUtils.load_config(args.config)
-    er = ER(config, ElasticCache(DBPEDIA_INDEX))
+    er = ER(config, ElasticCache.get_instance(DBPEDIA_INDEX))
 
     if args.query:
         res = er.retrieve(args.query)
@@ -0,0 +1,94 @@
+"""
+Result Cache
+============
+
+Cache for the results of the services (ER, EL, and TTI), placed in front of the API endpoints.
+
+  - Entries are keyed by the service name, the normalized query, and the config parameters that affect the results
+    (e.g., index, model, fields, and smoothing); pagination parameters (``start``, ``num_docs``) are not part of the
+    key, as the full ranked list is cached and pages are sliced from it.
+  - The cache is bounded by the number of entries (LRU eviction) and by the time-to-live of the entries.
+  - Hit/miss/expiration counters are available via :func:`ResultCache.stats`.
+  - The bounds are set in the ``result_cache`` section of ``config/api.json``.
+"""
+
+import json
+import threading
+import time
+
+from nordlys.core.utils.lru_cache import LRUCache
+
+
+class ResultCache(object):
+    """LRU cache with time-to-live for service results."""
+
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        :param max_size: max number of cached results (None: unbounded)
+        :param ttl: time-to-live of the entries in seconds (None: no expiration)
+        """
+        self.__cache = LRUCache(max_size=max_size, sizeof=lambda item: 0)  # {key: (timestamp, result)}
+        self.__ttl = ttl
+        self.__lock = threading.Lock()
+        self.expirations = 0
+
+    @staticmethod
+    def normalize_query(query):
+        """Normalizes the query (lowercase, single spaces); see :func:`Query.preprocess`."""
+        return " ".join(query.split()).lower()
+
+    @staticmethod
+    def get_key(service, query, config, params):
+        """Returns the cache key.
+
+        :param service: name of the service
+        :param query: query string
+        :param config: service config
+        :param params: names of the config parameters that affect the results
+        """
+        config_key = tuple((param, json.dumps(config.get(param, None), sort_keys=True)) for param in sorted(params))
+        return service, ResultCache.normalize_query(query), config_key
+
+    def get(self, key):
+        """Returns the cached result or ``LRUCache.MISSING`` (if not cached or expired)."""
+        with self.__lock:
+            entry = self.__cache.lookup(key)
+            if entry is LRUCache.MISSING:
+                return entry
+            timestamp, result = entry
+            if self.__ttl is not None and time.time() - timestamp > self.__ttl:
+                self.__cache.delete(key)
+                self.expirations += 1
+                return LRUCache.MISSING
+            return result
+
+    def put(self, key, result):
+        """Caches the result."""
+        with self.__lock:
+            self.__cache.put(key, (time.time(), result))
+
+    def get_or_set(self, key, callback_func, *args):
+        """Returns the cached result; computes and caches it using the callback function if missing.
+        The result is computed outside the lock, so that concurrent requests are not blocked."""
+        result = self.get(key)
+        if result is LRUCache.MISSING:
+            result = callback_func(*args)
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        """Removes all entries."""
+        with self.__lock:
+            self.__cache.clear()
+
+    def stats(self):
+        """Returns cache statistics; expired entries are counted as misses."""
+        with self.__lock:
+            stats = self.__cache.stats()
+        stats["hits"] -= self.expirations
+        stats["misses"] += self.expirations
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups > 0 else 0
+        stats["expirations"] = self.expirations
+        del stats["resident_bytes"]
+        return stats
@@ -25,6 +25,9 @@ Config parameters
 - **smoothing_method**: accepted values: ["jm", "dirichlet"]
 - **smoothing_param**: value of lambda or mu; accepted values: [float or "avg_len"]
 - **query_file**: path to query file (JSON)
+- **query_batch_size**: number of queries analyzed and searched together in batch mode, if method is "tc" (default: 50)
+- **local_index_dir**: directory of a :py:mod:`local index <nordlys.core.retrieval.local_index>` of the types (if method
+  is "tc") or entities (if method is "ec") to be used instead of Elasticsearch *(optional)*
 - **output_file**: path to output file (JSON)
 - **trec_output_file**: path to output file (trec_eval-formatted)
 
@@ -60,13 +63,14 @@ from pprint import pprint
 
 # Cross-ref imports
 from nordlys.config import ELASTIC_INDICES, ELASTIC_TTI_INDICES
-from nordlys.core.retrieval.elastic_cache import ElasticCache
+from nordlys.core.retrieval.local_index import get_index
 from nordlys.core.utils.file_utils import FileUtils
 from nordlys.core.retrieval.retrieval import Retrieval  # for TC TTI
 from nordlys.core.retrieval.scorer import Scorer  # for TC TTI
 from nordlys.logic.fusion.late_fusion_scorer import LateFusionScorer  # for EC TTI
 from nordlys.logic.entity.entity import Entity  # for defining the higher-order entity-centric late-fusion assoc func
 from nordlys.core.utils.file_utils import FileUtils  # for outputting
+from nordlys.core.utils.ranked_list import rank  # for top-k types
 from nordlys.core.retrieval.retrieval_results import RetrievalResults  # for TREC-formatted outputting
 from nordlys.config import PLOGGER  # for logging
 
@@ -93,14 +97,20 @@ DEFAULT_TTI_START = 0
 DEFAULT_TTI_TC_INDEX = ELASTIC_TTI_INDICES[0]
 DEFAULT_TTI_EC_INDEX = ELASTIC_INDICES[0]
 DEFAULT_TTI_EC_K_CUTOFF = 20  # Known to be a sufficient cut-off
+DEFAULT_TTI_QUERY_BATCH_SIZE = 50  # number of queries analyzed and searched together in batch mode (TC TTI)
 
 
 # -------
 
 class TTI(object):
-    def __init__(self, config):
+    # config parameters that affect the types; see :py:mod:`nordlys.services.result_cache`
+    CACHE_PARAMS = ["method", "index", "model", "ec_cutoff", "field", "smoothing_method", "smoothing_param",
+                    "local_index_dir"]
+
+    def __init__(self, config, result_cache=None):
         self.__check_config(config)
         self.__config = config
+        self.__result_cache = result_cache
         self.__method = config["method"]
         self.__num_docs = config["num_docs"]
         self.__start = config["start"]
@@ -110,6 +120,7 @@ class TTI(object):
                 "1st_num_docs": DEFAULT_1ST_PASS_NUM_DOCS,
                 "field": DEFAULT_1ST_PASS_FIELD
             },
+            "local_index_dir": self.__config.get("local_index_dir", None)
         }
         self.__query_file = config.get("query_file", None)
         self.__output_file = config.get("output_file", None)
@@ -122,6 +133,7 @@ class TTI(object):
         config["num_docs"] = int(config.get("num_docs", DEFAULT_TTI_NUM_DOCS))
         config["start"] = int(config.get("start", DEFAULT_TTI_START))
         config["run_id"] = config.get("run_id", "tti")
+        config["query_batch_size"] = int(config.get("query_batch_size", DEFAULT_TTI_QUERY_BATCH_SIZE))
 
         return config
 
@@ -134,11 +146,16 @@ class TTI(object):
         """
         return t is not OWL_THING_TYPE and t.startswith(DBO_TYPE_PREFIX)
 
-    def __entity_centric_mapper(self, entity_id):
-        """Gets the list of DBpedia types for a given entityID."""
-        en = Entity()
-        all_types = en.lookup_en(entity_id).get(RDF_TYPE_PROP, [])
-        final_types = [t for t in all_types if self.__valid_final_ec_type(t)]  # filtering
+    def __entity_centric_mapper(self, entity_ids):
+        """Gets the lists of DBpedia types for multiple entityIDs (looked up together).
+
+        :return: dictionary {entity_id: [type, ...]}
+        """
+        en_docs = Entity().multi_lookup_en(entity_ids)
+        final_types = {}
+        for entity_id in entity_ids:
+            all_types = en_docs.get(entity_id, {}).get(RDF_TYPE_PROP, [])
+            final_types[entity_id] = [t for t in all_types if self.__valid_final_ec_type(t)]  # filtering
         return final_types
 
     def __entity_centric(self, query):
@@ -160,8 +177,9 @@ class TTI(object):
         # Perform EC TTI using late fusion support
         late_fusion_scorer = LateFusionScorer(self.__config["index"], model, self.__ec_retr_config,
                                               num_docs=ec_cutoff, field="catchall", run_id=self.__config["run_id"],
-                                              num_objs=self.__config["num_docs"])
-        ret_res = late_fusion_scorer.score_query(query, assoc_fun=self.__entity_centric_mapper)
+                                              num_objs=self.__config["num_docs"],
+                                              local_index_dir=self.__config.get("local_index_dir", None))
+        ret_res = late_fusion_scorer.score_query(query, multi_assoc_fun=self.__entity_centric_mapper)
 
         for doc_id, score in ret_res.get_scores_sorted():
             types[doc_id] = {"score": score}
@@ -169,22 +187,12 @@ class TTI(object):
 
         return types
 
-    def __type_centric(self, query):
-        """Type-centric TTI.
-
-        :param query: query string
-        :type query: str
-        """
-        types = dict()
+    def __set_tc_model(self):
+        """Sets the retrieval model of type-centric TTI in the retrieval config; returns False if not supported."""
         model = self.__config.get("model", TTI_MODEL_BM25)
-        elastic = ElasticCache(self.__tc_config.get("index", DEFAULT_TTI_TC_INDEX))
-
         if model == TTI_MODEL_BM25:
             PLOGGER.info("TTI, TC, BM25")
             self.__tc_config["model"] = "bm25"
-            # scorer = Scorer.get_scorer(elastic, query, self.__tc_config)
-            types = Retrieval(self.__tc_config).retrieve(query)
-
         elif model == TTI_MODEL_LM:
             PLOGGER.debug("TTI, TC, LM")
             self.__tc_config["model"] = "lm"  # Needed for 2nd-pass
@@ -195,7 +203,27 @@ class TTI(object):
             for param in ["smoothing_method", "smoothing_param"]:
                 if self.__config.get(param, None) is not None:
                     self.__tc_config["second_pass"][param] = self.__config.get(param)
+        else:
+            return False
+        return True
+
+    def __type_centric(self, query):
+        """Type-centric TTI.
+
+        :param query: query string
+        :type query: str
+        """
+        types = dict()
+        model = self.__config.get("model", TTI_MODEL_BM25)
+        elastic = get_index(self.__tc_config["index_name"], self.__tc_config["local_index_dir"])
+        if not self.__set_tc_model():
+            return types
+
+        if model == TTI_MODEL_BM25:
+            # scorer = Scorer.get_scorer(elastic, query, self.__tc_config)
+            types = Retrieval(self.__tc_config).retrieve(query)
 
+        elif model == TTI_MODEL_LM:
             scorer = Scorer.get_scorer(elastic, query, self.__tc_config)
             types = Retrieval(self.__tc_config).retrieve(query, scorer)
 
@@ -203,6 +231,19 @@ class TTI(object):
 
         return types
 
+    def __type_centric_batch(self, queries, retrieval=None):
+        """Type-centric TTI for multiple queries; queries are analyzed and searched together
+        (see :func:`Retrieval.retrieve_batch <nordlys.core.retrieval.retrieval.Retrieval.retrieve_batch>`).
+
+        :param queries: dictionary {query_id: query}
+        :param retrieval: Retrieval object (to be reused across batches)
+        :return: dictionary {query_id: types}
+        """
+        if not self.__set_tc_model():
+            return {query_id: dict() for query_id in queries}
+        retrieval = retrieval if retrieval else Retrieval(self.__tc_config)
+        return retrieval.retrieve_batch(queries)
+
     def identify(self, query):
         """Performs target type identification for the query.
 
@@ -210,22 +251,30 @@ class TTI(object):
         :type query: str
         :return: annotated query
         """
+        if self.__result_cache is not None:
+            params = self.CACHE_PARAMS + (["num_docs"] if self.__method == TTI_METHOD_EC else [])
+            key = self.__result_cache.get_key("tti", query, self.__config, params)
+            types = self.__result_cache.get_or_set(key, self.__get_types, query)
+        else:
+            types = self.__get_types(query)
+        return self.__format_types(query, types)
+
+    def __get_types(self, query):
+        """Returns all types (with scores) identified for the query."""
         # obtains types according to requested method
         method = self.__config.get("method", None)
         if method == TTI_METHOD_EC:  # Entity-centric TTI
-            types = self.__entity_centric(query)
+            return self.__entity_centric(query)
         else:  # default Type-centric TTI
-            types = self.__type_centric(query)
+            return self.__type_centric(query)
 
+    def __format_types(self, query, types):
+        """Sorts the types and converts them to the output format."""
         # sorts types
         sorted_types = dict()
-        i = 0
-        for type_id, en in sorted(types.items(), key=lambda item: item[1]["score"], reverse=True):
-            rank = i + self.__start
-            sorted_types[rank] = {"type": type_id, "score": en["score"]}
-            i += 1
-            if i == self.__num_docs:
-                break
+        ranked = rank(types, num=self.__num_docs, start=self.__start, score_func=lambda t: t["score"])
+        for i, (type_id, t) in enumerate(ranked, self.__start):
+            sorted_types[i] = {"type": type_id, "score": t["score"]}
 
         # converts to output format
         res = {"query": query,
@@ -233,6 +282,32 @@ class TTI(object):
 
         return res
 
+    def __identify_batch(self, queries):
+        """Performs target type identification for all queries.
+        For type-centric TTI, queries are processed in batches of query_batch_size.
+
+        :param queries: dictionary {query_id: query}
+        :return: dictionary {query_id: annotated query}
+        """
+        query_ids = sorted(queries)
+        if self.__method == TTI_METHOD_EC:
+            results = dict()
+            for query_id in query_ids:
+                PLOGGER.info("Identifying target types for [{}] {}".format(query_id, queries[query_id]))
+                results[query_id] = self.identify(queries[query_id])
+            return results
+
+        results = dict()
+        retrieval = Retrieval(self.__tc_config) if self.__set_tc_model() else None
+        batch_size = self.__config["query_batch_size"]
+        for i in range(0, len(query_ids), batch_size):
+            batch = {query_id: queries[query_id] for query_id in query_ids[i:i + batch_size]}
+            PLOGGER.info("Identifying target types for queries {} - {}".format(query_ids[i], max(batch)))
+            types = self.__type_centric_batch(batch, retrieval)
+            for query_id in sorted(batch):
+                results[query_id] = self.__format_types(queries[query_id], types[query_id])
+        return results
+
     def batch_identification(self):
         """Annotates, in a batch, queries with identified target types, and outputs results."""
         queries = json.load(FileUtils.open_file_by_type(self.__query_file))
@@ -241,11 +316,8 @@ class TTI(object):
         if "trec_output_file" in self.__config:  # for TREC-formatted outputting
             f_trec_out = FileUtils.open_file_by_type(self.__config["trec_output_file"], mode="w")
 
-        results = dict()
+        results = self.__identify_batch(queries)
         for query_id in sorted(queries):
-            PLOGGER.info("Identifying target types for [{}] {}".format(query_id, queries[query_id]))
-            results[query_id] = self.identify(queries[query_id])
-
             # Output resulting scores in TREC format if required
             if f_trec_out:
                 type_to_score = dict()